@@ -1,9 +1,11 @@
 import pygame
+from settings import *
+from ui import Font
 
 pygame.font.init()
 
 class Text():
-    def __init__(self, screen = None, text = '', size = 24, color = (0,0,0), pos = (0, 0), fontname = 'oop/font/slkscr.ttf'):
+    def __init__(self, screen = None, text = '', size = 24, color = (0,0,0), pos = (0, 0), fontname = FONT_PATH):
         self.screen = screen # no longer
         self.pos = pos # no longer
         self.text = text
@@ -12,7 +14,7 @@ class Text():
         self.color = color
     def change_size(self,size):
         self.size = size
-        self.font = pygame.font.Font(self.fontname,size)
+        self.font = Font.get_font(size, self.fontname)
     def draw(self, pos = None, screen = None):
         if (screen==None):
             screen = self.screen
@@ -20,7 +22,7 @@ class Text():
             screen = pygame.display.get_surface()
         if (pos==None):
             pos = self.pos 
-        text_surface = self.font.render(self.text, False, self.color)
+        text_surface = Font.render(self.text, self.size, self.color, False, self.fontname)
         self.screen.blit(text_surface,pos)
 
 class Button():
@@ -0,0 +1,299 @@
+"""
+Headless benchmarks, run from the folder that contains the game folder (like game.py):
+    python oop/benchmark.py ordering
+    python oop/benchmark.py shots
+    python oop/benchmark.py particles
+    python oop/benchmark.py loop
+    python oop/benchmark.py replay path='fight.rec'
+options of a benchmark follow its name as key=value:
+    python oop/benchmark.py loop level=1 zombies=0,200 frames=600
+    python oop/benchmark.py loop zombies=100 trace='trace.json'
+"""
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+import sys
+import time
+import random
+from random import Random
+from collections import deque
+from ast import literal_eval
+import pygame
+import numpy as np
+from settings import *
+import system
+from controls import ScriptedInput
+
+def init_headless():
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+    system.screen = pygame.Surface((SCREEN_WIDTH,SCREEN_HEIGHT))
+    system.controls = ScriptedInput()
+    system.play_music = False
+    system.go_to_level = lambda level = None: None
+
+def timeit(func, frames):
+    "average ms per call"
+    start = time.perf_counter()
+    for _ in range(frames):
+        func()
+    return (time.perf_counter()-start)/frames*1000
+
+def bench_ordering(counts = (1000, 10000, 50000), dynamic_ratio = 0.1, frames = 20):
+    """full y-sort of the group vs RenderOrder, most sprites are static tiles
+    and the dynamic ones move every frame"""
+    from level import YSortCameraGroup, render_key
+    from tile import Tile
+
+    rng = Random(0)
+    image = pygame.Surface((TILESIZE,TILESIZE))
+    print(f'{"sprites":>8} {"sorted ms":>10} {"order ms":>10} {"in view ms":>11}')
+    for count in counts:
+        group = YSortCameraGroup()
+        side = int((count*(1-dynamic_ratio))**0.5)+1
+        dynamic = []
+        for i in range(count):
+            if (i<count*dynamic_ratio):
+                sprite = pygame.sprite.Sprite(group)
+                sprite.image = image
+                sprite.rect = image.get_rect(topleft = (rng.uniform(0,side*TILESIZE),rng.uniform(0,side*TILESIZE)))
+                sprite.zindex = 1
+                dynamic.append(sprite)
+            else:
+                pos = (rng.randrange(side)*TILESIZE, rng.randrange(side)*TILESIZE)
+                Tile(pos,[group],image,rng.randrange(3))
+
+        def move():
+            for sprite in dynamic:
+                sprite.rect.y += rng.randint(-3,3)
+
+        def legacy():
+            move()
+            for sprite in sorted(group.sprites(),key = lambda sprite: sprite.zindex*10**9+sprite.rect.centery): pass
+
+        def ordered():
+            move()
+            for sprite in group.render_order.ordered(): pass
+
+        def ordered_in_view():
+            move()
+            for sprite in group.render_order.ordered(0, SCREEN_HEIGHT): pass
+
+        ordered() #classify the new sprites
+        print(f'{count:>8} {timeit(legacy, frames):>10.2f} {timeit(ordered, frames):>10.2f} {timeit(ordered_in_view, frames):>11.2f}')
+
+def bench_shots(shots = 2000, flying = 100):
+    """projectiles created per second by each weapon at random angles, the oldest is killed past flying projectiles
+    (pooled classes reuse it, allocated counts the new ones), the legacy column is the PNG decode + rotate every shot used to pay"""
+    from player import Player
+    from grid import ObstacleGroup
+    from weapon import Gun, FlameThrower, MissileLaucher
+    from bullet import Bullet, FlameBullet, Missile, reclaim_projectiles
+
+    rng = Random(0)
+    player = Player((0,0), [], ObstacleGroup())
+    weapons = [(Gun, 'ak47', Bullet), (Gun, 'bluetagon', Bullet),
+        (FlameThrower, 'flamethrower', FlameBullet), (MissileLaucher, 'missile_laucher', Missile)]
+    print(f'{"weapon":>16} {"shots/s":>10} {"allocated":>10} {"legacy load+rotate/s":>21}')
+    for weapon_cls, name, bullet_cls in weapons:
+        weapon = weapon_cls(player, [], name)
+        group = pygame.sprite.Group()
+        bullet_path = weapon.path + 'bullet/0.png'
+        pool = getattr(bullet_cls, 'pool', None)
+        allocated = pool.allocated if pool!=None else 0
+        live = deque()
+
+        def shoot():
+            weapon.target = weapon.angle = rng.uniform(0,360)
+            if (pool!=None): live.append(pool.acquire([group], weapon, ObstacleGroup()))
+            else: live.append(bullet_cls([group], weapon, ObstacleGroup()))
+            if (len(live)>flying):
+                #a missile explodes when killed
+                if (pool!=None): live.popleft().kill()
+                else: group.remove(live.popleft())
+
+        def legacy():
+            pygame.transform.rotate(pygame.image.load(bullet_path).convert_alpha(), rng.uniform(0,360))
+
+        shoot_ms = timeit(shoot, shots)
+        legacy_ms = timeit(legacy, shots)
+        if (pool!=None): allocated = pool.allocated-allocated
+        else: allocated = shots
+        reclaim_projectiles()
+        group.empty()
+        print(f'{name:>16} {1000/shoot_ms:>10.0f} {allocated:>10} {1000/legacy_ms:>21.0f}')
+
+def bench_particles(counts = (1000, 10000, 50000), frames = 50):
+    """ms per frame to advance and draw count blood particles spread over the screen,
+    one Particle sprite each in the camera group (legacy) vs a ParticleEmitter"""
+    from level import YSortCameraGroup
+    from particle import Particle, ParticleEmitter
+
+    class LegacyBlood(Particle):
+        path = PATH + 'graphics/particle/blood/'
+
+    rng = Random(0)
+    #every particle lives through the frames
+    system.delta_time = 0.001
+    print(f'{"particles":>10} {"sprites ms":>11} {"emitter ms":>11}')
+    for count in counts:
+        positions = [(rng.uniform(0,SCREEN_WIDTH), rng.uniform(0,SCREEN_HEIGHT)) for _ in range(count)]
+        player = pygame.sprite.Sprite()
+        player.rect = pygame.Rect(SCREEN_WIDTH//2, SCREEN_HEIGHT//2, 0, 0)
+        group = YSortCameraGroup()
+        group.pos.update(player.rect.center)
+        group.previous_pos.update(player.rect.center)
+        for pos in positions:
+            LegacyBlood([group], pos)
+
+        def legacy():
+            group.update()
+            group.custom_draw(player)
+
+        emitter_group = YSortCameraGroup()
+        emitter_group.pos.update(player.rect.center)
+        emitter_group.previous_pos.update(player.rect.center)
+        emitter = ParticleEmitter(PATH + 'graphics/particle/blood/', capacity = count)
+        emitter_group.batch_providers.append(emitter)
+        for pos in positions:
+            emitter.emit(pos)
+
+        def batched():
+            emitter.update()
+            emitter_group.custom_draw(player)
+
+        print(f'{count:>10} {timeit(legacy, frames):>11.2f} {timeit(batched, frames):>11.2f}')
+
+LOOP_PHASES = ['frame', 'draw', 'update', 'horde', 'lighting', 'ui', 'transitions']
+#held in turn by the scripted player, 90 frames each
+WALK_KEYS = [pygame.K_d, pygame.K_s, pygame.K_a, pygame.K_w]
+
+def spawn_zombies(level, count, rng):
+    "count zombies on the free tiles reachable from the player"
+    from enemy import Zombie
+    level.flow_field.update(level.player.hitbox.center)
+    cells = sorted(level.flow_field.distance_map)
+    for _ in range(count):
+        col, row = rng.choice(cells)
+        pos = (col*TILESIZE, row*TILESIZE)
+        if (level.horde!=None): enemy = level.horde.spawn(Zombie, pos)
+        else: enemy = Zombie(pos, [level.visible_sprites], level.obstacle_sprites, level.player)
+        level.enemies.append(enemy)
+
+def scripted_frame(level, frame, slot):
+    "input of a frame: walk around, aim in a circle, select the slot and keep firing it"
+    held = [WALK_KEYS[frame//90%len(WALK_KEYS)]]
+    weapon = level.player.current_weapon
+    if (slot>=0 and level.player.current_primary!=slot): held.append(pygame.K_1+slot)
+    if (weapon!=None):
+        weapon.total_ammo = max(weapon.total_ammo, weapon.clip_max_ammo) #never runs dry
+        if (weapon.clip_ammo==0): held.append(pygame.K_r)
+    angle = frame*0.05
+    pos = (SCREEN_WIDTH/2+200*np.cos(angle), SCREEN_HEIGHT/2+200*np.sin(angle))
+    system.controls.set(held, pos, (slot>=0, False, False))
+
+def run_loop(level_cls, zombies, slot, frames):
+    "ms per frame of each phase (LOOP_PHASES) over frames of Level.update"
+    random.seed(0)
+    np.random.seed(0)
+    system.time = 0
+    system.delta_time = 1/FPS
+    system.controls.set()
+    level = level_cls()
+    #nobody dies, every frame is a playing frame
+    level.player.max_health = level.player.health = 10**9
+    spawn_zombies(level, zombies, Random(0))
+    times = {phase: [] for phase in LOOP_PHASES}
+    for frame in range(frames):
+        scripted_frame(level, frame, slot)
+        system.screen.fill('black')
+        system.profiler.begin_frame()
+        start = time.perf_counter()
+        level.update()
+        times['frame'].append(time.perf_counter()-start)
+        system.profiler.end_frame()
+        for phase, seconds in level.phase_times.items():
+            times[phase].append(seconds)
+        system.time += system.delta_time
+    return {phase: np.array(values)*1000 for phase, values in times.items()}
+
+def bench_loop(level = 0, zombies = (0, 100, 500), fire_zombies = 50, frames = 300, trace = None):
+    """frame time percentiles of a level run by scripted input, with fixed delta time and seeds,
+    scenarios: zombie counts without firing, then continuous firing of each weapon,
+    trace: path of a Chrome trace of the frames (profiler.py), the timing adds some overhead"""
+    from level import Level00, Level01
+    level_cls = [Level00, Level01][level]
+    if (isinstance(zombies, int)): zombies = (zombies,)
+    player_level = level_cls()
+    weapon_slots = [(slot, item.weapon.name) for slot, item in enumerate(player_level.player.inventory)
+        if hasattr(item, 'weapon')]
+    scenarios = [(f'zombies={count}', count, -1) for count in zombies]
+    scenarios += [(f'fire {name}', fire_zombies, slot) for slot, name in weapon_slots]
+    system.profiler.enabled = trace!=None
+
+    sheet = player_level.sprite_sheet_stats
+    print(f'{level_cls.__name__} map: {sheet["requests"]} tile requests, {sheet["unique"]} unique frames')
+    print(f'{level_cls.__name__}, {frames} frames, ms')
+    print(f'{"scenario":>24} {"phase":>11} {"p50":>7} {"p95":>7} {"p99":>7}')
+    for name, count, slot in scenarios:
+        times = run_loop(level_cls, count, slot, frames)
+        for i, phase in enumerate(LOOP_PHASES):
+            p50, p95, p99 = np.percentile(times[phase], [50, 95, 99])
+            print(f'{name if i==0 else "":>24} {phase:>11} {p50:>7.2f} {p95:>7.2f} {p99:>7.2f}')
+        #the scaled image cache of the level run_loop built
+        cache = system.level.visible_sprites.scaled_cache.stats()
+        print(f'{"":>24} scaled cache: {cache["hits"]} hits, {cache["misses"]} misses, {cache["entries"]} entries, '
+            f'{cache["bytes"]/2**20:.1f} MB, {cache["evictions"]} evictions')
+    if (trace!=None): system.profiler.export(trace)
+
+def bench_replay(path = 'recordings', trace = None):
+    """frame time percentiles of recorded runs (python oop/game.py record=fight.rec),
+    path: a recording or a folder of them (*.rec), each is checked to end in the recorded state"""
+    from replay import Recording, Replay
+    paths = [path]
+    if (os.path.isdir(path)): paths = sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.rec'))
+    paths = [recording_path for recording_path in paths if os.path.isfile(recording_path)]
+    if (not paths):
+        print(f'no recording at {path}, skipped (record one with python oop/game.py record=fight.rec)')
+        return
+    system.profiler.enabled = trace!=None
+    print(f'{"recording":>24} {"frames":>7} {"p50":>7} {"p95":>7} {"p99":>7} {"total s":>8} {"state":>9}')
+    for recording_path in paths:
+        recording = Recording.load(recording_path)
+        replay = Replay(recording)
+        start = time.perf_counter()
+        digest = replay.run()
+        total = time.perf_counter()-start
+        p50, p95, p99 = np.percentile(np.array(replay.frame_times)*1000, [50, 95, 99])
+        state = 'unknown' if recording.digest==None else ('same' if digest==recording.digest else 'DIFFERENT')
+        name = os.path.basename(recording_path)
+        print(f'{name:>24} {len(replay.frame_times):>7} {p50:>7.2f} {p95:>7.2f} {p99:>7.2f} {total:>8.2f} {state:>9}')
+    if (trace!=None): system.profiler.export(trace)
+
+BENCHMARKS = {
+    'ordering': bench_ordering,
+    'shots': bench_shots,
+    'particles': bench_particles,
+    'loop': bench_loop,
+    'replay': bench_replay,
+}
+
+def parse_args(args):
+    "[name key=value ...] -> [(name, options)]"
+    runs = []
+    for arg in args:
+        if ('=' not in arg):
+            runs.append((arg, {}))
+            continue
+        key, value = arg.split('=', 1)
+        try: value = literal_eval(value)
+        except (ValueError, SyntaxError): pass
+        runs[-1][1][key] = value
+    return runs
+
+if __name__ == '__main__':
+    init_headless()
+    runs = parse_args(sys.argv[1:]) or [(name, {}) for name in BENCHMARKS]
+    for name, options in runs:
+        print(f'== {name}')
+        BENCHMARKS[name](**options)
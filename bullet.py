@@ -6,7 +6,76 @@ from random import uniform
 import file
 from particle import Particle
 
-class BulletLine(pygame.sprite.Sprite):
+class ProjectilePool():
+    """
+    Keeps the killed sprites of a projectile class and resets them for the next shots,
+    instead of allocating new sprites (and surfaces) every shot and leaving the old ones to the garbage collector.
+
+    Attributes:
+        cls (type): Pooled class, cls.reset(*args) sets up a used sprite like cls(*args) does a new one.
+        max_size (int): Killed sprites kept at most, the ones beyond are dropped.
+        free (list): Killed sprites waiting to be reused.
+        live (set): Sprites handed out by acquire() and not killed yet.
+        allocated (int): Number of sprites the pool created.
+
+    Methods:
+        acquire(*args): Returns a reset free sprite, or a new one when none is free.
+        release(sprite): Takes back a killed sprite (called by PooledSprite.kill()).
+        reclaim(): Kills the live sprites, left in the groups of a finished level, and clears the free ones.
+        counters(): Returns the number of live, pooled and allocated sprites.
+    """
+    def __init__(self, cls, max_size = PROJECTILE_POOL_SIZE):
+        self.cls = cls
+        self.max_size = max_size
+        self.free = []
+        self.live = set()
+        self.allocated = 0
+
+    def acquire(self, *args):
+        if (self.free):
+            sprite = self.free.pop()
+            sprite.reset(*args)
+        else:
+            sprite = self.cls(*args)
+            self.allocated += 1
+        self.live.add(sprite)
+        return sprite
+
+    def release(self, sprite):
+        #killed twice or not from the pool (created directly)
+        if (sprite not in self.live): return
+        self.live.remove(sprite)
+        if (len(self.free)<self.max_size): self.free.append(sprite)
+
+    def reclaim(self):
+        for sprite in list(self.live):
+            sprite.kill()
+        #free sprites must not keep the finished level alive
+        for sprite in self.free:
+            sprite.clear()
+
+    def counters(self):
+        return {'live': len(self.live), 'pooled': len(self.free), 'allocated': self.allocated}
+
+class PooledSprite(pygame.sprite.Sprite):
+    """
+    Sprite that goes back to the pool of its class when killed.
+    A subclass sets pool (ProjectilePool) and sets up all of its state in reset(), called by __init__ and the pool.
+
+    Methods:
+        kill(): Removes the sprite from its groups and releases it to its pool.
+        clear(): Drops the references to the level, reset() sets them up again.
+    """
+    pool = None
+
+    def kill(self):
+        super().kill()
+        self.pool.release(self)
+
+    def clear(self):
+        pass
+
+class BulletLine(PooledSprite):
     """
     Represents a line showing the trajectory of a bullet.
 
@@ -15,7 +84,9 @@ class BulletLine(pygame.sprite.Sprite):
         default_alpha: The default alpha value of the line.
         min_alpha: The minimum alpha value of the line.
         current_alpha: The current alpha value of the line.
-        bullet: The bullet associated with the line.
+        bullet: The bullet associated with the line, None once the bullet is killed.
+        end: The last position of the bullet.
+        angle: The last angle of the bullet.
         zindex: The z-index of the line.
         original_image: The original image of the line.
         image: The image of the line.
@@ -24,38 +95,59 @@ class BulletLine(pygame.sprite.Sprite):
         time_self_destroy: The time until the line self-destructs.
 
     Methods:
+        reset(groups, bullet, zindex=0): Sets up the line of a new bullet.
+        release_bullet(): Keeps the last position of the bullet, which goes back to its pool.
+        clear(): Forgets the bullet.
         update(): Updates the trajectory line.
     """
     def __init__(self, groups, bullet, zindex = 0):
-        super().__init__(groups)
-        
+        super().__init__()
+        self.original_image = pygame.Surface((1,8), pygame.SRCALPHA)
+        self.barrel_pos = pygame.math.Vector2()
+        self.reset(groups, bullet, zindex)
+
+    def reset(self, groups, bullet, zindex = 0):
         self.fade_time = 2
         self.default_alpha = 100
         self.min_alpha = 40
         self.current_alpha = self.default_alpha
         self.bullet = bullet
+        self.end = bullet.rect.center
+        self.angle = bullet.angle
         self.zindex = 1
-        self.original_image = pygame.Surface((1,8), pygame.SRCALPHA)
         self.original_image.fill(self.bullet.weapon.bullet_line_color)
         self.image = self.original_image
         self.rect = self.image.get_rect()
-        self.barrel_pos = pygame.math.Vector2(bullet.rect.center) #bullet init state
+        self.barrel_pos.update(bullet.rect.center) #bullet init state
         self.time_self_destroy = 1.2
+        self.add(groups)
+
+    def release_bullet(self):
+        self.end = self.bullet.rect.center
+        self.angle = self.bullet.angle
+        self.bullet = None
+
+    def clear(self):
+        self.bullet = None
 
     def update(self):
+        if (self.bullet!=None):
+            self.end = self.bullet.rect.center
+            self.angle = self.bullet.angle
+
         #rotate and scale
-        length_line = (self.bullet.rect.center-self.barrel_pos).magnitude()
+        length_line = (self.end-self.barrel_pos).magnitude()
         self.image = pygame.transform.scale(self.original_image,(length_line,self.original_image.get_size()[1]))
-        self.image = pygame.transform.rotate(self.image,-self.bullet.angle)
-        
+        self.image = pygame.transform.rotate(self.image,-self.angle)
+
         #calc alpha
         self.current_alpha -= system.delta_time/self.fade_time*(self.default_alpha-self.min_alpha)
         if (self.current_alpha<self.min_alpha): self.current_alpha = self.min_alpha
         self.image.set_alpha(self.current_alpha)
-        
+
         #update position
         self.rect = self.image.get_rect()
-        self.rect.center = (self.barrel_pos+self.bullet.rect.center)/2
+        self.rect.center = (self.barrel_pos+self.end)/2
 
         self.time_self_destroy -= system.delta_time
         if (self.time_self_destroy<=0):
@@ -83,13 +175,16 @@ class BaseBullet(pygame.sprite.Sprite):
         dealing_damage_current_cooldown: The current cooldown time for dealing damage.
 
     Methods:
+        reset(groups, weapon, obstacles, zindex=0): Sets up the bullet of a new shot.
         move(): Moves the bullet.
         check_collision(): Checks for collisions with obstacles and enemies.
         update(): Updates the bullet's state.
     """
     def __init__(self, groups, weapon, obstacles, zindex = 0):
-        super().__init__(groups)
+        super().__init__()
+        self.reset(groups, weapon, obstacles, zindex)
 
+    def reset(self, groups, weapon, obstacles, zindex = 0):
         self.time_self_destroy = weapon.bullet_lifetime
         self.current_time_self_destroy = self.time_self_destroy
         self.speed = weapon.bullet_velocity
@@ -99,9 +194,8 @@ class BaseBullet(pygame.sprite.Sprite):
         self.obstacles = obstacles
         self.direction = pygame.math.Vector2(1,0).rotate(weapon.target)
         self.path = weapon.path + 'bullet/'
-        sprite_path = self.path + '0.png'
-        self.original_image = pygame.image.load(sprite_path).convert_alpha()
-        self.image = self.original_image 
+        self.original_image = weapon.bullet_image
+        self.image = self.original_image
         dbarrel = weapon.center_to_barrel_rotated
         barrel_pos = weapon.rect.center + dbarrel
         self.rect = self.original_image.get_rect(center=barrel_pos)
@@ -117,6 +211,7 @@ class BaseBullet(pygame.sprite.Sprite):
 
         self.dealing_damage_cooldown = 0.5
         self.dealing_damage_current_cooldown = 0
+        self.add(groups)
 
     @property
     def angle(self): #in degree, world coor
@@ -125,7 +220,7 @@ class BaseBullet(pygame.sprite.Sprite):
     @angle.setter
     def angle(self, angle): #in degree, world coor
         self.direction = pygame.math.Vector2(1,0).rotate(angle)
-        self.image = pygame.transform.rotate(self.original_image,-angle) #is on screen
+        self.image = self.weapon.get_bullet_image(angle) #cached per angle bucket
         self.rotated_image = self.image
         self.rect = self.image.get_rect(center = self.rect.center)
 
@@ -134,83 +229,91 @@ class BaseBullet(pygame.sprite.Sprite):
         self.hitbox.center = self.rect.center
 
     def check_collision(self):
-        for sprite in self.obstacles:
-            if not self.hitbox.colliderect(sprite.rect): continue
+        if (self.obstacles.collide_rect(self.hitbox)):
             self.kill()
-        
+
         self.dealing_damage_current_cooldown -= system.delta_time
         self.dealing_damage_current_cooldown = max(self.dealing_damage_current_cooldown,0)
-        for target in system.level.enemies:
-            if (not self.hitbox.colliderect(target.hitbox)): continue
+        for target in system.level.enemy_index.query(self.hitbox):
             if (self.dealing_damage_current_cooldown > 0): continue
             if (target.is_dead): continue
             target.get_damage(self.weapon.damage)
             self.dealing_damage_current_cooldown = self.dealing_damage_cooldown
 
     def update(self):
-        self.move()        
+        self.move()
         self.check_collision()
         self.current_time_self_destroy -= system.delta_time
         if (self.current_time_self_destroy<=0):
             self.kill()
 
-class Bullet(BaseBullet):
+class Bullet(PooledSprite, BaseBullet):
     """
     Represents a bullet projectile.
 
+    Attributes:
+        bullet_line: The trajectory line of the bullet.
+
     Methods:
         check_collision(): Checks for collisions with enemies.
+        kill(): Leaves the line at the last position and goes back to the pool.
+        clear(): Forgets the weapon, the obstacles and the line.
     """
-    def __init__(self, groups, weapon, obstacles, zindex = 0):
-        super().__init__(groups, weapon, obstacles, zindex)
-        self.bullet_line = BulletLine(groups, self)
+    def reset(self, groups, weapon, obstacles, zindex = 0):
+        super().reset(groups, weapon, obstacles, zindex)
+        self.bullet_line = BulletLine.pool.acquire(groups, self)
         self.hitbox = pygame.rect.Rect((0,0),(14,8))
         self.hitbox.center = self.rect.center
 
     def check_collision(self):
-        for target in system.level.enemies:
-            if (not self.hitbox.colliderect(target.hitbox)): continue
+        for target in system.level.enemy_index.query(self.hitbox):
             if (self.dealing_damage_current_cooldown > 0): continue
             if (target.is_dead): continue
             target.bleed(self.rect.center)
             self.kill()
         super().check_collision()
 
-class FlameBullet(BaseBullet):
+    def kill(self):
+        #the line may outlive the bullet, or already be the line of a newer bullet
+        if (self.bullet_line.bullet is self): self.bullet_line.release_bullet()
+        super().kill()
+
+    def clear(self):
+        self.weapon = None
+        self.obstacles = None
+        self.bullet_line = None
+
+class FlameBullet(PooledSprite, BaseBullet):
     """
     Represents a flame projectile.
 
     Attributes:
         flame_pos_std: The standard deviation of flame position.
+        flamesmoke: The smoke of the flame.
 
     Methods:
         update_flame_size(): Updates the size of the flame.
+        clear(): Forgets the weapon, the obstacles and the smoke.
     """
-    def __init__(self, groups, weapon, obstacles, zindex = 0):
+    def reset(self, groups, weapon, obstacles, zindex = 0):
         weapon.stability = weapon.max_stability
-        super().__init__(groups, weapon, obstacles, zindex)
+        super().reset(groups, weapon, obstacles, zindex)
         #slow down or speed up depend on player move
         coef = weapon.player.direction.dot(self.direction)*2
         self.speed += weapon.player.current_speed*coef
         self.dealing_damage_cooldown = 0.1
         self.flame_pos_std = 20
-        
+
         #self.angle = self.angle IS SO WEIRDDDDDDDDD
         self.update_flame_size()
-        self.flamesmoke = FlameSmoke(groups, self, obstacles, zindex)
+        self.flamesmoke = FlameSmoke.pool.acquire(groups, self, obstacles, zindex)
 
         self.hitbox = pygame.rect.Rect(self.rect)
 
     def update_flame_size(self):
-        #update color (aka more black)
-        current_image = self.rotated_image.copy()
-        colored_image = pygame.Surface(current_image.get_size(),pygame.SRCALPHA)
-        color_add = max(self.current_time_self_destroy/self.time_self_destroy,0)*120
-        colored_image.fill((color_add,color_add,color_add,0))
-        current_image.blit(colored_image, (0,0), special_flags = pygame.BLEND_RGBA_ADD)
-        #now update size (diff with smoke)
+        #size and color (aka more black) of the lifetime left, baked by the weapon
         len_side = self.weapon.bullet_start_size+(self.weapon.bullet_end_size-self.weapon.bullet_start_size)*(1-self.current_time_self_destroy/self.time_self_destroy)
-        self.image = pygame.transform.scale(current_image,(len_side,len_side))
+        self.image = self.weapon.flame_frames[int(len_side)]
         self.rect = self.image.get_rect(center = self.rect.center)
 
     def move(self):
@@ -218,8 +321,7 @@ class FlameBullet(BaseBullet):
         super().move()
 
     def check_collision(self):
-        for target in system.level.enemies:
-            if (not self.hitbox.colliderect(target.hitbox)): continue
+        for target in system.level.enemy_index.query(self.hitbox):
             if (self.dealing_damage_current_cooldown > 0): continue
             pos = pygame.math.Vector2(self.rect.center)
             pos += pygame.math.Vector2(uniform(-self.flame_pos_std,self.flame_pos_std),uniform(-self.flame_pos_std,self.flame_pos_std))
@@ -230,57 +332,65 @@ class FlameBullet(BaseBullet):
 
     def update(self):
         super().update()
+        #killed, back in the pool
+        if (not self.alive()): return
         self.update_flame_size()
 
-class FlameSmoke(pygame.sprite.Sprite):
+    def clear(self):
+        self.weapon = None
+        self.obstacles = None
+        self.flamesmoke = None
+
+class FlameSmoke(PooledSprite):
     """
     Represents the smoke produced by a flame projectile.
 
     Attributes:
-        bullet: The flame bullet associated with the smoke.
+        weapon: The weapon that fired the flame.
+        direction: The direction of the flame.
 
     Methods:
+        reset(groups, bullet, obstacles, zindex=0): Sets up the smoke of a new flame.
         update_flamesmoke(): Updates the size and alpha of the smoke.
+        clear(): Forgets the weapon, the direction and the obstacles.
     """
-
     def __init__(self, groups, bullet, obstacles, zindex = 0):
-        super().__init__(groups)
+        super().__init__()
+        self.reset(groups, bullet, obstacles, zindex)
+
+    def reset(self, groups, bullet, obstacles, zindex = 0):
+        #the flame may be killed and reused before the smoke fades, keep what is needed of it
         self.zindex = zindex-0.25
-        self.bullet = bullet
+        self.weapon = bullet.weapon
+        self.direction = bullet.direction
         self.obstacles = obstacles
-        self.time_self_destroy = bullet.weapon.flamesmoke_lifetime
+        self.time_self_destroy = self.weapon.flamesmoke_lifetime
         self.current_time_self_destroy = self.time_self_destroy
-        self.path = self.bullet.weapon.path + 'flamesmoke/'
-        sprite_path = self.path + '0.png'
-        self.orginal_image = pygame.image.load(sprite_path).convert_alpha()
+        self.path = self.weapon.path + 'flamesmoke/'
+        self.orginal_image = self.weapon.flamesmoke_image #shared, alpha already set
         self.image = self.orginal_image
-        self.image.set_alpha(bullet.weapon.flamesmoke_start_alpha)
         self.rect = self.image.get_rect(center=bullet.rect.center)
-        coef = bullet.weapon.player.direction.dot(bullet.direction)*2
-        self.speed = bullet.weapon.flamesmoke_velocity
-        self.speed += bullet.weapon.player.current_speed*coef
+        coef = self.weapon.player.direction.dot(self.direction)*2
+        self.speed = self.weapon.flamesmoke_velocity
+        self.speed += self.weapon.player.current_speed*coef
+        self.add(groups)
         # self.angle = self.bullet.angle #VAN SUS LA SAOOOOO
         # self.direction = pygame.math.Vector2(1,0).rotate(self.angle)
 
     def update_flamesmoke(self):
-        #update size
-        len_side = self.bullet.weapon.flamesmoke_start_size+(self.bullet.weapon.flamesmoke_end_size-self.bullet.weapon.flamesmoke_start_size)*(1-self.current_time_self_destroy/self.time_self_destroy)
-        self.image = pygame.transform.scale(self.orginal_image,(len_side,len_side))
+        #size and color (aka alpha) of the lifetime left, baked by the weapon
+        weapon = self.weapon
+        len_side = weapon.flamesmoke_start_size+(weapon.flamesmoke_end_size-weapon.flamesmoke_start_size)*(1-self.current_time_self_destroy/self.time_self_destroy)
+        self.image = weapon.flamesmoke_frames[int(len_side)]
         self.rect = self.image.get_rect(center = self.rect.center)
-        
-        #update color (aka alpha)
-        weapon = self.bullet.weapon
-        current_alpha = max((weapon.flamesmoke_end_alpha-weapon.flamesmoke_start_alpha)*self.current_time_self_destroy/self.time_self_destroy+weapon.flamesmoke_start_alpha,0)
-        self.image.set_alpha(current_alpha)
 
     def move(self):
         #update speed
-        self.speed *= exp2(-system.delta_time/self.bullet.weapon.flamesmoke_velocity_decay_halflife)
-        self.rect.center += self.bullet.direction*self.speed*system.delta_time
-    
+        self.speed *= exp2(-system.delta_time/self.weapon.flamesmoke_velocity_decay_halflife)
+        self.rect.center += self.direction*self.speed*system.delta_time
+
     def check_collision(self):
-        for sprite in self.obstacles:
-            if not self.rect.colliderect(sprite.rect): continue
+        if (self.obstacles.collide_rect(self.rect)):
             self.kill()
 
     def update(self):
@@ -291,6 +401,11 @@ class FlameSmoke(pygame.sprite.Sprite):
         if (self.current_time_self_destroy<=0):
             self.kill()
 
+    def clear(self):
+        self.weapon = None
+        self.direction = None
+        self.obstacles = None
+
 class Missile(BaseBullet):
     """
     Represents a missile projectile.
@@ -314,12 +429,10 @@ class Missile(BaseBullet):
         super().kill()
 
     def check_collision(self):
-        for sprite in self.obstacles:
-            if not self.hitbox.colliderect(sprite.rect): continue
+        if (self.obstacles.collide_rect(self.hitbox)):
             self.kill()
 
-        for target in system.level.enemies:
-            if (not self.hitbox.colliderect(target.hitbox)): continue
+        for target in system.level.enemy_index.query(self.hitbox):
             if (target.is_dead): return
             self.kill()
 
@@ -332,6 +445,7 @@ class Explode(Particle):
         damage: The damage caused by the explosion.
 
     Methods:
+        update(): Lights the area around the explosion, then animates it.
         explode(): Deals damage to enemies within the explosion area.
     """
     def __init__(self, groups, pos, path, damage, zindex = 0):
@@ -347,8 +461,21 @@ class Explode(Particle):
         self.hitbox.center = self.rect.center
         self.explode()
 
+    def update(self):
+        system.level.lighting.add(self.rect.center, EXPLOSION_LIGHT_SIZE)
+        super().update()
+
     def explode(self):
-        enemies = system.level.enemies
-        for target in enemies:
-            if (not self.hitbox.colliderect(target.hitbox)): continue
+        for target in system.level.enemy_index.query(self.hitbox):
             target.get_damage(self.damage)
+
+#one pool per pooled class, sized by PROJECTILE_POOL_SIZE
+BulletLine.pool = ProjectilePool(BulletLine)
+Bullet.pool = ProjectilePool(Bullet)
+FlameBullet.pool = ProjectilePool(FlameBullet)
+FlameSmoke.pool = ProjectilePool(FlameSmoke)
+
+def reclaim_projectiles():
+    "returns the projectiles still flying in a finished level to their pools"
+    for cls in [Bullet, FlameBullet, BulletLine, FlameSmoke]:
+        cls.pool.reclaim()
@@ -0,0 +1,23 @@
+"""
+Offline level compiler, packs the csv layers of every level room into one
+memory-mapped file (file.COMPILED_LEVEL) that Level.create_map loads instead of the csv.
+Run from the folder that contains the game folder (like game.py), again after editing a map:
+    python oop/compile_levels.py [level ...]
+"""
+import sys
+from os import listdir, path
+from settings import *
+import file
+
+def compile_levels(levels = None):
+    levels_path = PATH + 'level/'
+    for level in levels or sorted(listdir(levels_path)):
+        for room_id in sorted(listdir(levels_path + level)):
+            level_path = levels_path + level + '/' + room_id + '/'
+            if (not path.isdir(level_path)): continue
+            compiled = file.compile_level(level_path)
+            kinds = [file.LAYER_KINDS[kind] for kind in compiled['kind']]
+            print(f'{level_path + file.COMPILED_LEVEL}: {compiled["tiles"].shape[1:]} {kinds}')
+
+if __name__ == '__main__':
+    compile_levels(sys.argv[1:])
@@ -0,0 +1,79 @@
+import pygame
+
+class HeldKeys(frozenset):
+    """
+    Set of held key codes, indexed like pygame.key.get_pressed(): keys[pygame.K_w].
+    """
+    def __getitem__(self, key):
+        return key in self
+
+class LiveInput():
+    """
+    Keyboard and mouse read from pygame, the default system.controls.
+
+    Methods:
+        keys(): Returns the held keys, indexed by key code.
+        mouse_pos(): Returns the mouse position on the screen.
+        mouse_buttons(): Returns the (left, middle, right) mouse buttons state.
+    """
+    def keys(self):
+        return pygame.key.get_pressed()
+
+    def mouse_pos(self):
+        return pygame.mouse.get_pos()
+
+    def mouse_buttons(self):
+        return pygame.mouse.get_pressed()
+
+class ScriptedInput():
+    """
+    Keyboard and mouse set by code (benchmarks, headless runs) instead of a human.
+
+    Attributes:
+        held (HeldKeys): Held key codes.
+        pos (tuple): Mouse position on the screen.
+        buttons (tuple): (left, middle, right) mouse buttons state.
+
+    Methods:
+        set(held, pos, buttons): Sets the input of the next frame.
+        keys(), mouse_pos(), mouse_buttons(): Same as LiveInput.
+    """
+    def __init__(self):
+        self.set()
+
+    def set(self, held = (), pos = (0, 0), buttons = (False, False, False)):
+        self.held = HeldKeys(held)
+        self.pos = tuple(pos)
+        self.buttons = tuple(buttons)
+
+    def keys(self):
+        return self.held
+
+    def mouse_pos(self):
+        return self.pos
+
+    def mouse_buttons(self):
+        return self.buttons
+
+class RecordingInput(ScriptedInput):
+    """
+    Live keyboard and mouse frozen once per frame, so a Recording (replay.py) holds exactly what the game read.
+    Held keys come from the KEYDOWN/KEYUP events, the mouse from pygame.
+
+    Attributes:
+        down (set): Key codes pressed and not released yet.
+
+    Methods:
+        event(event): Tracks the held keys from a pygame event.
+        capture(): Sets the input of the frame from the tracked keys and the mouse.
+    """
+    def __init__(self):
+        super().__init__()
+        self.down = set()
+
+    def event(self, event):
+        if (event.type==pygame.KEYDOWN): self.down.add(event.key)
+        if (event.type==pygame.KEYUP): self.down.discard(event.key)
+
+    def capture(self):
+        self.set(self.down, pygame.mouse.get_pos(), pygame.mouse.get_pressed())
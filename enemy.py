@@ -5,6 +5,17 @@ from numpy import random
 import file
 from sound import Playlist
 
+def import_animations(zombie_path):
+    "state -> [frames, flipped frames]"
+    animations = {'idle':[], 'walking':[], 'attacking':[], 'dying': []}
+    for animation in animations.keys():
+        anim_path = zombie_path + animation + '/'
+        anim = file.import_folder(anim_path)
+        animations[animation].append(anim)
+        animations[animation].append(
+            [pygame.transform.flip(img, flip_x = True, flip_y = False) for img in anim])
+    return animations
+
 class BasedZombie(pygame.sprite.Sprite):
     """
     Base class for zombie enemies.
@@ -12,7 +23,7 @@ class BasedZombie(pygame.sprite.Sprite):
     Attributes:
         pos (pygame.Vector2): Position vector.
         player: Reference to the player object.
-        obstacle_sprites: List of obstacle sprites.
+        obstacle_sprites: ObstacleGroup of the level walls.
         speed_scale (float): Scaling factor for speed.
         speed (int): Base movement speed.
         trigger_speed (int): Speed when triggered.
@@ -55,7 +66,7 @@ class BasedZombie(pygame.sprite.Sprite):
 
     Methods:
         target_sight_check: Check if the target is in sight of the zombie.
-        find_2nd_target: Find a secondary target.
+        find_2nd_target: Find a secondary target (next tile of the level flow field).
         get_random_target_point: Get a random target point for wandering.
         check_collision: Check collision with obstacles.
         cancel_trigger: Cancel the trigger if not chasing something.
@@ -67,7 +78,7 @@ class BasedZombie(pygame.sprite.Sprite):
         die: Execute death sequence.
         update: Update the zombie's behavior.
         bleed: Emit blood particles.
-        load_assets: Load zombie assets.
+        load_assets: Load zombie assets (shared through file.assets).
     """
     def __init__(self, pos, groups, obstacle_sprites, player, zindex = 1):
         super().__init__(groups)
@@ -138,40 +149,24 @@ class BasedZombie(pygame.sprite.Sprite):
         
         x, y = self.hitbox.width/2, self.hitbox.height/2
         if (coef == None): coef = self.coef_wall_hiding
-        for sprite in self.obstacle_sprites:
-            sprite_collision = False
-            for offset in [(x,y), (-x,y), (x,-y), (-x,-y)]:
-                offset = pygame.math.Vector2(offset)
-                if (not sprite.rect.clipline(self_pos+offset, target_pos+offset*coef)): continue
+        #the 4 corner lines of the trapezoid, walked over the obstacle grid
+        for offset in [(x,y), (-x,y), (x,-y), (-x,-y)]:
+            offset = pygame.math.Vector2(offset)
+            if (self.obstacle_sprites.clipline(self_pos+offset, target_pos+offset*coef)):
                 return False
             
         return True
 
     def find_2nd_target(self, target_pos):
-        "smarter AI"
+        "smarter AI: next tile of the level flow field toward the player"
+        flow_field = system.level.flow_field
         self_pos = pygame.math.Vector2(self.hitbox.center)
-        #speed up
-        if ((self_pos-target_pos).magnitude()>self.distance_to_follow):
-            return None
-        x, y = self.hitbox.width, self.hitbox.height
-        lstmp = [(x,0), (-x,0), (0,y), (0,-y)]
-        ls = []
-        if (self_pos.x+x/2>target_pos.x):
-            ls.append((-x,0))
-        if (self_pos.x-x/2<target_pos.x):
-            ls.append((x,0))
-        if (self_pos.y-y/2<target_pos.y):
-            ls.append((0,y))
-        if (self_pos.y+y/2>target_pos.y):
-            ls.append((0,-y))
-        # print(ls+lstmp)
-        for offset in ls+lstmp:
-            next_pos = self_pos + offset
-            if (not self.target_sight_check(next_pos, coef=1)): continue
-            if (not self.target_sight_check(target_pos, next_pos, 1)): continue
-            # print(next_pos,offset)
-            return next_pos
-        return None     
+        distance = flow_field.distance(self_pos)
+        if (distance==None): return None
+        if (self.distance_to_follow!=-1 and distance>self.distance_to_follow): return None
+        #same tile as the target
+        if (distance==0): return target_pos
+        return flow_field.next_point(self_pos)
             
     def get_random_target_point(self):
         self_pos = pygame.math.Vector2(self.hitbox.center)
@@ -183,10 +178,7 @@ class BasedZombie(pygame.sprite.Sprite):
     def check_collision(self):
         # if (is_though_wall==None): is_though_wall = self.is_though_wall
         if (self.is_though_wall): return False
-        for sprite in self.obstacle_sprites:
-            if (sprite.rect.colliderect(self.hitbox)):
-                return True
-        return False
+        return self.obstacle_sprites.collide_rect(self.hitbox)
     
     def cancel_trigger(self):
         "when zombie not chase sth it cancels trigger"
@@ -214,8 +206,10 @@ class BasedZombie(pygame.sprite.Sprite):
             self.cancel_trigger() #move to point then relize there's no one
         if (target!=None): 
             target_pos = pygame.math.Vector2(target.hitbox.center)
-            next_pos = self.find_2nd_target(target_pos)
-            if (self.target_sight_check(target_pos) and not self.is_attacking): #trigger
+            is_seen = self.target_sight_check(target_pos)
+            next_pos = None
+            if (not is_seen and not self.is_attacking): next_pos = self.find_2nd_target(target_pos)
+            if (is_seen and not self.is_attacking): #trigger
                 self.target_point = target_pos
                 self.current_speed = self.trigger_speed
                 self.on_trigger = True
@@ -239,6 +233,8 @@ class BasedZombie(pygame.sprite.Sprite):
             self.cancel_trigger()
         
         self.rect.center = self.hitbox.center + self.shift
+        #projectiles later in the step hit it where it is now
+        system.level.enemy_index.move(self)
 
     def attack(self):
         target = self.player
@@ -321,6 +317,7 @@ class BasedZombie(pygame.sprite.Sprite):
 
     def die(self):
         self.is_dead = True
+        system.level.enemy_index.remove(self)
         self.frame_index = 0 #die animation
     
     def update(self):
@@ -331,16 +328,10 @@ class BasedZombie(pygame.sprite.Sprite):
         self.bleeding_sounds.play()
 
     def load_assets(self):
-        "import zombie assets"
+        "import zombie assets, loaded once per namedir and shared by every instance"
         zombie_path = PATH + 'graphics/enemy/' + self.namedir + '/'
         self.path = zombie_path
-        self.animations = {'idle':[], 'walking':[], 'attacking':[], 'dying': []}
-        for animation in self.animations.keys():
-            anim_path = zombie_path + animation + '/'
-            anim = file.import_folder(anim_path)
-            self.animations[animation].append(anim)
-            self.animations[animation].append(
-                [pygame.transform.flip(img, flip_x = True, flip_y = False) for img in anim])
+        self.animations = file.assets.get(('enemy', self.namedir), lambda: import_animations(zombie_path))
     
     def import_scream_sounds(self):
         "all sounds too :D"
@@ -381,7 +372,7 @@ class Zombie(BasedZombie):
         anim_state (str): The current state of animation ('idle' or 'attack').
         rect (pygame.Rect): The rectangle representing the position and size of the zombie image.
         groups (pygame.sprite.Group): The group to which the zombie belongs.
-        obstacle_sprites (pygame.sprite.Group): The group containing obstacle sprites.
+        obstacle_sprites (ObstacleGroup): The group containing obstacle sprites.
         player (Player): The player object.
         zindex (int): The z-index of the zombie for layering in the game.
 
@@ -547,6 +538,8 @@ class FlyingSword(BasedZombie):
         self.trigger_speed *= self.speed_scale
 
         system.level.enemies.append(self)
+        #hittable in the step it is thrown
+        system.level.enemy_index.add(self)
 
         self.import_scream_sounds()
         self.scream_cooldown = 1
@@ -562,6 +555,7 @@ class FlyingSword(BasedZombie):
         if self.is_attacking:
             self.kill()
             system.level.enemies.remove(self)
+            system.level.enemy_index.remove(self)
 
     def update(self):
         if (not self.is_dead): self.move()
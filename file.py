@@ -1,7 +1,14 @@
 from csv import reader
-from os import walk
+from os import walk, path as os_path
 import pygame
 import json
+import numpy as np
+from threading import Thread, Lock
+from queue import Queue
+
+#layer kinds of a level room, in loading order
+LAYER_KINDS = ['visible', 'obstacle', 'enemy']
+COMPILED_LEVEL = 'compiled.npy'
 
 def import_csv_layout(path):
     terrain_map = []
@@ -11,13 +18,52 @@ def import_csv_layout(path):
             terrain_map.append(list(row))
         return terrain_map
 
+def layer_files(level_path, kind):
+    "csv files of a layer kind in name order (the layer order of the map editor)"
+    for _,__,csv_files in walk(level_path + kind + '/'):
+        return sorted(csv_files)
+    return []
+
+def import_csv_layers(level_path):
+    "[(kind, (rows, cols) int16 tile indexes, -1 if empty)] of a level room"
+    layers = []
+    for kind in LAYER_KINDS:
+        for filename in layer_files(level_path, kind):
+            layout = import_csv_layout(level_path + kind + '/' + filename)
+            tiles = np.full((len(layout), max(len(row) for row in layout)), -1, np.int16)
+            for row_index, row in enumerate(layout):
+                tiles[row_index, :len(row)] = [int(col) for col in row]
+            layers.append((kind, tiles))
+    return layers
+
+def compile_level(level_path):
+    """packs the csv layers of a level room into one int16 .npy file,
+    one (kind, tiles) record per layer in drawing order"""
+    layers = import_csv_layers(level_path)
+    rows = max(tiles.shape[0] for _, tiles in layers)
+    cols = max(tiles.shape[1] for _, tiles in layers)
+    compiled = np.zeros(len(layers), np.dtype([('kind', np.int16), ('tiles', np.int16, (rows, cols))]))
+    compiled['tiles'] = -1
+    for index, (kind, tiles) in enumerate(layers):
+        compiled['kind'][index] = LAYER_KINDS.index(kind)
+        compiled['tiles'][index, :tiles.shape[0], :tiles.shape[1]] = tiles
+    np.save(level_path + COMPILED_LEVEL, compiled)
+    return compiled
+
+def import_level_layers(level_path):
+    "same as import_csv_layers, memory-mapped from the compiled file when there is one"
+    compiled_path = level_path + COMPILED_LEVEL
+    if (not os_path.exists(compiled_path)): return import_csv_layers(level_path)
+    compiled = np.load(compiled_path, mmap_mode = 'r')
+    return [(LAYER_KINDS[kind], compiled['tiles'][index]) for index, kind in enumerate(compiled['kind'].tolist())]
+
 def import_folder(path):
     surface_list = []
 
     for _,__,img_files in walk(path):
         for image in sorted(img_files, key = lambda name: int(name.split('.')[0])): 
             full_path = path + '/' + image
-            image_surf = pygame.image.load(full_path).convert_alpha()
+            image_surf = decode_image(full_path).convert_alpha()
             surface_list.append(image_surf)
 
     return surface_list
@@ -28,11 +74,144 @@ def import_playlist(path):
     for _,__,img_files in walk(path):
         for image in sorted(img_files, key = lambda name: int(name.split('.')[0])): 
             full_path = path + '/' + image
-            sound = pygame.mixer.Sound(full_path)
+            sound = decode_sound(full_path)
             surface_list.append(sound)
 
     return surface_list
 
+class AssetRegistry():
+    """
+    Process-wide cache of loaded assets, an asset is loaded the first time its key is asked
+    and the same object is returned afterwards. Shared assets must not be modified in place.
+
+    Attributes:
+        assets (dict): Key -> loaded asset.
+        loads (int): Number of assets loaded (cache misses).
+
+    Methods:
+        get(key, loader): Returns the asset of key, calling loader() if it isn't loaded yet.
+        clear(): Forgets every asset.
+    """
+    def __init__(self):
+        self.assets = {}
+        self.loads = 0
+
+    def get(self, key, loader):
+        if (key not in self.assets):
+            self.assets[key] = loader()
+            self.loads += 1
+        return self.assets[key]
+
+    def clear(self):
+        self.assets.clear()
+
+assets = AssetRegistry()
+
+class AssetPreloader():
+    """
+    Reads and decodes image and sound files on a worker thread, so that building a level
+    on the main thread only has to convert them (see decode_image, decode_sound).
+    Other jobs that don't need the display (like baking tiles) can run there too.
+
+    Attributes:
+        decoded (dict): Normalized path (or job key) -> decoded Surface (not converted), Sound or job result.
+        queue (Queue): (key, job) waiting for the worker.
+        queued (set): Keys queued or done, a key is queued once.
+        lock (Lock): Guards decoded.
+        thread (Thread): Worker, started by the first preload.
+        generation (int): Bumped by clear(), the results of jobs queued before are dropped.
+
+    Methods:
+        preload(paths): Queues image (.png) and sound (.wav) files for decoding.
+        preload_folder(path): Queues every image and sound file under a folder.
+        preload_job(key, job): Queues job() to run on the worker, its result is taken with take(key).
+        take(key): Returns and forgets the decoded asset of a path (or job result), None if it isn't ready,
+            a taken job can be queued again.
+        pending(): Returns the number of jobs not done yet.
+        clear(): Forgets the results not taken and the queued jobs, once a level is loaded they won't be taken.
+    """
+    def __init__(self):
+        self.decoded = {}
+        self.queue = Queue()
+        self.queued = set()
+        self.lock = Lock()
+        self.thread = None
+        self.generation = 0
+
+    def preload(self, paths):
+        for path in paths:
+            path = os_path.normpath(path)
+            if (path in loaded_paths): continue
+            if (path.endswith('.png')): self.preload_job(path, lambda path = path: pygame.image.load(path))
+            elif (path.endswith('.wav')): self.preload_job(path, lambda path = path: pygame.mixer.Sound(path))
+
+    def preload_job(self, key, job):
+        if (key in self.queued): return
+        self.queued.add(key)
+        self.queue.put((key, job, self.generation))
+        if (self.thread==None):
+            self.thread = Thread(target = self.work, daemon = True)
+            self.thread.start()
+
+    def preload_folder(self, path):
+        for folder, __, files in walk(path):
+            self.preload(os_path.join(folder, name) for name in sorted(files))
+
+    def work(self):
+        while True:
+            key, job, generation = self.queue.get()
+            try:
+                result = job()
+                with self.lock:
+                    #not needed anymore if the main thread loaded it meanwhile or the preloads were cleared
+                    if (key not in loaded_paths and generation==self.generation): self.decoded[key] = result
+            except (pygame.error, OSError):
+                pass #the main thread will load it and report the error
+            self.queue.task_done()
+
+    def take(self, key):
+        if (isinstance(key, str)): key = os_path.normpath(key)
+        with self.lock:
+            result = self.decoded.pop(key, None)
+        if (result!=None): self.queued.discard(key)
+        return result
+
+    def pending(self):
+        return self.queue.unfinished_tasks
+
+    def clear(self):
+        with self.lock:
+            self.decoded.clear()
+            self.queued.clear()
+            self.generation += 1
+
+preloader = AssetPreloader()
+#files already loaded by the main thread, not worth preloading again
+loaded_paths = set()
+
+def decode_image(path):
+    "pygame.image.load, from the preloader if it already decoded the file"
+    loaded_paths.add(os_path.normpath(path))
+    image = preloader.take(path)
+    if (image==None): image = pygame.image.load(path)
+    return image
+
+def decode_sound(path):
+    "pygame.mixer.Sound, from the preloader if it already decoded the file"
+    loaded_paths.add(os_path.normpath(path))
+    sound = preloader.take(path)
+    if (sound==None): sound = pygame.mixer.Sound(path)
+    return sound
+
+def import_image(path, convert = True):
+    "loaded once, shared through assets"
+    if (not convert): return assets.get(('raw image', path), lambda: decode_image(path))
+    return assets.get(('image', path), lambda: decode_image(path).convert_alpha())
+
+def import_sound(path):
+    "loaded once, shared through assets"
+    return assets.get(('sound', path), lambda: decode_sound(path))
+
 def import_json(path):
     f = open(path)
     data = json.load(f)
@@ -40,20 +219,44 @@ def import_json(path):
 
 
 class SpriteSheet():
-    def __init__(self, path, sprite_w, sprite_h):
-        self.sheet = pygame.image.load(path).convert_alpha()
+    """
+    Sheet of equal sized frames. A frame is cut out once and the same surface
+    is returned every time it is asked, so it must not be modified in place.
+
+    Attributes:
+        sheet (Surface): Whole sheet image.
+        sprite_w, sprite_h (int): Size of a frame.
+        w, h (int): Number of frames per row and per column.
+        frames (dict): Frame index -> surface, the frames cut out so far.
+        requests (int): Number of get_image calls.
+
+    Methods:
+        get_image(frame): Returns the surface of a frame.
+        stats(): Returns the number of requests and of unique frames used.
+    """
+    def __init__(self, path, sprite_w, sprite_h, convert = True):
+        #not converted for a worker thread, which must not touch the display and assets
+        self.sheet = import_image(path) if convert else pygame.image.load(path)
         self.sprite_w = sprite_w
         self.sprite_h = sprite_h
         self.w, self.h = self.sheet.get_rect().size
         self.w = self.w // self.sprite_w
         self.h = self.h // self.sprite_h
+        self.frames = {}
+        self.requests = 0
 
     def get_image(self, frame):
         assert frame < self.w*self.h, 'frame is out of the sheet'
+        self.requests += 1
+        if (frame in self.frames): return self.frames[frame]
         #transparent surface not .convert_alpha()
         image = pygame.Surface((self.sprite_w, self.sprite_h),pygame.SRCALPHA)
         offset_w = frame%self.w*self.sprite_w
         offset_h = frame//self.w*self.sprite_h
         image.blit(self.sheet, (0,0), (offset_w, offset_h, self.sprite_w, self.sprite_h))
+        self.frames[frame] = image
+
+        return image
 
-        return image
\ No newline at end of file
+    def stats(self):
+        return {'requests': self.requests, 'unique': len(self.frames)}
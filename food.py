@@ -41,8 +41,8 @@ class Food(pygame.sprite.Sprite):
         self.is_disable = True
         self.is_update = False
         
-        self.eating_sound = pygame.mixer.Sound(PATH + 'graphics/food/eating.wav')
-        self.healing_sound = pygame.mixer.Sound(PATH + 'graphics/food/healing.wav')
+        self.eating_sound = file.import_sound(PATH + 'graphics/food/eating.wav')
+        self.healing_sound = file.import_sound(PATH + 'graphics/food/healing.wav')
 
     def read_info(self):
         f = open(self.path+'info.json', "r")
@@ -2,16 +2,23 @@ import pygame
 import GUI
 import player 
 from settings import *
-from level import Level, MenuScreen, Level00, Level01
+from level import Level, LevelSwitcher
 import system
 from pygame.locals import *
 import moderngl
-import struct
+import file
+from post import PostProcess, HudSurface
+from time import perf_counter
+import sys
+from random import SystemRandom
+from controls import RecordingInput
+from replay import Recording, seed_all, state_digest
+from timestep import FixedTimestep
 
 VIRTUAL_RES = (SCREEN_WIDTH, SCREEN_HEIGHT)
 
 
-class Game:
+class Game(LevelSwitcher):
     def __init__(self):
         pygame.init()
         pygame.display.set_caption('[OOP] Zombie Slayer: Nhu nhung con zombie co ban vao cung ton dan')
@@ -23,123 +30,96 @@ class Game:
         else:
             pygame.display.set_mode((SCREEN_WIDTH,SCREEN_HEIGHT))
             system.screen = pygame.Surface((SCREEN_WIDTH,SCREEN_HEIGHT))
+        #python oop/game.py record=fight.rec saves the seed and input of the run for replay.py
+        self.recording = None
+        for arg in sys.argv[1:]:
+            if (arg.startswith('record=')): self.start_recording(arg[len('record='):])
         # self.level = Level()
-        self.level = MenuScreen()
+        self.start_menu()
         self.clock = pygame.time.Clock()
+        #real seconds of the last frame, simulated in fixed steps
+        self.timestep = FixedTimestep()
+        self.frame_time = 0
         if (debug): self.level.darkness_value = 0
-        
-        self.current_level = 0
-        system.go_to_level = self.go_to_level
     def init_CRT(self):
         pygame.display.set_mode((SCREEN_WIDTH,SCREEN_HEIGHT),DOUBLEBUF|OPENGL)
         system.screen = pygame.Surface((SCREEN_WIDTH,SCREEN_HEIGHT)).convert((255, 65280, 16711680, 0))
+        system.hud_screen = HudSurface((SCREEN_WIDTH,SCREEN_HEIGHT))
         self.ctx = moderngl.create_context()
-        ctx = self.ctx
-
-        texture_coordinates = [0, 1,  1, 1,
-                            0, 0,  1, 0]
-
-        world_coordinates = [-1, -1,  1, -1,
-                            -1,  1,  1,  1]
-
-        render_indices = [0, 1, 2,
-                        1, 2, 3]
-
-        prog = ctx.program(
-                vertex_shader='''#version 300 es
-            in vec2 vert;
-            in vec2 in_text;
-            out vec2 v_text;
-            void main() {
-            gl_Position = vec4(vert, 0.0, 1.0);
-            v_text = in_text;
-            }
-            ''',
-
-                fragment_shader='''#version 300 es
-            precision mediump float;
-            uniform sampler2D Texture;
-
-            out vec4 color;
-            in vec2 v_text;
-            uniform float current_time;
-
-            void main() {
-            vec2 center = vec2(0.5, 0.5);
-            vec2 off_center = v_text - center;
-
-            off_center *= 1.0 + 0.8 * pow(abs(off_center.yx), vec2(3));
-
-            vec2 v_text2 = center+off_center;
-
-            if (v_text2.x > 1.0 || v_text2.x < 0.0 ||
-                v_text2.y > 1.0 || v_text2.y < 0.0){
-                color=vec4(0.0, 0.0, 0.0, 1.0);
-            } else {
-                color = vec4(texture(Texture, v_text2).rgb, 1.0);
-                float fv = fract((v_text2.y+0.05*current_time) * float(textureSize(Texture,0).y)*0.08);
-                fv=min(1.0, 0.8+0.5*min(fv, 1.0-fv));
-                color.rgb*=fv;
-            }
-            }
-            ''')
-        self.prog = prog
-
-        self.screen_texture = ctx.texture(
-            VIRTUAL_RES, 3,
-            pygame.image.tostring(system.screen, "RGB", 1))
-        screen_texture = self.screen_texture
-
-        screen_texture.repeat_x = False
-        screen_texture.repeat_y = False
-
-        vbo = ctx.buffer(struct.pack('8f', *world_coordinates))
-        uvmap = ctx.buffer(struct.pack('8f', *texture_coordinates))
-        ibo= ctx.buffer(struct.pack('6I', *render_indices))
-
-        vao_content = [
-            (vbo, '2f', 'vert'),
-            (uvmap, '2f', 'in_text')
-        ]
-
-        self.vao = ctx.vertex_array(prog, vao_content, ibo)
+        light_image = file.import_image(PATH + 'graphics/light/light.png', convert = False)
+        self.post_process = PostProcess(self.ctx, VIRTUAL_RES, light_image)
+        #the level gives its darkness, lights and transitions to the GPU instead of drawing them
+        system.post_effects = self.post_process.effects
     
+    def start_recording(self, path):
+        "before anything random happens"
+        seed = SystemRandom().randrange(2**32)
+        seed_all(seed)
+        system.controls = RecordingInput()
+        self.recording = Recording(seed)
+        self.recording_path = path
+
+    def record_frame(self):
+        "after the events of the frame"
+        if (self.recording==None): return
+        system.controls.capture()
+        self.recording.add(self.frame_time, system.mouse_scroll, system.controls)
+
+    def save_recording(self):
+        if (self.recording==None): return
+        self.recording.digest = state_digest(self.level)
+        self.recording.save(self.recording_path)
+
     def render_CRT(self):
-        self.prog['current_time'] = system.time
-        texture_data = system.screen.get_view('1')
-        self.screen_texture.write(texture_data)
-        self.ctx.clear(14/255,40/255,66/255)
-        self.screen_texture.use()
-        self.vao.render()
+        start = perf_counter()
+        #menus only upload what changed
+        dirty = getattr(self.level, 'dirty_rects', None)
+        self.post_process.render(system.screen, system.hud_screen, system.time, dirty = dirty)
         pygame.display.flip()
+        system.profiler.record('present', start, perf_counter())
+
+    def profiler_event(self, event):
+        #F3 shows the frame profiler, F4 writes its trace (chrome://tracing)
+        if (event.type!=KEYDOWN): return
+        if (event.key==K_F3):
+            system.profiler.toggle()
+        if (event.key==K_F4 and system.profiler.enabled):
+            system.profiler.export(PROFILER_TRACE_PATH)
 
     def run(self):
         if (self.CRT_filter):
             self.run_CRT()
         else:
             self.run_no_CRT()
+        self.save_recording()
 
     def run_CRT(self):
         self.is_run = True
         while self.is_run:
-            mouse_wheel_event_check = False
+            system.profiler.begin_frame()
+            start = perf_counter()
             for event in pygame.event.get():
+                self.profiler_event(event)
+                if (self.recording!=None): system.controls.event(event)
                 if event.type == KEYDOWN and event.key == K_w:
                     continue
                     pygame.mixer.music.fadeout(1000)
                 if event.type == pygame.QUIT:
                     self.is_run = False
                 if event.type == pygame.MOUSEWHEEL:
-                    mouse_wheel_event_check = True
+                    #kept until a level step uses it, a frame may run no step
                     system.mouse_scroll = event.y
-            if (not mouse_wheel_event_check): system.mouse_scroll = 0
+            self.record_frame()
+            system.profiler.record('events', start, perf_counter())
             # self.screen.fill('black')
             system.screen.fill('black')
-            self.level.update()
+            system.hud_screen.clear()
+            self.timestep.run(self, self.frame_time)
+            system.profiler.draw(system.hud_screen)
             # self.screen.blit(self.level.sprite_sheet.get_image(71), (0,0))
             self.render_CRT()
-            system.delta_time = self.clock.tick(FPS)/1000
-            system.time += system.delta_time
+            system.profiler.end_frame()
+            self.frame_time = self.clock.tick(FPS)/1000
 
     def run_no_CRT(self):
         """
@@ -148,55 +128,35 @@ class Game:
         """
         self.is_run = True
         while self.is_run:
-            mouse_wheel_event_check = False
+            system.profiler.begin_frame()
+            start = perf_counter()
             for event in pygame.event.get():
+                self.profiler_event(event)
+                if (self.recording!=None): system.controls.event(event)
                 if event.type == pygame.QUIT:
                     self.is_run = False
                 if event.type == pygame.MOUSEWHEEL:
-                    mouse_wheel_event_check = True
+                    #kept until a level step uses it, a frame may run no step
                     system.mouse_scroll = event.y
-            if (not mouse_wheel_event_check): system.mouse_scroll = 0
+            self.record_frame()
+            system.profiler.record('events', start, perf_counter())
             #self.screen.fill('black')
             system.screen.fill('black')
             self.level.darkness_value = 0
-            self.level.update()
+            self.timestep.run(self, self.frame_time)
+            system.profiler.draw(system.screen)
+            start = perf_counter()
             pygame.display.get_surface().blit(system.screen,(0,0))
             # self.screen.blit(self.level.sprite_sheet.get_image(71), (0,0))
             pygame.display.update()
-            system.delta_time = self.clock.tick(FPS)/1000
+            system.profiler.record('present', start, perf_counter())
+            system.profiler.end_frame()
+            self.frame_time = self.clock.tick(FPS)/1000
             
             # print('FPS: ',self.clock.get_fps())
         # filehandler = open('ccbm', 'wb') 
         # pickle.dump(self, filehandler)
 
-    def go_to_level(self, level = None):
-        if (level == None):
-            self.current_level = -1
-            self.level = MenuScreen()
-            return
-
-        if (level == 'next'):
-            level = self.current_level + 1
-            if (level>1):
-                level = -1
-        elif (level == 'restart'):
-            level = self.current_level
-        elif (level == 'exit'):
-            self.is_run = False
-            return
-
-        
-        self.current_level = level
-        if self.current_level==-1:
-            self.level = MenuScreen()
-        elif self.current_level==0:
-            self.level = Level00()
-        elif self.current_level==1:
-            self.level = Level01()
-        else:
-            assert False, f"Cant find level: {self.current_level}"
-            self.level = None
-
 
 game = Game()
 game.run()
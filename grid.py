@@ -0,0 +1,344 @@
+import pygame
+from settings import *
+from collections import deque
+import numpy as np
+
+class SpatialGrid():
+    """
+    Uniform grid (spatial hash) of sprites, a sprite is stored in every cell its rect overlaps.
+
+    Attributes:
+        cell_size (int): Side length of a cell in world coordinates.
+        cells (dict): (col, row) -> list of sprites overlapping the cell.
+
+    Methods:
+        cell_range(rect): Returns the column and row ranges overlapped by a rect.
+        insert(sprite, rect): Stores a sprite in the cells of rect (sprite.rect by default).
+        remove(sprite, rect): Removes a sprite from the cells of rect, where it was inserted.
+        clear(): Removes every sprite.
+        query(rect): Returns the sprites stored in the cells overlapped by rect, each once.
+        segment_cells(start, end): Yields the cells crossed by an integer segment.
+        collide_rect(rect, attr): Checks if rect hits the rect (or attr) of a stored sprite.
+    """
+    def __init__(self, cell_size = TILESIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def cell_range(self, rect):
+        left, right = min(rect.left,rect.right), max(rect.left,rect.right)
+        top, bottom = min(rect.top,rect.bottom), max(rect.top,rect.bottom)
+        size = self.cell_size
+        return range(left//size, right//size+1), range(top//size, bottom//size+1)
+
+    def insert(self, sprite, rect = None):
+        if (rect==None): rect = sprite.rect
+        #right/bottom are outside the rect
+        size = self.cell_size
+        for col in range(rect.left//size, (rect.right-1)//size+1):
+            for row in range(rect.top//size, (rect.bottom-1)//size+1):
+                self.cells.setdefault((col,row),[]).append(sprite)
+
+    def remove(self, sprite, rect):
+        size = self.cell_size
+        for col in range(rect.left//size, (rect.right-1)//size+1):
+            for row in range(rect.top//size, (rect.bottom-1)//size+1):
+                self.cells[(col,row)].remove(sprite)
+
+    def clear(self):
+        self.cells.clear()
+
+    def query(self, rect):
+        cols, rows = self.cell_range(rect)
+        found = []
+        for col in cols:
+            for row in rows:
+                for sprite in self.cells.get((col,row),()):
+                    if (sprite not in found): found.append(sprite)
+        return found
+
+    def segment_cells(self, start, end):
+        """cells crossed by the segment start-end (grid DDA walk),
+        both cells are taken when it passes exactly through a corner"""
+        size = self.cell_size
+        x0, y0 = start
+        x1, y1 = end
+        col, row = x0//size, y0//size
+        end_col, end_row = x1//size, y1//size
+        dx, dy = abs(x1-x0), abs(y1-y0)
+        step_col = 1 if x1>x0 else -1
+        step_row = 1 if y1>y0 else -1
+        #distance to the next cell border, compared as t_x = bx/dx vs t_y = by/dy
+        bx = (col+1)*size-x0 if step_col>0 else x0-col*size
+        by = (row+1)*size-y0 if step_row>0 else y0-row*size
+        yield col, row
+        for _ in range(abs(end_col-col)+abs(end_row-row)):
+            if (col==end_col and row==end_row): return
+            tx, ty = bx*dy, by*dx #integer, no rounding when comparing
+            if (dx==0 or (dy!=0 and ty<tx)):
+                row += step_row
+                by += size
+            elif (dy==0 or tx<ty):
+                col += step_col
+                bx += size
+            else: #corner
+                yield col+step_col, row
+                yield col, row+step_row
+                col += step_col
+                row += step_row
+                bx += size
+                by += size
+            yield col, row
+
+    def collide_rect(self, rect, attr = 'rect'):
+        cols, rows = self.cell_range(rect)
+        cells = self.cells
+        for col in cols:
+            for row in rows:
+                for sprite in cells.get((col,row),()):
+                    if (rect.colliderect(getattr(sprite,attr))): return True
+        return False
+
+class ObstacleGroup(pygame.sprite.Group):
+    """
+    Group of static obstacles (walls) answering collision queries through a SpatialGrid.
+
+    Attributes:
+        grid (SpatialGrid): Obstacles by TILESIZE cell, built by build_grid().
+        sight_grid (SpatialGrid): Same, but a wall is also in the cells within 1px of it,
+            Rect.clipline rounds to pixels and can hit a wall from the next cell.
+
+    Methods:
+        build_grid(): Puts every obstacle in the grids, called once the map is loaded.
+        collide_rect(rect): Checks if rect hits a wall, only looking at the cells it overlaps.
+        clipline(start, end): Checks if a segment hits a wall (same result as Rect.clipline on every wall),
+            only looking at the cells the segment crosses.
+    """
+    def __init__(self, *sprites):
+        super().__init__(*sprites)
+        self.grid = SpatialGrid(TILESIZE)
+        self.sight_grid = SpatialGrid(TILESIZE)
+
+    def build_grid(self):
+        self.grid.clear()
+        self.sight_grid.clear()
+        for sprite in self.sprites():
+            self.grid.insert(sprite)
+            self.sight_grid.insert(sprite, sprite.rect.inflate(2,2))
+
+    def collide_rect(self, rect):
+        return self.grid.collide_rect(rect)
+
+    def clipline(self, start, end):
+        #clipline truncates to int too
+        start = (int(start[0]),int(start[1]))
+        end = (int(end[0]),int(end[1]))
+        cells = self.sight_grid.cells
+        checked = set()
+        for cell in self.sight_grid.segment_cells(start, end):
+            for sprite in cells.get(cell,()):
+                if (sprite in checked): continue
+                checked.add(sprite)
+                if (sprite.rect.clipline(start, end)): return True
+        return False
+
+class FlowField():
+    """
+    Breadth-first distance map (in tiles) to the player over the obstacle grid, shared by every enemy.
+    It is only recomputed when the player enters another tile.
+
+    Attributes:
+        cell_size (int): Side length of a tile.
+        cols, rows (int): Size of the map in tiles.
+        radius (int): Tiles further than this (path length) from the player are not reached.
+        blocked (set): Tiles holding a wall.
+        distance_map (dict): (col, row) -> path length in tiles to the player tile.
+        seed (tuple): Tile of the player the map was computed from.
+        arrays (tuple): Dense (distance, next point) arrays of the current seed, built on demand.
+
+    Methods:
+        update(pos): Recomputes the map if pos is in another tile.
+        cell(pos): Returns the tile of a world position.
+        distance(pos): Returns the path length in pixels from pos to the player, None if unreachable.
+        next_point(pos): Returns the center of the next tile toward the player, None if unreachable.
+        as_arrays(): Returns (rows, cols) path lengths (-1 unreachable) and (rows, cols, 2) next points (nan if none).
+    """
+    def __init__(self, obstacles, size, radius = FLOW_FIELD_RADIUS):
+        self.cell_size = obstacles.grid.cell_size
+        self.cols, self.rows = size
+        self.radius = radius
+        self.blocked = set(obstacles.grid.cells)
+        self.distance_map = {}
+        self.seed = None
+        self.arrays = None
+
+    def cell(self, pos):
+        return int(pos[0])//self.cell_size, int(pos[1])//self.cell_size
+
+    def update(self, pos):
+        seed = self.cell(pos)
+        if (seed==self.seed): return
+        self.seed = seed
+        distance_map = {seed: 0}
+        blocked = self.blocked
+        cols, rows = self.cols, self.rows
+        queue = deque([seed])
+        while (queue):
+            col, row = cell = queue.popleft()
+            distance = distance_map[cell]+1
+            if (distance>self.radius): continue
+            for next_cell in ((col+1,row), (col-1,row), (col,row+1), (col,row-1)):
+                if (next_cell in distance_map or next_cell in blocked): continue
+                if (not (0<=next_cell[0]<cols and 0<=next_cell[1]<rows)): continue
+                distance_map[next_cell] = distance
+                queue.append(next_cell)
+        self.distance_map = distance_map
+        self.arrays = None
+
+    def distance(self, pos):
+        distance = self.distance_map.get(self.cell(pos))
+        if (distance==None): return None
+        return distance*self.cell_size
+
+    def next_point(self, pos):
+        col, row = self.cell(pos)
+        distance_map = self.distance_map
+        best = distance_map.get((col,row))
+        if (best==None): return None
+        best_cell = None
+        for dcol, drow in ((1,0), (-1,0), (0,1), (0,-1), (1,1), (1,-1), (-1,1), (-1,-1)):
+            next_cell = (col+dcol,row+drow)
+            distance = distance_map.get(next_cell)
+            if (distance==None or distance>=best): continue
+            #no corner cutting
+            if (dcol and drow and ((col+dcol,row) not in distance_map or (col,row+drow) not in distance_map)): continue
+            best, best_cell = distance, next_cell
+        if (best_cell==None): return None
+        return pygame.math.Vector2(best_cell)*self.cell_size + pygame.math.Vector2(self.cell_size,self.cell_size)/2
+
+    def as_arrays(self):
+        "for batched lookups (Horde)"
+        if (self.arrays!=None): return self.arrays
+        distance_array = np.full((self.rows, self.cols), -1, int)
+        next_array = np.full((self.rows, self.cols, 2), np.nan)
+        half = self.cell_size/2
+        for (col, row), distance in self.distance_map.items():
+            distance_array[row, col] = distance
+            next_point = self.next_point((col*self.cell_size+half, row*self.cell_size+half))
+            if (next_point!=None): next_array[row, col] = next_point
+        self.arrays = (distance_array, next_array)
+        return self.arrays
+
+class EnemyIndex():
+    """
+    Uniform grid of the live enemy hitboxes, rebuilt once per step by the level
+    and queried by the projectiles and explosions instead of scanning every enemy.
+    Enemies moving during the step (BasedZombie.move) and swords thrown during it keep it up to date,
+    the horde only moves after the projectiles, its hitboxes are the ones of the build.
+
+    Attributes:
+        grid (SpatialGrid): Indexes of the enemies by cell.
+        enemies (list): Indexed enemies.
+        boxes (list or ndarray): (x, y, w, h) hitbox of each indexed enemy, as of the build or its last move.
+        indexes (dict): Enemy -> index of the enemies that can move or be added during the step (not the horde).
+        removed (set): Enemies dropped since the build (died).
+
+    Methods:
+        build(enemies): Indexes the live enemies of a list.
+        build_arrays(enemies, boxes, others): Same from an (n, 4) int array of hitboxes (Horde), vectorized,
+            plus the live enemies of others.
+        add(enemy): Indexes an enemy created after the build.
+        move(enemy): Moves the entry of an indexed enemy to its current hitbox.
+        remove(enemy): Drops an enemy until the next build.
+        query(rect): Returns the indexed enemies whose hitbox collides with rect.
+    """
+    def __init__(self, cell_size = TILESIZE*2):
+        #bigger cells than the walls, an enemy hitbox spans fewer of them
+        self.grid = SpatialGrid(cell_size)
+        self.enemies = []
+        self.boxes = []
+        self.indexes = {}
+        self.removed = set()
+
+    def build(self, enemies):
+        self.grid.clear()
+        self.enemies = []
+        self.boxes = []
+        self.indexes = {}
+        self.removed.clear()
+        for enemy in enemies:
+            if (enemy.is_dead): continue
+            self.add(enemy)
+
+    def build_arrays(self, enemies, boxes, others = ()):
+        others = [enemy for enemy in others if not enemy.is_dead]
+        if (others):
+            enemies = list(enemies)+others
+            boxes = np.concatenate([boxes, np.array([tuple(enemy.hitbox) for enemy in others], int)])
+        self.grid.clear()
+        self.enemies = list(enemies)
+        self.boxes = boxes
+        self.indexes = {enemy: len(self.enemies)-len(others)+i for i, enemy in enumerate(others)}
+        self.removed.clear()
+        if (len(enemies)==0): return
+        size = self.grid.cell_size
+        #same cells as SpatialGrid.insert
+        col0, row0 = boxes[:,0]//size, boxes[:,1]//size
+        col1 = (boxes[:,0]+boxes[:,2]-1)//size
+        row1 = (boxes[:,1]+boxes[:,3]-1)//size
+        cols_count = col1-col0+1
+        cells_count = cols_count*(row1-row0+1)
+        #one entry per (enemy, cell)
+        owner = np.repeat(np.arange(len(enemies)), cells_count)
+        offset = np.arange(len(owner))-np.repeat(np.cumsum(cells_count)-cells_count, cells_count)
+        cols = col0[owner]+offset%cols_count[owner]
+        rows = row0[owner]+offset//cols_count[owner]
+        #group the entries by cell, one slice of the sorted entries per cell
+        min_col, min_row = cols.min(), rows.min()
+        keys = (rows-min_row)*(cols.max()-min_col+1)+cols-min_col
+        order = np.argsort(keys)
+        _, starts = np.unique(keys[order], return_index=True)
+        entries = owner[order].tolist()
+        cell_cols = cols[order[starts]].tolist()
+        cell_rows = rows[order[starts]].tolist()
+        ends = starts[1:].tolist()+[len(entries)]
+        cells = self.grid.cells
+        for col, row, start, end in zip(cell_cols, cell_rows, starts.tolist(), ends):
+            cells[(col,row)] = entries[start:end]
+
+    def add(self, enemy):
+        index = len(self.enemies)
+        box = tuple(enemy.hitbox)
+        self.enemies.append(enemy)
+        if (isinstance(self.boxes, np.ndarray)): self.boxes = np.concatenate([self.boxes.reshape(-1, 4), [box]]).astype(int)
+        else: self.boxes.append(box)
+        self.indexes[enemy] = index
+        self.grid.insert(index, enemy.hitbox)
+
+    def move(self, enemy):
+        index = self.indexes.get(enemy)
+        if (index==None): return
+        old, new = pygame.Rect(tuple(self.boxes[index])), enemy.hitbox
+        size = self.grid.cell_size
+        #most moves stay in the same cells
+        if ((old.left//size, (old.right-1)//size, old.top//size, (old.bottom-1)//size)
+            !=(new.left//size, (new.right-1)//size, new.top//size, (new.bottom-1)//size)):
+            self.grid.remove(index, old)
+            self.grid.insert(index, new)
+        self.boxes[index] = tuple(new)
+
+    def remove(self, enemy):
+        self.removed.add(enemy)
+
+    def query(self, rect):
+        cols, rows = self.grid.cell_range(rect)
+        cells, boxes = self.grid.cells, self.boxes
+        checked = set()
+        found = []
+        for col in cols:
+            for row in rows:
+                for index in cells.get((col,row),()):
+                    if (index in checked): continue
+                    checked.add(index)
+                    if (rect.colliderect(boxes[index])): found.append(self.enemies[index])
+        if (self.removed): found = [enemy for enemy in found if enemy not in self.removed]
+        return found
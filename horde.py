@@ -0,0 +1,447 @@
+import pygame
+from settings import *
+import system
+import numpy as np
+from numpy import random
+from enemy import Zombie, Bat, Skeleton, FlyingSword
+
+#anim_state
+IDLE, WALKING, ATTACKING, DYING = 0, 1, 2, 3
+ANIM_STATES = ['idle', 'walking', 'attacking', 'dying']
+
+#per kind randomness of the enemy constructors: size scale range, speed scale range, ranges scale with size
+HORDE_KINDS = {
+    Zombie: ((0.8,1.5), (0.8,2.5), True),
+    Bat: ((3,3), (2,2.5), True),
+    Skeleton: ((2,2.5), (2,2.5), False),
+}
+
+class HordeKind():
+    """
+    Shared data of one enemy class in a horde, read from a prototype instance.
+
+    Attributes:
+        cls (type): Enemy class (Zombie, Bat, Skeleton).
+        animations (dict): Animation frames of the prototype, shared by every enemy of the kind.
+        anim_lengths (list): Number of frames of idle, walking, attacking, dying.
+        scream_sounds, bleeding_sounds (Playlist): Sounds of the kind.
+        prototype (BasedZombie): Instance the constant traits are read from.
+        size_scale_range, speed_scale_range (tuple): Random scales of a new enemy.
+        is_range_scaled (bool): Attack ranges scale with the size.
+        is_ranged (bool): Attacks from a distance by throwing a FlyingSword.
+        flashed (dict): Frame -> white copy shown when getting damage.
+    """
+    def __init__(self, cls, obstacle_sprites, player):
+        self.cls = cls
+        prototype = cls((0,0), [], obstacle_sprites, player)
+        self.prototype = prototype
+        self.animations = prototype.animations
+        self.anim_lengths = [len(self.animations[state][0]) for state in ANIM_STATES]
+        self.scream_sounds = prototype.scream_sounds
+        self.bleeding_sounds = prototype.bleeding_sounds
+        self.size_scale_range, self.speed_scale_range, self.is_range_scaled = HORDE_KINDS[cls]
+        self.is_ranged = cls is Skeleton
+        self.flashed = {}
+
+    def get_flashed(self, image):
+        if (image not in self.flashed):
+            flashed = image.copy()
+            flashed.fill((255,255,255,0),special_flags=pygame.BLEND_RGBA_MAX)
+            self.flashed[image] = flashed
+        return self.flashed[image]
+
+class HordeEnemy(pygame.sprite.Sprite):
+    """
+    Thin view of one enemy of a Horde, used for rendering and by bullets/explosions.
+    All the state lives in the horde arrays.
+
+    Attributes:
+        horde (Horde): Horde owning the state.
+        index (int): Row of the enemy in the horde arrays.
+        kind (HordeKind): Shared data of the enemy class.
+        image (Surface): Current frame, set when the enemy is in view.
+        rect (Rect): Image rect, set when the enemy is in view.
+        zindex (int): Rendering layer.
+
+    Methods:
+        hitbox: Rect of the hitbox computed from the arrays.
+        is_dead: Whether the enemy is dead.
+        get_damage(damage): Deals damage to the enemy.
+        bleed(pos): Emits blood and plays a bleeding sound.
+    """
+    def __init__(self, horde, index, kind):
+        super().__init__()
+        self.horde = horde
+        self.index = index
+        self.kind = kind
+        self.image = kind.animations['idle'][0][0]
+        self.rect = pygame.Rect(0,0,0,0)
+        self.zindex = 1
+
+    @property
+    def hitbox(self):
+        horde, i = self.horde, self.index
+        if (not horde.active[i]): return pygame.Rect(0,0,0,0)
+        w, h = horde.hitbox_size[i]
+        x, y = horde.pos[i]
+        return pygame.Rect(x-w/2, y-h/2, w, h)
+
+    @property
+    def is_dead(self):
+        return bool(self.horde.is_dead[self.index])
+
+    def get_damage(self, damage = 0):
+        self.horde.get_damage(self.index, damage)
+
+    def bleed(self, bullet_pos):
+        system.level.create_blood(bullet_pos)
+        self.kind.bleeding_sounds.play()
+
+class Horde():
+    """
+    Structure of arrays simulation of many enemies. Every frame is advanced with
+    batched NumPy operations, the HordeEnemy views are only touched when in view.
+
+    Same behaviour as BasedZombie (wander, chase, attack, die) except that the
+    chase uses the level flow field (path length <= distance_to_follow) instead
+    of the per zombie sight check, so hiding behind walls doesn't work on a horde.
+
+    Attributes:
+        obstacle_sprites (ObstacleGroup): Walls of the level.
+        player (Player): Target of the horde.
+        kinds (dict): Enemy class -> HordeKind.
+        kind_list (list): HordeKind by kind_id.
+        views (list): HordeEnemy of every row.
+        count (int): Number of used rows.
+        blocked (ndarray): (rows, cols) wall occupancy of the map.
+        max_screams (int): Max scream sounds started per frame.
+        previous_pos (ndarray): (n, 2) positions at the start of the step, for the render interpolation.
+        pos, target_point, direction, hitbox_size, rect_size (ndarray): (n, 2) columns.
+        speed, trigger_speed, current_speed, health, ... (ndarray): (n,) columns, see COLUMNS.
+
+    Methods:
+        spawn(cls, pos): Adds an enemy of class cls at pos (topleft), returns its view.
+        update(): Advances every enemy by one frame.
+        get_damage(i, damage): Deals damage to one enemy.
+        live_hitboxes(): Returns the views of the live enemies and their (n, 4) int hitboxes.
+        store_previous(): Keeps the positions at the start of a step.
+        visible_sprites(view_rect, alpha): Syncs and returns the views inside view_rect,
+            placed alpha (0-1) of a step after store_previous().
+    """
+    COLUMNS = {
+        #vectors
+        'pos': (2, float), 'target_point': (2, float), 'direction': (2, float),
+        'hitbox_size': (2, float), 'rect_size': (2, float),
+        #traits
+        'kind_id': (1, int), 'speed': (1, float), 'trigger_speed': (1, float), 'max_health': (1, float),
+        'damage': (1, float), 'attack_range': (1, float), 'attack_range_trigger': (1, float),
+        'distance_to_follow': (1, float), 'attack_cooldown': (1, float), 'attack_cooldown_std': (1, float),
+        'attack_damage_after': (1, float), 'attack_damage_after_limit': (1, float),
+        'corpse_despawn_time': (1, float), 'scream_cooldown': (1, float), 'scream_cooldown_std': (1, float),
+        'wandering_distance': (1, float), 'standing_time': (1, float), 'prob_standing': (1, float),
+        'animation_speed': (1, float), 'shift_y': (1, float),
+        #state
+        'current_speed': (1, float), 'health': (1, float), 'current_standing_time': (1, float),
+        'attack_current_cooldown': (1, float), 'scream_current_cooldown': (1, float),
+        'corpse_despawn_current_time': (1, float), 'getting_damage_current_delay': (1, float),
+        'frame_index': (1, float), 'anim_state': (1, int),
+        'on_trigger': (1, bool), 'is_attacking': (1, bool), 'attack_anim_start': (1, bool),
+        'dealing_damage_yet': (1, bool), 'is_dead': (1, bool), 'active': (1, bool),
+    }
+
+    def __init__(self, obstacle_sprites, player, map_size, capacity = 256):
+        self.obstacle_sprites = obstacle_sprites
+        self.player = player
+        self.kinds = {}
+        self.kind_list = []
+        self.views = []
+        self.count = 0
+        self.capacity = 0
+        self.max_screams = 4
+        self.getting_damage_delay = 0.05
+        self.previous_pos = np.zeros((0, 2))
+
+        cols, rows = map_size
+        self.blocked = np.zeros((rows, cols), bool)
+        for col, row in obstacle_sprites.grid.cells:
+            if (0<=col<cols and 0<=row<rows): self.blocked[row, col] = True
+
+        for name, (width, dtype) in self.COLUMNS.items():
+            setattr(self, name, np.zeros((0, width) if width>1 else 0, dtype))
+        self.grow(capacity)
+
+    def grow(self, capacity):
+        for name, (width, dtype) in self.COLUMNS.items():
+            column = getattr(self, name)
+            new_column = np.zeros((capacity, width) if width>1 else capacity, dtype)
+            new_column[:self.count] = column[:self.count]
+            setattr(self, name, new_column)
+        self.capacity = capacity
+
+    def get_kind(self, cls):
+        if (cls not in self.kinds):
+            self.kinds[cls] = HordeKind(cls, self.obstacle_sprites, self.player)
+            self.kind_list.append(self.kinds[cls])
+        return self.kinds[cls]
+
+    def spawn(self, cls, pos):
+        kind = self.get_kind(cls)
+        if (self.count==self.capacity): self.grow(self.capacity*2)
+        i = self.count
+        self.count += 1
+        prototype = kind.prototype
+        proto_scale = prototype.zombie_size_scale
+        size_scale = random.uniform(*kind.size_scale_range)
+        speed_scale = random.uniform(*kind.speed_scale_range)
+
+        self.kind_id[i] = self.kind_list.index(kind)
+        self.hitbox_size[i] = np.array(prototype.hitbox.size)/proto_scale*size_scale
+        self.rect_size[i] = np.array(prototype.rect.size)/proto_scale*size_scale
+        #the constructors put the hitbox at pos then scale it from its topleft
+        self.pos[i] = np.array(pos)+self.hitbox_size[i]/2
+        self.target_point[i] = self.pos[i]
+        self.speed[i] = prototype.speed/prototype.speed_scale*speed_scale
+        self.trigger_speed[i] = prototype.trigger_speed/prototype.speed_scale*speed_scale
+        range_scale = size_scale/proto_scale if kind.is_range_scaled else 1
+        self.attack_range[i] = prototype.attack_range*range_scale
+        self.attack_range_trigger[i] = prototype.attack_range_trigger*range_scale
+        for name in ['max_health', 'damage', 'distance_to_follow', 'attack_cooldown', 'attack_cooldown_std',
+                    'attack_damage_after', 'attack_damage_after_limit', 'corpse_despawn_time',
+                    'scream_cooldown', 'scream_cooldown_std', 'wandering_distance', 'standing_time',
+                    'prob_standing', 'animation_speed', 'shift_y']:
+            getattr(self, name)[i] = getattr(prototype, name)
+
+        self.current_speed[i] = self.speed[i]
+        self.health[i] = self.max_health[i]
+        self.current_standing_time[i] = 0
+        self.attack_current_cooldown[i] = 0
+        self.scream_current_cooldown[i] = self.scream_cooldown[i]+random.uniform(-1,1)*self.scream_cooldown_std[i]
+        self.corpse_despawn_current_time[i] = 0
+        self.getting_damage_current_delay[i] = 0
+        self.frame_index[i] = 0
+        self.anim_state[i] = IDLE
+        self.direction[i] = 0
+        self.on_trigger[i] = False
+        self.is_attacking[i] = False
+        self.attack_anim_start[i] = False
+        self.dealing_damage_yet[i] = False
+        self.is_dead[i] = False
+        self.active[i] = True
+
+        view = HordeEnemy(self, i, kind)
+        self.views.append(view)
+        return view
+
+    def get_damage(self, i, damage):
+        if (self.is_dead[i]): return
+        self.getting_damage_current_delay[i] = self.getting_damage_delay
+        self.health[i] -= damage
+        if (self.health[i]<=0):
+            self.is_dead[i] = True
+            self.frame_index[i] = 0 #die animation
+            system.level.enemy_index.remove(self.views[i])
+
+    def cancel_trigger(self, mask):
+        "vectorized BasedZombie.cancel_trigger"
+        mask = mask & (self.current_standing_time[:self.count]<=0)
+        n = self.count
+        standing = mask & (random.uniform(size = n)<self.prob_standing[:n])
+        wandering = mask & ~standing
+        self.current_speed[:n][standing] = 0
+        self.current_standing_time[:n][standing] = self.standing_time[:n][standing]
+        distance = self.wandering_distance[:n][wandering]
+        dpos = random.uniform(-1,1,(len(distance),2))*distance[:,None]
+        self.target_point[:n][wandering] = self.pos[:n][wandering]+dpos.round()
+        self.current_speed[:n][wandering] = self.speed[:n][wandering]
+
+    def collide(self, pos, size):
+        "hitboxes hitting a wall, every tile from the first to the last one covered is checked"
+        left_top = pos-size/2
+        right_bottom = left_top+size-1
+        first = np.floor(left_top/TILESIZE).astype(int)
+        last = np.floor(right_bottom/TILESIZE).astype(int)
+        rows, cols = self.blocked.shape
+        hit = np.zeros(len(pos), bool)
+        if (len(pos)==0): return hit
+        span = (last-first).max(axis = 0)+1
+        for dx in range(span[0]):
+            col = first[:,0]+dx
+            for dy in range(span[1]):
+                row = first[:,1]+dy
+                inside = (col<=last[:,0]) & (row<=last[:,1]) & (col>=0) & (col<cols) & (row>=0) & (row<rows)
+                hit[inside] |= self.blocked[row[inside], col[inside]]
+        return hit
+
+    def move(self, alive, dt):
+        n = self.count
+        pos = self.pos[:n]
+        attacking = self.is_attacking[:n]
+
+        #update standing time
+        self.current_standing_time[:n] = np.maximum(self.current_standing_time[:n]-dt, 0)
+        mask = alive & (self.current_standing_time[:n]<=0) & (self.current_speed[:n]==0) & ~attacking
+        self.current_speed[:n][mask] = self.speed[:n][mask]
+
+        #move to point then relize there's no one
+        reached = np.linalg.norm(self.target_point[:n]-pos, axis = 1)<=self.attack_range_trigger[:n]
+        self.cancel_trigger(alive & reached & ~self.on_trigger[:n] & ~attacking)
+
+        #chase along the flow field
+        target_pos = np.array(self.player.hitbox.center, float)
+        flow_field = system.level.flow_field
+        distance_array, next_array = flow_field.as_arrays()
+        cells = np.floor(pos/TILESIZE).astype(int)
+        rows, cols = distance_array.shape
+        inside = (cells[:,0]>=0) & (cells[:,0]<cols) & (cells[:,1]>=0) & (cells[:,1]<rows)
+        cells = np.where(inside[:,None], cells, 0)
+        path = np.where(inside, distance_array[cells[:,1], cells[:,0]], -1)*float(TILESIZE)
+        follow = self.distance_to_follow[:n]
+        chase = alive & (path>=0) & ((path<=follow) | (follow==-1))
+        trigger = chase & ~attacking
+        next_point = next_array[cells[:,1], cells[:,0]]
+        #same or next tile: go straight to the target
+        near = path<=TILESIZE
+        next_point[near] = target_pos
+        trigger &= ~np.isnan(next_point[:,0])
+        self.target_point[:n][trigger] = next_point[trigger]
+        self.current_speed[:n][trigger] = self.trigger_speed[:n][trigger]
+        self.on_trigger[:n] = trigger
+
+        #update direction
+        direction = self.target_point[:n]-pos
+        length = np.linalg.norm(direction, axis = 1)
+        moving = alive & (length!=0)
+        direction[moving] /= length[moving][:,None]
+        self.direction[:n][alive] = direction[alive]
+
+        step = (dt*self.current_speed[:n])[:,None]*self.direction[:n]
+        new_pos = pos+step
+        hit = alive & self.collide(new_pos, self.hitbox_size[:n])
+        move = alive & ~hit
+        pos[move] = new_pos[move]
+        self.cancel_trigger(hit)
+
+    def attack(self, alive, dt):
+        n = self.count
+        self.attack_current_cooldown[:n][alive] = np.maximum(self.attack_current_cooldown[:n][alive]-dt, 0)
+        cooldown = self.attack_current_cooldown[:n]
+        target_pos = np.array(self.player.hitbox.center, float)
+        distance = np.linalg.norm(self.pos[:n]-target_pos, axis = 1)
+
+        in_trigger = alive & (distance<=self.attack_range_trigger[:n])
+        self.is_attacking[:n][in_trigger] = True
+        start = in_trigger & (cooldown==0)
+        self.attack_anim_start[:n][start] = True
+        cooldown[start] = self.attack_cooldown[:n][start]+random.uniform(-1,1,start.sum())*self.attack_cooldown_std[:n][start]
+        self.current_speed[:n][start] = 0
+        stop = alive & ~in_trigger & (cooldown==0)
+        self.is_attacking[:n][stop] = False
+
+        #deal damage
+        is_ranged = np.array([kind.is_ranged for kind in self.kind_list])[self.kind_id[:n]]
+        in_range = is_ranged | (distance<=self.attack_range[:n])
+        deal = (alive & in_range & self.is_attacking[:n] & ~self.dealing_damage_yet[:n]
+                & (cooldown<=self.attack_cooldown[:n]-self.attack_damage_after[:n])
+                & (cooldown>=self.attack_cooldown[:n]-self.attack_damage_after_limit[:n]))
+        self.dealing_damage_yet[:n][deal] = True
+        for i in np.nonzero(deal)[0]:
+            view = self.views[i]
+            if (view.kind.is_ranged):
+                FlyingSword(pygame.math.Vector2(self.pos[i].tolist()),[system.camera],self.obstacle_sprites,self.player, zindex=2)
+            else: self.player.get_damage(self.damage[i])
+
+    def update_animation(self, dt):
+        n = self.count
+        active = self.active[:n]
+        self.frame_index[:n] += self.animation_speed[:n]*dt
+        lengths = np.array([kind.anim_lengths for kind in self.kind_list])[self.kind_id[:n]]
+
+        #corpses
+        dead = active & self.is_dead[:n]
+        self.anim_state[:n][dead] = DYING
+        self.corpse_despawn_current_time[:n][dead] += dt
+        despawn = dead & (self.corpse_despawn_current_time[:n]>=self.corpse_despawn_time[:n])
+        self.active[:n][despawn] = False
+        for i in np.nonzero(despawn)[0]:
+            self.views[i].kill()
+
+        alive = active & ~self.is_dead[:n]
+        start = alive & self.is_attacking[:n] & self.attack_anim_start[:n]
+        self.attack_anim_start[:n][start] = False
+        self.anim_state[:n][start] = ATTACKING
+        self.frame_index[:n][start] = 0
+        self.dealing_damage_yet[:n][start] = False
+        not_attacking = alive & (self.anim_state[:n]!=ATTACKING)
+        walking = (np.linalg.norm(self.direction[:n], axis = 1)>1e-2) & (self.current_speed[:n]>0)
+        self.anim_state[:n][not_attacking] = np.where(walking[not_attacking], WALKING, IDLE)
+
+        length = lengths[np.arange(n), self.anim_state[:n]]
+        end = alive & (self.frame_index[:n]>=length)
+        self.frame_index[:n][end] = 0
+        self.anim_state[:n][end & (self.anim_state[:n]==ATTACKING)] = WALKING
+
+        self.getting_damage_current_delay[:n] = np.maximum(self.getting_damage_current_delay[:n]-dt, 0)
+
+    def update_scream(self, alive, dt):
+        n = self.count
+        self.scream_current_cooldown[:n][alive] -= dt
+        scream = alive & (self.scream_current_cooldown[:n]<=0)
+        self.scream_current_cooldown[:n][scream] = (self.scream_cooldown[:n][scream]
+            +random.uniform(-1,1,scream.sum())*self.scream_cooldown_std[:n][scream])
+        target_pos = np.array(self.player.hitbox.center, float)
+        distance = np.linalg.norm(self.pos[:n]-target_pos, axis = 1)
+        scream &= distance<=self.distance_to_follow[:n]*1.5
+        for i in np.nonzero(scream)[0][:self.max_screams]:
+            self.views[i].kind.scream_sounds.play()
+
+    def update(self):
+        if (self.count==0): return
+        dt = system.delta_time
+        n = self.count
+        alive = self.active[:n] & ~self.is_dead[:n]
+        self.move(alive, dt)
+        self.update_animation(dt)
+        alive = self.active[:n] & ~self.is_dead[:n]
+        self.attack(alive, dt)
+        self.update_scream(alive, dt)
+
+    def live_hitboxes(self):
+        "for EnemyIndex.build_arrays, same rects as HordeEnemy.hitbox"
+        n = self.count
+        live = np.nonzero(self.active[:n] & ~self.is_dead[:n])[0]
+        size = self.hitbox_size[live]
+        boxes = np.concatenate([self.pos[live]-size/2, size], axis = 1).astype(int)
+        return [self.views[i] for i in live], boxes
+
+    def store_previous(self):
+        self.previous_pos = self.pos[:self.count].copy()
+
+    def visible_sprites(self, view_rect, alpha = 1):
+        n = self.count
+        if (n==0): return []
+        pos = self.pos[:n]
+        if (alpha<1):
+            #rows spawned during the step have no previous position
+            previous = len(self.previous_pos)
+            pos = pos.copy()
+            pos[:previous] += (alpha-1)*(pos[:previous]-self.previous_pos)
+        rect_center = pos+np.stack([np.zeros(n), self.shift_y[:n]], axis = 1)
+        half = self.rect_size[:n]/2
+        visible = (self.active[:n]
+            & (rect_center[:,0]+half[:,0]>=view_rect.left) & (rect_center[:,0]-half[:,0]<=view_rect.right)
+            & (rect_center[:,1]+half[:,1]>=view_rect.top) & (rect_center[:,1]-half[:,1]<=view_rect.bottom))
+        sprites = []
+        for i in np.nonzero(visible)[0]:
+            view = self.views[i]
+            kind = view.kind
+            turn_left = int(self.direction[i,0]<0)
+            state = self.anim_state[i]
+            animation = kind.animations[ANIM_STATES[state]][turn_left]
+            frame = min(int(self.frame_index[i]), len(animation)-1)
+            image = animation[frame]
+            if (self.getting_damage_current_delay[i]>0 and state!=DYING): image = kind.get_flashed(image)
+            view.image = image
+            view.rect.size = self.rect_size[i]
+            view.rect.center = rect_center[i]
+            sprites.append(view)
+        return sprites
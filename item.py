@@ -31,7 +31,7 @@ class ItemInventory():
         
     def import_asset(self):
         path = self.path + 'avatar.png'
-        image = pygame.image.load(path)
+        image = file.import_image(path, convert = False)
         self.avatar = image
     
     def change_owner(self):
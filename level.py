@@ -1,19 +1,27 @@
 import pygame
 from settings import *
-from tile import Tile
+from tile import Tile, StaticTileLayer, bake_chunks
+from grid import ObstacleGroup, FlowField, EnemyIndex
+from light import Lighting
 from player import Player
 import system
-from os import walk
 import file
 from math import sqrt, exp2, pi, cos, sin
 phi = ( 1 + sqrt(5) ) / 2
 from weapon import Weapon, Gun, FlameThrower
-from bullet import Bullet, FlameBullet, Missile
+from bullet import Bullet, FlameBullet, Missile, reclaim_projectiles
 from enemy import Zombie, Bat, FlyingSword, Skeleton
+from horde import Horde, HordeEnemy
 from ui import UI, Button, Text, Font
-from particle import Blood, FlamePariticle
+from particle import ParticleEmitter
 from random import uniform
 from sound import Playlist
+from collections import OrderedDict
+import weakref
+from bisect import bisect_left, bisect_right, insort
+from operator import itemgetter
+from time import perf_counter
+import numpy as np
 
 #render layers:
 # - background tile
@@ -26,26 +34,58 @@ render_layers = {
     'o2': 5, 'p2': 6, 't2': 7, 'UI': 8
 }
 
+def non_empty_tiles(layout):
+    "(row, col, tile index) of the non empty (!= -1) cells of a layer"
+    rows, cols = np.nonzero(layout!=-1)
+    return zip(rows.tolist(), cols.tolist(), layout[rows, cols].tolist())
+
+def bake_level(level_path):
+    "bake_chunks of each visible layer of a level, runs on the preloader worker"
+    sprite_sheet = file.SpriteSheet(level_path+'sheet.png',TILESIZE,TILESIZE,convert=False)
+    baked = []
+    for kind, layout in file.import_level_layers(level_path):
+        if (kind!='visible'): continue
+        tiles = {(col,row): sprite_sheet.get_image(idx) for row, col, idx in non_empty_tiles(layout)}
+        baked.append(bake_chunks(tiles, on_worker=True))
+    return baked
+
+#asset folders every level loads from (player, inventory, enemies, hud)
+LEVEL_ASSET_FOLDERS = ['graphics/player/', 'graphics/weapon/', 'graphics/enemy/', 'graphics/food/',
+    'graphics/light/', 'graphics/ui/']
+
 class Level():
     """
     Represents a game level with various entities including the player, enemies, 
     visible and obstacle sprites, and other elements necessary for gameplay.
 
     Attributes:
+        level_name: Folder of the level map (class attribute).
         screen: The main display surface from the system.
         visible_sprites: A YSortCameraGroup instance managing sprites to be rendered.
-        obstacle_sprites: A Pygame sprite group for obstacles in the level.
+        static_layers: StaticTileLayer per visible layer when STATIC_TILE_CHUNKS is on.
+        obstacle_sprites: An ObstacleGroup of the level walls, with a grid for collision queries.
         ui: The user interface associated with the level.
-        light_image: The light effect image used for rendering lighting effects.
+        lighting: Lighting of the level, the player, explosions and flames add their light every frame.
+        blood, flames: ParticleEmitter of the blood and flame particles, drawn by visible_sprites.
         is_end: Boolean indicating if the level has ended.
         sprite_sheet: The sprite sheet containing level tiles.
+        sprite_sheet_stats: Requests and unique frames of sprite_sheet once the map is built.
         player: The player character in the level.
         enemies: A list of enemy instances in the level.
+        map_size: Size of the map in tiles.
+        flow_field: FlowField toward the player shared by the enemies.
+        horde: Horde simulating the map enemies when HORDE_MODE is on, else None.
+        enemy_index: EnemyIndex of the live enemies for the projectiles, rebuilt every step, kept up to date during it.
         darkness_value: An integer representing the current level of darkness.
+        phase_times: Seconds spent in each phase by the last step (update, horde) and render (draw, lighting, ui, transitions).
     
     Methods:
         create_map(): Sets up the level by loading the map, obstacles, and enemies.
-        update(): Updates and renders the level, handles input, and manages the game state.
+        step(): Advances the simulation by one fixed step (system.delta_time): camera, sprites, horde, timers and input.
+        render(alpha): Draws the level, the sprites interpolated alpha of a step after the previous step.
+        update(): One step and its render.
+        darkness_and_zoom_input(): Changes the darkness ([ and ]) and the zoom (mouse wheel), the wheel notch is used up.
+        draw_transitions(): Draws the transition in, loss and victory circles.
         loss(): Placeholder method for handling level loss conditions.
         victory(): Placeholder method for handling level victory conditions.
         check_win(): Checks if all enemies are defeated.
@@ -54,26 +94,38 @@ class Level():
         create_bullet(weapon, type='bullet'): Creates a bullet or projectile.
         create_blood(pos, zindex=2): Creates a blood effect at a given position.
         create_flame_particle(pos, zindex=2): Creates a flame particle effect at a given position.
+        draw_transition_circle(radius, color, inside): Fills the inside or the outside of a screen centered circle,
+            on the GPU in CRT mode (system.post_effects).
+        preload_assets(): Queues the files of the level and the baking of its tiles on file.preloader (class method).
     """
+    level_name = 'xx'
+
     def __init__(self, level='xx', music_file = 'level.wav'):
+        #the projectiles of the previous level go back to their pools
+        reclaim_projectiles()
         self.screen = system.screen
         self.visible_sprites = YSortCameraGroup()
-        self.obstacle_sprites = pygame.sprite.Group()
+        self.obstacle_sprites = ObstacleGroup()
         self.level = level
         self.create_map()
+        self.sprite_sheet_stats = self.sprite_sheet.stats()
         self.ui = UI(self.player)
 
         light_path = PATH + 'graphics/light/light.png'
-        self.light_image = pygame.image.load(light_path)
+        self.lighting = Lighting(file.import_image(light_path, convert = False))
+        self.blood = ParticleEmitter(PATH + 'graphics/particle/blood/')
+        self.flames = ParticleEmitter(PATH + 'graphics/particle/flame/', FLAME_LIGHT_SIZE)
+        self.visible_sprites.batch_providers += [self.blood, self.flames]
 
         system.level = self
         self.is_end = False
 
         BGM_PATH = PATH + 'sound/' + music_file
-        pygame.mixer.music.load(BGM_PATH)
-        pygame.mixer.music.play(-1)
-        self.loss_sound = pygame.mixer.Sound(PATH + 'sound/death.wav')
-        self.victory_sound = pygame.mixer.Sound(PATH + 'sound/victory.wav')
+        if (system.play_music):
+            pygame.mixer.music.load(BGM_PATH)
+            pygame.mixer.music.play(-1)
+        self.loss_sound = file.import_sound(PATH + 'sound/death.wav')
+        self.victory_sound = file.import_sound(PATH + 'sound/victory.wav')
 
         self.transition_time = 1.5
         self.current_transition_in = self.transition_time
@@ -90,53 +142,61 @@ class Level():
         level = self.level
         room_id = 0 #wolrd, level, map, scene, room
         level_path = PATH + 'level/' + level + '/' + str(room_id) + '/'
-        visible_path = level_path + 'visible/'
-        obstacle_path = level_path + 'obstacle/'
-        enemy_path = level_path + 'enemy/'
 
         #this is level tile sheet
         self.sprite_sheet = file.SpriteSheet(level_path+'sheet.png',TILESIZE,TILESIZE)
-
-        for _,__,csv_files in walk(visible_path):
-            for zindex, filename in enumerate(csv_files):
-                layout = file.import_csv_layout(visible_path+filename)
-                for row_index,row in enumerate(layout):
-                    for col_index, col in enumerate(row):
-                        idx = int(col) #tile index frame
-                        if (idx==-1):
-                            continue
-                        x = col_index*TILESIZE
-                        y = row_index*TILESIZE
-                        Tile((x,y),[self.visible_sprites],self.sprite_sheet.get_image(idx),zindex)
-
-        for _,__,csv_files in walk(obstacle_path):
-            for zindex, filename in enumerate(csv_files):
-                layout = file.import_csv_layout(obstacle_path+filename)
-                for row_index,row in enumerate(layout):
-                    for col_index, col in enumerate(row):
-                        idx = int(col) #tile index frame
-                        if (idx==-1):
-                            continue
-                        x = col_index*TILESIZE
-                        y = row_index*TILESIZE
-                        Tile((x,y),[self.obstacle_sprites],self.sprite_sheet.get_image(idx),zindex)
+        #compiled file (compile_levels.py) or csv, in drawing order
+        layers = file.import_level_layers(level_path)
+        #chunks already baked by the preloader
+        baked = file.preloader.take(('baked', level_path)) if STATIC_TILE_CHUNKS else None
+
+        self.static_layers = []
+        visible_layers = [tiles for kind, tiles in layers if kind=='visible']
+        for zindex, layout in enumerate(visible_layers):
+            self.map_size = (layout.shape[1], layout.shape[0])
+            static_layer = StaticTileLayer([self.visible_sprites],zindex)
+            if (baked!=None):
+                static_layer.bake(baked[zindex])
+                self.static_layers.append(static_layer)
+                continue
+            for row_index, col_index, idx in non_empty_tiles(layout):
+                if (STATIC_TILE_CHUNKS):
+                    static_layer.add(col_index,row_index,self.sprite_sheet.get_image(idx))
+                    continue
+                x = col_index*TILESIZE
+                y = row_index*TILESIZE
+                Tile((x,y),[self.visible_sprites],self.sprite_sheet.get_image(idx),zindex)
+            if (STATIC_TILE_CHUNKS):
+                static_layer.bake()
+                self.static_layers.append(static_layer)
+
+        obstacle_layers = [tiles for kind, tiles in layers if kind=='obstacle']
+        for zindex, layout in enumerate(obstacle_layers):
+            for row_index, col_index, idx in non_empty_tiles(layout):
+                x = col_index*TILESIZE
+                y = row_index*TILESIZE
+                Tile((x,y),[self.obstacle_sprites],self.sprite_sheet.get_image(idx),zindex)
+        self.obstacle_sprites.build_grid()
+        self.flow_field = FlowField(self.obstacle_sprites, self.map_size)
 
         self.player = Player(player_pos,[self.visible_sprites], self.obstacle_sprites, 1)
         self.enemies = []
+        self.enemy_index = EnemyIndex()
+        self.horde = None
+        if (HORDE_MODE):
+            self.horde = Horde(self.obstacle_sprites, self.player, self.map_size)
+            self.visible_sprites.sprite_providers.append(self.horde)
 
         enemy_lst = [Zombie, Bat, Skeleton]
-        for _,__,csv_files in walk(enemy_path):
-            for zindex, filename in enumerate(csv_files):
-                layout = file.import_csv_layout(enemy_path+filename)
-                for row_index,row in enumerate(layout):
-                    for col_index, col in enumerate(row):
-                        idx = int(col) #tile index frame
-                        if (idx==-1):
-                            continue
-                        x = col_index*TILESIZE
-                        y = row_index*TILESIZE
-                        enemy = enemy_lst[idx]((x,y),[self.visible_sprites], self.obstacle_sprites, self.player)
-                        self.enemies.append(enemy)
+        enemy_layers = [tiles for kind, tiles in layers if kind=='enemy']
+        for layout in enemy_layers:
+            for row_index, col_index, idx in non_empty_tiles(layout):
+                x = col_index*TILESIZE
+                y = row_index*TILESIZE
+                if (self.horde!=None):
+                    enemy = self.horde.spawn(enemy_lst[idx],(x,y))
+                else: enemy = enemy_lst[idx]((x,y),[self.visible_sprites], self.obstacle_sprites, self.player)
+                self.enemies.append(enemy)
 
         # self.visible_sprites.box = Tile((0,0),[self.visible_sprites],pygame.image.load('oop/image/test/rock.png').convert_alpha(),100)
 
@@ -150,56 +210,114 @@ class Level():
         #                 for xpos in [500,600,700, 800, 900]]
         
         self.darkness_value = 120
+        self.phase_times = {}
+
+    def step(self):
+        "one simulation step of system.delta_time (timestep.py), draws nothing"
+        start = perf_counter()
+        self.visible_sprites.store_previous()
+        self.lighting.clear()
+        self.darkness_and_zoom_input()
+        self.visible_sprites.update_camera(self.player)
+        self.flow_field.update(self.player.hitbox.center)
+        if (self.horde!=None):
+            swords = [enemy for enemy in self.enemies if not isinstance(enemy, HordeEnemy)]
+            self.enemy_index.build_arrays(*self.horde.live_hitboxes(), others = swords)
+        else: self.enemy_index.build(self.enemies)
+        if (not self.is_end):
+            #particles spawned by the sprites start moving next step, like new sprites
+            self.blood.update()
+            self.flames.update()
+            self.visible_sprites.update()
+        update_end = perf_counter()
+        if (not self.is_end and self.horde!=None): self.horde.update()
+        horde_end = perf_counter()
+        self.lighting.add(self.player.hitbox.center, PLAYER_LIGHT_SIZE)
+        self.update_transition_in()
+        self.update_loss_screen()
+        self.update_victory()
+        self.phase_times['update'] = update_end-start
+        self.phase_times['horde'] = horde_end-update_end
+        system.profiler.record('update', start, update_end)
+        system.profiler.record('horde', update_end, horde_end)
 
-    def update(self):
-        self.visible_sprites.custom_draw(self.player)
-        if (not self.is_end): self.visible_sprites.update()
+        if (system.controls.keys()[pygame.K_ESCAPE]):
+            system.go_to_level()
 
-        filter = pygame.surface.Surface(self.screen.get_size())
-        keys = pygame.key.get_pressed()
+        if (self.check_win()):
+            self.victory()
+
+    def render(self, alpha = 1):
+        "draws the level alpha (0-1) of a step after the previous step"
+        start = perf_counter()
+        self.visible_sprites.custom_draw(self.player, alpha)
+        draw_end = perf_counter()
+        # self.darkness_value = 0
+        self.lighting.render(self.screen, self.visible_sprites, self.darkness_value)
+        lighting_end = perf_counter()
+        self.ui.display()
+        ui_end = perf_counter()
+        self.draw_transitions()
+        transitions_end = perf_counter()
+        self.phase_times.update({'draw': draw_end-start, 'lighting': lighting_end-draw_end,
+            'ui': ui_end-lighting_end, 'transitions': transitions_end-ui_end})
+        if (system.profiler.enabled):
+            for name, end in (('draw', draw_end), ('lighting', lighting_end), ('ui', ui_end), ('transitions', transitions_end)):
+                system.profiler.record(name, start, end)
+                start = end
+
+    def darkness_and_zoom_input(self):
+        keys = system.controls.keys()
         if keys[pygame.K_LEFTBRACKET]: 
             self.darkness_value -= 10
             self.darkness_value = max(self.darkness_value,0)
         if keys[pygame.K_RIGHTBRACKET]:
             self.darkness_value += 10
             self.darkness_value = min(self.darkness_value,255)
-        # self.darkness_value = 0
-        if (self.darkness_value>0):
-            color = (self.darkness_value,self.darkness_value,self.darkness_value,255)
-            filter.fill(color)
-            obj = pygame.sprite.Sprite()
-            obj.image = self.light_image
-            obj.rect = pygame.rect.Rect((0,0), (1000,1000))
-            obj.rect.center = self.player.hitbox.center
-            self.visible_sprites.draw_sprite(obj, filter)
-            self.screen.blit(filter, (0, 0), special_flags=pygame.BLEND_RGBA_SUB)
 
         if system.mouse_scroll == 1:
             if (self.visible_sprites.zoom_out_scale>0.2*2): self.visible_sprites.zoom_out_scale -= 0.1
         if system.mouse_scroll == -1:
             if (self.visible_sprites.zoom_out_scale<4): self.visible_sprites.zoom_out_scale += 0.1
-        self.ui.display()
-        self.update_transition_in()
-        self.update_loss_screen()
-        self.update_victory()
+        #one notch zooms once, however many steps the frame runs
+        system.mouse_scroll = 0
 
-        if (keys[pygame.K_ESCAPE]):
-            system.go_to_level()
-
-        if (self.check_win()):
-            self.victory()
+    def update(self):
+        "one step and its render, for callers running the simulation themselves (benchmark.py)"
+        self.step()
+        self.render()
     
     def update_transition_in(self):
         if (self.current_transition_in<=0):
             return
         self.current_transition_in -= system.delta_time
 
-        ratio = 1-self.current_transition_in/self.transition_time
-        radius = pygame.math.Vector2(self.screen.get_size()).magnitude()/2*(1.5)*ratio
+    def draw_transitions(self):
+        radius = pygame.math.Vector2(self.screen.get_size()).magnitude()/2*1.5
+        if (self.current_transition_in>0):
+            ratio = 1-self.current_transition_in/self.transition_time
+            self.draw_transition_circle(radius*ratio, (0, 0, 0), inside = False)
+        if (self.is_loss):
+            ratio = 1-self.current_transition_loss/self.transition_time
+            self.draw_transition_circle(radius*ratio, (255, 0, 0), inside = True)
+        if (self.is_victory and self.victory_current_time<=0):
+            ratio = self.current_transition_out/self.transition_time
+            self.draw_transition_circle(radius*ratio, (0, 0, 0), inside = False)
+
+    def draw_transition_circle(self, radius, color, inside):
+        "fills the inside (or the outside) of a circle centered on the screen"
+        if (system.post_effects!=None):
+            system.post_effects.add_circle(radius, color, inside)
+            return
         transition_surf = pygame.Surface(self.screen.get_size())
-        pygame.draw.circle(transition_surf, (255, 255, 255), 
-            pygame.math.Vector2(self.screen.get_size())/2, radius)
-        transition_surf.set_colorkey((255, 255, 255))
+        center = pygame.math.Vector2(self.screen.get_size())/2
+        if (inside):
+            pygame.draw.circle(transition_surf, color, center, radius)
+            transition_surf.set_colorkey((0, 0, 0))
+        else:
+            transition_surf.fill(color)
+            pygame.draw.circle(transition_surf, (255, 255, 255), center, radius)
+            transition_surf.set_colorkey((255, 255, 255))
         self.screen.blit(transition_surf, (0,0))
 
     def loss(self):
@@ -207,6 +325,7 @@ class Level():
         self.is_end = True
         pygame.mixer.music.stop()
         self.loss_sound.play()
+        if (system.preload_level!=None): system.preload_level('restart')
 
     def update_loss_screen(self):
         if (not self.is_loss): return
@@ -216,13 +335,6 @@ class Level():
         self.loss_screen_current_time -= system.delta_time
         self.current_transition_loss -= system.delta_time
         self.current_transition_loss = max(self.current_transition_loss,0)
-        ratio = 1-self.current_transition_loss/self.transition_time
-        radius = pygame.math.Vector2(self.screen.get_size()).magnitude()/2*1.5*ratio
-        transition_surf = pygame.Surface(self.screen.get_size()).convert_alpha()
-        pygame.draw.circle(transition_surf, (255, 0, 0, 255), 
-            pygame.math.Vector2(self.screen.get_size())/2, radius)
-        transition_surf.set_colorkey((0,0,0))
-        self.screen.blit(transition_surf, (0,0))
     
     def update_transition_out(self):
         if (self.current_transition_out<=0):
@@ -230,14 +342,6 @@ class Level():
         self.current_transition_out -= system.delta_time
         self.current_transition_out = max(self.current_transition_out, 0)
 
-        ratio = self.current_transition_out/self.transition_time
-        radius = pygame.math.Vector2(self.screen.get_size()).magnitude()/2*(1.5)*ratio
-        transition_surf = pygame.Surface(self.screen.get_size())
-        pygame.draw.circle(transition_surf, (255, 255, 255), 
-            pygame.math.Vector2(self.screen.get_size())/2, radius)
-        transition_surf.set_colorkey((255, 255, 255))
-        self.screen.blit(transition_surf, (0,0))
-
     def update_victory(self):
         if (not self.is_victory): return
         if (self.victory_current_time<=0):
@@ -251,12 +355,22 @@ class Level():
         self.is_victory = True
         pygame.mixer.music.stop()
         self.victory_sound.play()
+        #decoded on the worker thread during the victory screen
+        if (system.preload_level!=None): system.preload_level('next')
 
     def check_win(self):
         for target in self.enemies:
             if (not target.is_dead): return False
         return True
 
+    @classmethod
+    def preload_assets(cls):
+        level_path = PATH + 'level/' + cls.level_name + '/0/'
+        file.preloader.preload_folder(PATH + 'level/' + cls.level_name + '/')
+        if (STATIC_TILE_CHUNKS): file.preloader.preload_job(('baked', level_path), lambda: bake_level(level_path))
+        for folder in LEVEL_ASSET_FOLDERS:
+            file.preloader.preload_folder(PATH + folder)
+
     def create_weapon(self,player,name, type=''):
         if (player.current_weapon): return
         if (type=='gun'):
@@ -270,16 +384,186 @@ class Level():
 
     def create_bullet(self,weapon,type='bullet'):
         if (type=='bullet'):
-            Bullet([self.visible_sprites],weapon, self.obstacle_sprites, weapon.zindex)
+            Bullet.pool.acquire([self.visible_sprites],weapon, self.obstacle_sprites, weapon.zindex)
         elif (type=='flamebullet'): 
-            FlameBullet([self.visible_sprites],weapon, self.obstacle_sprites, weapon.zindex)
+            FlameBullet.pool.acquire([self.visible_sprites],weapon, self.obstacle_sprites, weapon.zindex)
         else:
             Missile([self.visible_sprites],weapon, self.obstacle_sprites, weapon.zindex)
     def create_blood(self, pos, zindex = 2):
-        Blood([self.visible_sprites],pos)
+        self.blood.emit(pos)
 
     def create_flame_particle(self, pos, zindex = 2):
-        FlamePariticle([self.visible_sprites], pos)
+        self.flames.emit(pos)
+
+class ScaledImageCache():
+    """
+    LRU cache of scaled surfaces, keyed on source surface identity and target size.
+
+    Attributes:
+        max_bytes (int): Memory cap of the cached scaled surfaces.
+        entries (OrderedDict): key -> (weakref to source, scaled surface, bytes), oldest first.
+        ghosts (OrderedDict): key -> weakref of surfaces missed once, cached on their second miss.
+        max_ghosts (int): Number of remembered ghost keys.
+        bytes (int): Memory used by the cached scaled surfaces.
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups that had to scale.
+        evictions (int): Number of entries dropped because of the memory cap.
+
+    Methods:
+        get(image, size): Returns image scaled to size, scaling only on a miss.
+        clear(): Drops every cached surface (e.g. when the zoom changes).
+        stats(): Returns hits, misses, bytes and the entry count.
+    """
+    def __init__(self, max_bytes = SCALED_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.ghosts = OrderedDict()
+        self.max_ghosts = 4096
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, image, size):
+        size = (int(size[0]),int(size[1]))
+        #alpha is in the key because some sprites set_alpha their image in place
+        key = (id(image), size, image.get_alpha())
+        entry = self.entries.get(key)
+        #a dead surface's id can be reused by a new one, so check identity
+        if (entry!=None and entry[0]() is image):
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        scaled_image = pygame.transform.scale(image,size)
+        nbytes = scaled_image.get_pitch()*scaled_image.get_height()
+        if (nbytes>self.max_bytes): return scaled_image
+        #images rebuilt every frame (bullet line, flame...) are never seen twice, don't cache them
+        ghost = self.ghosts.pop(key, None)
+        if (ghost==None or ghost() is not image):
+            self.ghosts[key] = weakref.ref(image)
+            if (len(self.ghosts)>self.max_ghosts): self.ghosts.popitem(last = False)
+            return scaled_image
+        if (entry!=None): self.bytes -= entry[2] #stale entry of a dead surface
+        self.entries[key] = (weakref.ref(image), scaled_image, nbytes)
+        self.entries.move_to_end(key)
+        self.bytes += nbytes
+        while (self.bytes>self.max_bytes):
+            _, (__, ___, old_bytes) = self.entries.popitem(last = False)
+            self.bytes -= old_bytes
+            self.evictions += 1
+        return scaled_image
+
+    def clear(self):
+        self.entries.clear()
+        self.ghosts.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'bytes': self.bytes,
+                'entries': len(self.entries), 'evictions': self.evictions}
+
+def render_key(sprite):
+    "rendering priority: zindex first, then y"
+    return sprite.zindex*10**9+sprite.rect.centery
+
+class RenderOrder():
+    """
+    Keeps the sprites of a camera group in render order without sorting all of them every frame.
+
+    Static sprites (is_static, e.g. tiles) are put once into per-zindex buckets sorted by y,
+    so only the rows in view are read. Moving sprites live in a dynamic list kept in the order of the last frame:
+    new sprites are appended, then the nearly sorted list is sorted once per frame, which costs about one pass.
+
+    Attributes:
+        contains (function): Checks that a sprite is still in the group.
+        pending (list): Sprites added since the last frame, their rect is not set yet when they join the group.
+        static_buckets (dict): zindex -> ([render key], [(render key, sprite)]) sorted by key.
+        static_margin (dict): zindex -> half of the tallest sprite in the bucket.
+        static_zindex (list): Sorted zindexes of the static buckets.
+        dynamic (list): Moving sprites, sorted by render_key in ordered() (new ones are appended).
+        has_removed (bool): A dynamic or pending sprite was removed since the last frame.
+
+    Methods:
+        add(sprite): Queues a sprite added to the group.
+        remove(sprite): Removes a sprite removed from the group.
+        update(): Classifies pending sprites, the dynamic ones are appended to the dynamic list.
+        ordered(top, bottom, extra): Returns (key, sprite) in render order, static sprites limited to the y range,
+            extra sprites (not in the group, e.g. horde enemies in view) are merged in.
+    """
+    def __init__(self, contains):
+        self.contains = contains
+        self.pending = []
+        self.static_buckets = {}
+        self.static_margin = {}
+        self.static_zindex = []
+        self.dynamic = []
+        self.has_removed = False
+
+    def add(self, sprite):
+        self.pending.append(sprite)
+
+    def remove(self, sprite):
+        bucket = self.static_buckets.get(getattr(sprite, 'zindex', None))
+        if (bucket==None or not getattr(sprite, 'is_static', False)):
+            self.has_removed = True
+            return
+        keys, pairs = bucket
+        #static sprites don't move, their key is still the bucket key
+        i = bisect_left(keys, render_key(sprite))
+        while (i<len(pairs) and pairs[i][1] is not sprite): i += 1
+        if (i==len(pairs)): #was still pending
+            self.has_removed = True
+            return
+        del keys[i]
+        del pairs[i]
+
+    def add_static(self, sprite):
+        zindex = sprite.zindex
+        if (zindex not in self.static_buckets):
+            self.static_buckets[zindex] = ([], [])
+            self.static_margin[zindex] = 0
+            insort(self.static_zindex, zindex)
+        keys, pairs = self.static_buckets[zindex]
+        key = render_key(sprite)
+        i = bisect_right(keys, key)
+        keys.insert(i, key)
+        pairs.insert(i, (key, sprite))
+        self.static_margin[zindex] = max(self.static_margin[zindex], sprite.rect.height//2+1)
+
+    def update(self):
+        if (self.has_removed):
+            #a sprite removed and added again since the last frame (pooled projectiles) is pending once and not dynamic
+            self.pending = [sprite for sprite in dict.fromkeys(self.pending) if self.contains(sprite)]
+            pending = set(self.pending)
+            self.dynamic = [sprite for sprite in self.dynamic if self.contains(sprite) and sprite not in pending]
+            self.has_removed = False
+        for sprite in self.pending:
+            if (getattr(sprite, 'is_static', False)): self.add_static(sprite)
+            else: self.dynamic.append(sprite) #put in place by the sort of ordered()
+        self.pending = []
+
+    def ordered(self, top = -float('inf'), bottom = float('inf'), extra = ()):
+        self.update()
+        pairs = []
+        for zindex in self.static_zindex:
+            keys, static_pairs = self.static_buckets[zindex]
+            margin = self.static_margin[zindex]
+            base = zindex*10**9
+            lo = bisect_left(keys, base+top-margin)
+            hi = bisect_right(keys, base+bottom+margin)
+            #pairs are built once, slicing allocates no tuple
+            pairs.extend(static_pairs[lo:hi])
+
+        dynamic = [(render_key(sprite), sprite) for sprite in self.dynamic]
+        dynamic.sort(key = itemgetter(0)) #nearly sorted since the last frame
+        self.dynamic = [sprite for _, sprite in dynamic]
+        #two sorted runs (plus the few extra sprites), timsort only merges them
+        pairs.extend(dynamic)
+        pairs.extend([(render_key(sprite), sprite) for sprite in extra])
+        pairs.sort(key = itemgetter(0))
+        return pairs
 
 class YSortCameraGroup(pygame.sprite.Group):
     """
@@ -287,9 +571,16 @@ class YSortCameraGroup(pygame.sprite.Group):
 
     Methods:
         mouse_world_position(): Gets the current mouse position in the world's coordinate system.
-        custom_draw(player): Draws sprites and updates the camera position based on the player.
+        store_previous(): Keeps the camera and moving sprite positions at the start of a step.
+        update_camera(player): Moves the camera toward the player and the aim, and shakes it (one step).
+        custom_draw(player, alpha): Draws the sprites and the camera alpha (0-1) of a step after store_previous().
+        visible_batches(view_rect): Returns the render keys (sorted) and the blits of the batch providers in view.
         draw_sprite(sprite, screen=None): Transforms the sprite's image and blits it to the screen.
         screen_shake(swing): Shakes the screen by a specified magnitude.
+        flush_scaled_cache(): Empties the scaled image cache if the zoom changed.
+        add_internal(sprite, layer=None): Adds a sprite to the group and its render order.
+        remove_internal(sprite): Removes a sprite from the group and its render order.
+        update(): Updates the sprites, timing each sprite class when the profiler is on.
     """
     def __init__(self): 
         super().__init__()
@@ -297,6 +588,8 @@ class YSortCameraGroup(pygame.sprite.Group):
         self.half_width = self.screen.get_size()[0] // 2
         self.half_height = self.screen.get_size()[1] // 2
         self.offset = pygame.math.Vector2()
+        #offset of the simulated camera, the steps map the mouse with it (offset is the interpolated one drawn)
+        self.step_offset = pygame.math.Vector2()
         self.zoom_out_scale = 1
         self.pos = pygame.math.Vector2(0,0)
         self.velocity = pygame.math.Vector2(0,0)
@@ -306,31 +599,69 @@ class YSortCameraGroup(pygame.sprite.Group):
         self.current_shake = 0
         self.shake_recover = 20
 
+        self.scaled_cache = ScaledImageCache()
+        self.scaled_cache_zoom = self.zoom_out_scale
+        self.render_order = RenderOrder(self.has_internal)
+        #objects drawing sprites that aren't in the group: visible_sprites(view_rect, alpha) -> sprites, store_previous()
+        self.sprite_providers = []
+        #objects drawing many images without sprites (particles): visible_batch(camera, view_rect) -> sorted render keys, blits
+        self.batch_providers = []
+        #interpolation of the render between the last two steps
+        self.previous = {}
+        self.previous_pos = pygame.math.Vector2(self.pos)
+        self.alpha = 1
+
         system.camera = self
 
+    def add_internal(self, sprite, layer = None):
+        super().add_internal(sprite)
+        self.render_order.add(sprite)
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        self.render_order.remove(sprite)
+        #a pooled sprite may come back this step, it must not be drawn from where it died
+        self.previous.pop(sprite, None)
+
+    def update(self, *args, **kwargs):
+        profiler = system.profiler
+        if (not profiler.enabled): return super().update(*args, **kwargs)
+        start = perf_counter()
+        totals = {}
+        for sprite in self.sprites():
+            sprite_start = perf_counter()
+            sprite.update(*args, **kwargs)
+            name = type(sprite).__name__
+            seconds, count = totals.get(name, (0, 0))
+            totals[name] = (seconds+perf_counter()-sprite_start, count+1)
+        profiler.record_classes(start, totals)
+
     def mouse_wolrd_position(self):
-        mouse = pygame.math.Vector2(pygame.mouse.get_pos())
-        mouse = mouse*self.zoom_out_scale + pygame.math.Vector2(self.offset)
+        mouse = pygame.math.Vector2(system.controls.mouse_pos())
+        mouse = mouse*self.zoom_out_scale + self.step_offset
         return mouse
 
-    def custom_draw(self,player):
+    def store_previous(self):
+        "positions at the start of a step, the render interpolates from them"
+        self.render_order.update()
+        self.previous = {sprite: sprite.rect.topleft for sprite in self.render_order.dynamic}
+        self.previous_pos = pygame.math.Vector2(self.pos)
+        for provider in self.sprite_providers:
+            provider.store_previous()
+
+    def update_camera(self, player):
         #update camera position
         player_pos = pygame.math.Vector2(player.rect.centerx,player.rect.centery)
         mouse = self.mouse_wolrd_position()
         dest_pos = mouse-(mouse - player_pos)/1.2 #not aiming
-        if (pygame.mouse.get_pressed()[2]): #aiming
+        if (system.controls.mouse_buttons()[2]): #aiming
             dest_pos = mouse-(mouse - player_pos)/phi
         force = self.force_to_dest*(dest_pos-self.pos)
         self.velocity += system.delta_time*force
         self.velocity *= exp2(-system.delta_time/self.decay_fiction_halflife)
         self.pos += system.delta_time*self.velocity
-        
-        #offset = topleft start rendering
-        self.offset.x = self.pos.x - self.half_width*self.zoom_out_scale
-        self.offset.y = self.pos.y - self.half_height*self.zoom_out_scale
-        
-        for sprite in sorted(self.sprites(),key = lambda sprite: sprite.zindex*10**9+sprite.rect.centery):
-            self.draw_sprite(sprite)
+        self.step_offset.x = self.pos.x - self.half_width*self.zoom_out_scale
+        self.step_offset.y = self.pos.y - self.half_height*self.zoom_out_scale
 
         #shake
         angle = uniform(-pi, pi)
@@ -338,7 +669,42 @@ class YSortCameraGroup(pygame.sprite.Group):
         self.pos += vec_shake*self.current_shake
         self.current_shake -= system.delta_time*self.shake_recover
         self.current_shake = max(self.current_shake, 0)
+
+    def custom_draw(self, player, alpha = 1):
+        self.flush_scaled_cache()
+        self.alpha = alpha
+        pos = self.previous_pos.lerp(self.pos, alpha)
+
+        #offset = topleft start rendering
+        self.offset.x = pos.x - self.half_width*self.zoom_out_scale
+        self.offset.y = pos.y - self.half_height*self.zoom_out_scale
         
+        view_rect = pygame.Rect(self.offset, (self.half_width*2*self.zoom_out_scale, self.half_height*2*self.zoom_out_scale))
+        extra = []
+        for provider in self.sprite_providers:
+            extra += provider.visible_sprites(view_rect, alpha)
+        pairs = self.render_order.ordered(view_rect.top, view_rect.bottom, extra)
+        keys, blits = self.visible_batches(view_rect)
+        #the batches are blitted in runs, each run before the first sprite drawn over it
+        cuts = np.searchsorted(keys, [key for key, _ in pairs]).tolist() if blits else [0]*len(pairs)
+        drawn = 0
+        for cut, (_, sprite) in zip(cuts, pairs):
+            if (cut>drawn):
+                self.screen.blits(blits[drawn:cut], doreturn = False)
+                drawn = cut
+            self.draw_sprite(sprite)
+        if (drawn<len(blits)): self.screen.blits(blits[drawn:], doreturn = False)
+
+    def visible_batches(self, view_rect):
+        batches = [provider.visible_batch(self, view_rect) for provider in self.batch_providers]
+        batches = [(keys, blits) for keys, blits in batches if blits]
+        if (len(batches)<=1): return batches[0] if batches else (np.zeros(0, int), [])
+        keys = np.concatenate([keys for keys, _ in batches])
+        blits = [blit for _, batch_blits in batches for blit in batch_blits]
+        order = np.argsort(keys, kind = 'stable')
+        return keys[order], [blits[i] for i in order.tolist()]
+        
+
     def draw_hit_box(self,player):
         self.box.rect = player.hitbox
         self.box.image = pygame.transform.scale(self.box.image,player.hitbox.size)
@@ -355,13 +721,18 @@ class YSortCameraGroup(pygame.sprite.Group):
         if hasattr(sprite, 'is_disable') and sprite.is_disable:
             return
         offset_pos = sprite.rect.topleft - self.offset
+        previous = self.previous.get(sprite) if self.alpha<1 else None
+        if (previous!=None): #where it was alpha of a step ago
+            offset_pos -= (1-self.alpha)*(pygame.math.Vector2(sprite.rect.topleft)-previous)
         offset_pos = (offset_pos[0]/self.zoom_out_scale,offset_pos[1]/self.zoom_out_scale)
         new_size = sprite.rect.size # sprite.image.get_size()
         new_size = (new_size[0]/self.zoom_out_scale,new_size[1]/self.zoom_out_scale)
 
         #check before render because lag when zoom, screen_relative_rect
         if (not self.screen.get_rect().colliderect(pygame.Rect(offset_pos, new_size))): return
-        scaled_image = pygame.transform.scale(sprite.image,new_size)
+        if hasattr(sprite, 'get_scaled_image'): #baked static chunk
+            scaled_image = sprite.get_scaled_image(new_size)
+        else: scaled_image = self.scaled_cache.get(sprite.image,new_size)
         if (screen == None): screen = self.screen
         screen.blit(scaled_image,offset_pos)
 
@@ -369,12 +740,22 @@ class YSortCameraGroup(pygame.sprite.Group):
     def screen_shake(self, swing):
         self.current_shake = max(self.current_shake, swing)
 
+    def flush_scaled_cache(self):
+        "scaled images of the old zoom are never hit again"
+        if (self.scaled_cache_zoom==self.zoom_out_scale): return
+        self.scaled_cache_zoom = self.zoom_out_scale
+        self.scaled_cache.clear()
+
 class Level00(Level):
-    def __init__(self, level='testing_level', music_file = 'level.wav'):
+    level_name = 'testing_level'
+
+    def __init__(self, level=level_name, music_file = 'level.wav'):
         super().__init__(level, music_file)
 
 class Level01(Level):
-    def __init__(self, level='grass_level', music_file = 'level_high.wav'):
+    level_name = 'grass_level'
+
+    def __init__(self, level=level_name, music_file = 'level_high.wav'):
         super().__init__(level, music_file)
         self.player.health = 100
 
@@ -394,6 +775,11 @@ class MenuScreen:
         A button object for selecting Level 01.
     LEVEL2_BUTTON : Button
         A button object for selecting Level 02.
+    dirty_rects : list
+        Rects of the screen changed by the last update (a button hovered or left),
+        None when everything changed (first frame). CRT mode only uploads these.
+    hovered : list
+        Hover state of each button at the last update.
 
     Methods
     -------
@@ -401,6 +787,10 @@ class MenuScreen:
         Initializes the menu screen with the title text and level selection buttons.
     update(display=True):
         Updates the display with the current state of the menu screen.
+    step():
+        Nothing to simulate, the menu only reacts when rendered.
+    render(alpha=1):
+        Same as update().
     draw_prite(sprite):
         Draws a sprite (text) on the screen.
     draw_button(button):
@@ -419,11 +809,14 @@ class MenuScreen:
                             text_input="EXIT", font=Font.get_font(30), base_color="#d7fcd4", hovering_color="#801010")
         
         THEME_PATH = PATH + 'sound/main_theme_cutted.wav'
-        pygame.mixer.music.load(THEME_PATH)
-        pygame.mixer.music.play(-1)
+        if (system.play_music):
+            pygame.mixer.music.load(THEME_PATH)
+            pygame.mixer.music.play(-1)
 
-        self.bg = pygame.image.load(PATH + 'graphics/main_background.png')
+        self.bg = file.import_image(PATH + 'graphics/main_background.png', convert = False)
         self.bg = pygame.transform.scale(self.bg, self.screen.get_size())
+        self.dirty_rects = None
+        self.hovered = None
 
     def update(self, display = True):
         self.screen.blit(self.bg, (0,0))
@@ -437,8 +830,15 @@ class MenuScreen:
         self.draw_button(LEVEL1_BUTTON)
         self.draw_button(LEVEL2_BUTTON)
 
-        mouse = pygame.mouse.get_pos()
-        if (pygame.mouse.get_pressed()[0]):
+        #the rest of the menu is the same every frame
+        buttons = [LEVEL0_BUTTON, LEVEL1_BUTTON, LEVEL2_BUTTON]
+        hovered = [button.is_hovering for button in buttons]
+        if (self.hovered!=None):
+            self.dirty_rects = [button.rect.union(button.text_rect) for button, old, new in zip(buttons, self.hovered, hovered) if old!=new]
+        self.hovered = hovered
+
+        mouse = system.controls.mouse_pos()
+        if (system.controls.mouse_buttons()[0]):
             if LEVEL0_BUTTON.checkForInput(mouse):
                 pygame.mixer.music.stop()
                 system.go_to_level(0)
@@ -452,8 +852,69 @@ class MenuScreen:
                 system.go_to_level('exit')
                 LEVEL2_BUTTON.disable()
 
+    def step(self):
+        pass
+
+    def render(self, alpha = 1):
+        self.update()
+
     def draw_prite(self, sprite):
         self.screen.blit(sprite.image, sprite.rect)
 
     def draw_button(self, button):
-        button.update(self.screen)
\ No newline at end of file
+        button.update(self.screen)
+class LevelSwitcher():
+    """
+    Level switching shared by Game (game.py) and Replay (replay.py), so a replay switches levels like the game.
+
+    Attributes:
+        levels (list): Level classes by index (class attribute).
+        level: Current level or menu.
+        current_level (int): Index of the current level, -1 for the menu.
+        is_run (bool): Set to False when a level asks to exit.
+
+    Methods:
+        start_menu(): Hooks system.go_to_level and system.preload_level and shows the menu.
+        level_index(level): Turns 'next' and 'restart' into a level index.
+        preload_level(level): Decodes the files of a level on a worker thread, the current screen keeps running.
+        go_to_level(level): Replaces the current level, None is the menu, 'exit' stops the run.
+            The preloads not taken by the new level are dropped, the menu preloads every level again.
+    """
+    levels = [Level00, Level01]
+
+    def start_menu(self):
+        system.go_to_level = self.go_to_level
+        system.preload_level = self.preload_level
+        self.go_to_level()
+
+    def level_index(self, level):
+        if (level == 'next'):
+            level = self.current_level + 1
+            if (level>=len(self.levels)):
+                level = -1
+        elif (level == 'restart'):
+            level = self.current_level
+        return level
+
+    def preload_level(self, level = None):
+        level = self.level_index(level)
+        if (level!=None and 0<=level<len(self.levels)): self.levels[level].preload_assets()
+
+    def go_to_level(self, level = None):
+        if (level == 'exit'):
+            self.is_run = False
+            return
+        level = -1 if level==None else self.level_index(level)
+        assert -1<=level<len(self.levels), f"Cant find level: {level}"
+        self.current_level = level
+        #a wheel notch of the previous screen doesn't zoom the new level
+        system.mouse_scroll = 0
+        #the menu is no Level, it does not reclaim the projectiles itself
+        if (level==-1): reclaim_projectiles()
+        self.level = MenuScreen() if level==-1 else self.levels[level]()
+        #files preloaded for another level would stay decoded in memory
+        file.preloader.clear()
+        if (level==-1):
+            #while the menu is shown
+            for level in range(len(self.levels)):
+                self.preload_level(level)
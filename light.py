@@ -0,0 +1,81 @@
+import pygame
+from settings import *
+import system
+
+class Lighting():
+    """
+    Darkness of a level. The darkness is drawn in a screen sized buffer kept across frames,
+    every light of the frame is cut out of it, then it is subtracted from the screen in one blend,
+    so adding lights only adds small blits.
+
+    Attributes:
+        light_image (Surface): Light texture, black with the light strength as alpha.
+        darkness (Surface): Screen sized buffer, reused every frame.
+        masks (dict): World size -> light_image scaled for masks_zoom.
+        masks_zoom (float): Camera zoom the masks were scaled for.
+        lights (list): (world center, world size) of the lights of the last simulation step.
+
+    Methods:
+        add(pos, size): Adds a light for the current step.
+        add_many(centers, size): Adds a light of the same size at each row of an (n, 2) array.
+        clear(): Forgets the lights, at the start of a step, every frame rendered until the next step shows the same lights.
+        get_mask(size, zoom): Returns light_image scaled for a world size at a zoom, scaled once per zoom.
+        render(screen, camera, darkness_value): Darkens the screen except around the lights.
+            In CRT mode the darkness and the lights are given to system.post_effects (GPU) instead.
+    """
+    def __init__(self, light_image):
+        self.light_image = light_image
+        self.darkness = None
+        self.masks = {}
+        self.masks_zoom = None
+        self.lights = []
+
+    def add(self, pos, size):
+        self.lights.append((pos, size))
+
+    def add_many(self, centers, size):
+        self.lights.extend((center, size) for center in centers.tolist())
+
+    def clear(self):
+        self.lights = []
+
+    def get_mask(self, size, zoom):
+        if (zoom!=self.masks_zoom):
+            #masks of the old zoom are never used again
+            self.masks.clear()
+            self.masks_zoom = zoom
+        mask = self.masks.get(size)
+        if (mask==None):
+            scaled = pygame.transform.scale(self.light_image,(int(size/zoom),int(size/zoom)))
+            #copied to ARGB like the darkness buffer, blits from the png RGBA order are ~15x slower
+            mask = pygame.surface.Surface(scaled.get_size(), pygame.SRCALPHA)
+            mask.blit(scaled, (0, 0), special_flags=pygame.BLEND_RGBA_MAX)
+            self.masks[size] = mask
+        return mask
+
+    def render(self, screen, camera, darkness_value):
+        lights = self.lights
+        if (darkness_value<=0): return
+        zoom = camera.zoom_out_scale
+        offset = camera.offset
+        view = screen.get_rect()
+        if (system.post_effects!=None):
+            system.post_effects.darkness = darkness_value
+            for (x, y), size in lights:
+                dest = ((x-size/2-offset.x)/zoom, (y-size/2-offset.y)/zoom)
+                if (view.colliderect(pygame.Rect(dest, (size/zoom,size/zoom)))): system.post_effects.add_light(dest, size/zoom)
+            return
+
+        if (self.darkness==None or self.darkness.get_size()!=screen.get_size()):
+            self.darkness = pygame.surface.Surface(screen.get_size())
+        self.darkness.fill((darkness_value,darkness_value,darkness_value,255))
+        blits = []
+        for (x, y), size in lights:
+            mask = self.get_mask(size, zoom)
+            #topleft on screen, same as YSortCameraGroup.draw_sprite
+            dest = ((x-size/2-offset.x)/zoom, (y-size/2-offset.y)/zoom)
+            if (not view.colliderect(pygame.Rect(dest, mask.get_size()))): continue
+            blits.append((mask, dest))
+        self.darkness.blits(blits, doreturn = False)
+        #the screen has no alpha, RGB_SUB gives the same pixels as RGBA_SUB and is faster
+        screen.blit(self.darkness, (0, 0), special_flags=pygame.BLEND_RGB_SUB)
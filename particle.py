@@ -2,6 +2,7 @@ import pygame
 from settings import *
 import file
 import system
+import numpy as np
 
 class Particle(pygame.sprite.Sprite):
     """
@@ -35,7 +36,8 @@ class Particle(pygame.sprite.Sprite):
 
     def load_asset(self):
         path = self.path
-        self.animation = file.import_folder(path)
+        #loaded once, shared by every particle of the folder
+        self.animation = file.assets.get(('folder', path), lambda: file.import_folder(path))
 
     def update_animation(self):
         self.frame_index += system.delta_time*self.animation_speed
@@ -49,19 +51,79 @@ class Particle(pygame.sprite.Sprite):
         self.update_animation()
     
 
-class Blood(Particle):
+class ParticleEmitter():
     """
-    Represents a blood particle effect in the game.
-    """
-    def __init__(self, groups, pos, zindex=2):
-        self.path = PATH + 'graphics/particle/blood/'
-        super().__init__(groups, pos, zindex)
+    Structure of arrays of one kind of animated particle (blood, flame), advanced every step
+    with batched NumPy operations and drawn by the camera in runs of blits (YSortCameraGroup.batch_providers),
+    instead of one sprite per particle.
 
-class FlamePariticle(Particle):
-    """
-    Represents a flame particle effect in the game.
+    Attributes:
+        frames (list): Animation frames, loaded once and shared by every emitter of the folder.
+        size (tuple): Size of the particles (the first frame).
+        animation_speed (float): Frames per second of the animation, a particle dies after its last frame.
+        light_size (int): World size of the light around each particle, None for no light.
+        zindex (int): Rendering priority of the particles.
+        capacity (int): Maximum number of particles, a new particle replaces the oldest one past it.
+        count (int): Number of live particles, they are the first rows.
+        topleft (ndarray): (capacity, 2) int topleft of the particles.
+        frame_index (ndarray): (capacity,) current frame index of the particles.
+
+    Methods:
+        emit(pos): Adds a particle centered at pos.
+        update(): Advances every particle by one step, adds their light and removes the finished ones.
+        visible_batch(camera, view_rect): Returns the render keys (sorted) and the blits of the particles inside view_rect.
     """
-    def __init__(self, groups, pos, zindex=2):
-        self.path = PATH + 'graphics/particle/flame/'
-        super().__init__(groups, pos, zindex)
-        
\ No newline at end of file
+    def __init__(self, path, light_size = None, zindex = 2, capacity = PARTICLE_CAPACITY):
+        self.frames = file.assets.get(('folder', path), lambda: file.import_folder(path))
+        self.size = self.frames[0].get_size()
+        self.animation_speed = 10
+        self.light_size = light_size
+        self.zindex = zindex
+        self.capacity = capacity
+        self.count = 0
+        self.topleft = np.zeros((capacity, 2), int)
+        self.frame_index = np.zeros(capacity)
+
+    def emit(self, pos):
+        i = self.count
+        if (i==self.capacity): i = int(np.argmax(self.frame_index))
+        else: self.count += 1
+        #same rounding as a sprite rect centered at pos
+        self.topleft[i] = self.frames[0].get_rect(center = pos).topleft
+        self.frame_index[i] = 0
+
+    def update(self):
+        n = self.count
+        if (n==0): return
+        if (self.light_size!=None):
+            centers = self.topleft[:n]+np.array(self.size)//2
+            system.level.lighting.add_many(centers, self.light_size)
+        frame_index = self.frame_index[:n]
+        frame_index += system.delta_time*self.animation_speed
+        alive = frame_index<len(self.frames)
+        if (alive.all()): return
+        #keep the live particles in order, packed in the first rows
+        live = np.nonzero(alive)[0]
+        self.topleft[:len(live)] = self.topleft[live]
+        self.frame_index[:len(live)] = frame_index[live]
+        self.count = len(live)
+
+    def visible_batch(self, camera, view_rect):
+        n = self.count
+        if (n==0): return np.zeros(0, int), []
+        w, h = self.size
+        topleft = self.topleft[:n]
+        visible = ((topleft[:,0]+w>=view_rect.left) & (topleft[:,0]<=view_rect.right)
+            & (topleft[:,1]+h>=view_rect.top) & (topleft[:,1]<=view_rect.bottom))
+        rows = np.nonzero(visible)[0]
+        #render_key of a sprite with the same rect
+        keys = self.zindex*10**9+topleft[rows,1]+h//2
+        order = np.argsort(keys, kind = 'stable')
+        rows, keys = rows[order], keys[order]
+        #same transform as YSortCameraGroup.draw_sprite, one scaled image per frame
+        zoom = camera.zoom_out_scale
+        scaled = np.empty(len(self.frames), object)
+        scaled[:] = [camera.scaled_cache.get(frame, (w/zoom, h/zoom)) for frame in self.frames]
+        dest = (topleft[rows]-(camera.offset.x, camera.offset.y))/zoom
+        images = scaled[self.frame_index[rows].astype(int)].tolist()
+        return keys, list(zip(images, dest.tolist()))
@@ -34,13 +34,14 @@ class Player(pygame.sprite.Sprite):
         direction (Vector2): Direction the player is moving.
         facing_direction (Vector2): Direction the player is facing.
         pos (tuple): Initial position of the player.
-        obstacle_sprites (iterable): Sprites representing obstacles.
+        obstacle_sprites (ObstacleGroup): Sprites representing obstacles.
         hitbox (Rect): Rectangular hitbox for collision detection.
         hitbox_shift (int): Shift value for the hitbox.
         dirname (int): Direction index for animation.
         anim_state (str): Current animation state.
         is_reloading (bool): Whether the player is reloading a weapon.
         is_eating (bool): Whether the player is eating.
+        is_sprinting (bool): Whether the sprint key was held at the last move.
         current_food (Food): The player's current food item.
         inventory (list): List of items in the player's inventory.
         current_primary (int): Index of the current primary item in the inventory.
@@ -92,6 +93,7 @@ class Player(pygame.sprite.Sprite):
         self.anim_state = 'idle'
         self.is_reloading = False
         self.is_eating = False
+        self.is_sprinting = False #a shot can come before the first move()
         self.current_food = None
 
         # self.inventory = [GunItemInventory(groups,self),
@@ -108,7 +110,7 @@ class Player(pygame.sprite.Sprite):
         self.process_bar = ProcessBar(groups, self)
 
         self.path = PATH + 'graphics/player/' + self.character_namedir + '/'
-        self.taking_damage_sound = pygame.mixer.Sound(self.path + 'taking_damage.wav')
+        self.taking_damage_sound = file.import_sound(self.path + 'taking_damage.wav')
 
     def import_player_assets(self):
         character_path = PATH + 'graphics/player/' + self.character_namedir + '/'
@@ -116,11 +118,12 @@ class Player(pygame.sprite.Sprite):
         for animation in self.animations.keys():
             for dir in range(4):
                 full_path = character_path + animation + '/' + str(dir) + '/'
-                self.animations[animation].append(file.import_folder(full_path))
+                #shared between levels, a restart doesn't reload them
+                self.animations[animation].append(file.assets.get(('folder', full_path), lambda: file.import_folder(full_path)))
 
     def input(self):
         #direction update
-        keys = pygame.key.get_pressed()
+        keys = system.controls.keys()
         self.direction.x = keys[pygame.K_d]-keys[pygame.K_a]
         self.direction.y = keys[pygame.K_s]-keys[pygame.K_w]
         if (self.direction.magnitude()!=0):
@@ -159,7 +162,7 @@ class Player(pygame.sprite.Sprite):
         #     system.level.destroy_weapon(self)
         #     system.level.create_weapon(self,'flamethrower', 'flamethrower')
 
-        if (pygame.mouse.get_pressed()[0]):
+        if (system.controls.mouse_buttons()[0]):
             if (self.current_weapon):
                 self.current_weapon.shoot()
             if (self.current_food):
@@ -203,7 +206,7 @@ class Player(pygame.sprite.Sprite):
             self.current_food = self.inventory[slot].food
 
     def move(self):
-        keys = pygame.key.get_pressed()
+        keys = system.controls.keys()
 
         #movement
         self.is_eating = (self.current_food!=None 
@@ -232,10 +235,7 @@ class Player(pygame.sprite.Sprite):
     
     def collision_check(self):
         # return pygame.sprite.spritecollide(self, self.obstacle_sprites, False, pygame.sprite.collide_mask)
-        for sprite in self.obstacle_sprites:
-            if not self.hitbox.colliderect(sprite.rect): continue
-            return True
-        return False
+        return self.obstacle_sprites.collide_rect(self.hitbox)
     
     def animate(self):
         
@@ -0,0 +1,362 @@
+import pygame
+from settings import *
+import numpy as np
+import struct
+import moderngl
+import system
+from collections import deque
+from time import perf_counter
+
+#uniform array size of the effects pass, extra circles are dropped
+MAX_CIRCLES = 4
+#pixel buffers per uploaded texture, the one filled is not the one the GPU may still read
+UPLOAD_BUFFERS = 3
+
+VERTEX_SHADER = '''#version 300 es
+in vec2 vert;
+in vec2 in_text;
+out vec2 v_text;
+void main() {
+gl_Position = vec4(vert, 0.0, 1.0);
+v_text = in_text;
+}
+'''
+
+#one instance per light: left, top, size on screen (px)
+LIGHT_VERTEX_SHADER = '''#version 300 es
+in vec2 corner;
+in vec3 light;
+uniform vec2 screen_size;
+out vec2 v_text;
+void main() {
+vec2 pos = light.xy+corner*light.z;
+gl_Position = vec4(pos/screen_size*2.0-1.0, 0.0, 1.0);
+v_text = corner;
+}
+'''
+
+#multiplied into the darkness by the blending (1 - alpha)
+LIGHT_SHADER = '''#version 300 es
+precision mediump float;
+uniform sampler2D Light;
+out vec4 color;
+in vec2 v_text;
+void main() {
+color = vec4(0.0, 0.0, 0.0, texture(Light, v_text).a);
+}
+'''
+
+#darkness cut by the lights, then the hud, then the transition circles
+#highp: distances in pixels overflow half floats
+EFFECTS_SHADER = '''#version 300 es
+precision highp float;
+uniform sampler2D Texture;
+uniform sampler2D Hud;
+uniform sampler2D Darkness;
+uniform vec2 screen_size;
+uniform int circle_count;
+uniform vec2 circles[%d];
+uniform vec3 circle_colors[%d];
+
+out vec4 color;
+in vec2 v_text;
+
+void main() {
+vec2 pos = v_text*screen_size;
+vec3 rgb = texture(Texture, v_text).rgb;
+rgb = max(rgb-texture(Darkness, v_text).r, 0.0);
+
+//premultiplied alpha (ui.UI_Object)
+vec4 hud = texture(Hud, v_text);
+rgb = rgb*(1.0-hud.a)+hud.rgb;
+
+float distance_center = distance(pos, screen_size*0.5);
+for (int i = 0; i < circle_count; i++) {
+    bool inside = distance_center <= circles[i].x;
+    if (inside == (circles[i].y > 0.5)) rgb = circle_colors[i];
+}
+color = vec4(rgb, 1.0);
+}
+''' % (MAX_CIRCLES, MAX_CIRCLES)
+
+CRT_SHADER = '''#version 300 es
+precision mediump float;
+uniform sampler2D Texture;
+
+out vec4 color;
+in vec2 v_text;
+uniform float current_time;
+
+void main() {
+vec2 center = vec2(0.5, 0.5);
+vec2 off_center = v_text - center;
+
+off_center *= 1.0 + 0.8 * pow(abs(off_center.yx), vec2(3));
+
+vec2 v_text2 = center+off_center;
+
+if (v_text2.x > 1.0 || v_text2.x < 0.0 ||
+    v_text2.y > 1.0 || v_text2.y < 0.0){
+    color=vec4(0.0, 0.0, 0.0, 1.0);
+} else {
+    color = vec4(texture(Texture, v_text2).rgb, 1.0);
+    float fv = fract((v_text2.y+0.05*current_time) * float(textureSize(Texture,0).y)*0.08);
+    fv=min(1.0, 0.8+0.5*min(fv, 1.0-fv));
+    color.rgb*=fv;
+}
+}
+'''
+
+class ScreenEffects():
+    """
+    Full screen effects of the current frame kept as values, the GPU pass chain (PostProcess)
+    draws them instead of the level compositing full screen surfaces on the CPU.
+
+    Attributes:
+        darkness (int): Darkness subtracted from the screen (0-255).
+        lights (list): (left, top, size) on screen of the light textures cutting the darkness.
+        circles (list): (radius, color, inside) screen centered circles, the inside (or outside)
+            is filled with color, in drawing order.
+
+    Methods:
+        add_light(topleft, size): Adds a light for the current frame.
+        add_circle(radius, color, inside): Adds a transition circle for the current frame.
+        clear(): Forgets the effects of the frame.
+    """
+    def __init__(self):
+        self.clear()
+
+    def add_light(self, topleft, size):
+        self.lights.append((topleft[0], topleft[1], size))
+
+    def add_circle(self, radius, color, inside):
+        self.circles.append((radius, pygame.Color(color), inside))
+
+    def clear(self):
+        self.darkness = 0
+        self.lights = []
+        self.circles = []
+
+class HudSurface(pygame.Surface):
+    """
+    Transparent surface of the hud in CRT mode. It is cleared and drawn again every frame, and it remembers
+    what was blitted on it, so only the areas that changed since the last frame are uploaded.
+    An image blitted on it must not be drawn on afterwards, a changed widget is drawn into a new image.
+
+    Attributes:
+        blits (list): (image, dest, area, special_flags, rect) blitted since the last clear().
+        last_blits (list): Blits of the last frame, their images are kept so no new image can take their id.
+
+    Methods:
+        blit(source, dest, area, special_flags): Blits the image and remembers it.
+        clear(): Starts a frame: makes the surface transparent and keeps the blits of the last frame.
+        damage(): Returns the rects that changed since the last frame, an empty list if none did.
+    """
+    def __init__(self, size):
+        super().__init__(size, pygame.SRCALPHA)
+        self.blits = []
+        self.last_blits = []
+
+    def blit(self, source, dest, area = None, special_flags = 0):
+        rect = super().blit(source, dest, area, special_flags)
+        self.blits.append((source, tuple(dest)[:2], area, special_flags, rect))
+        return rect
+
+    def clear(self):
+        self.fill((0,0,0,0))
+        self.last_blits = self.blits
+        self.blits = []
+
+    def damage(self):
+        last = self.last_blits
+        if (len(last)==len(self.blits)
+            and all(a[0] is b[0] and a[1:]==b[1:] for a, b in zip(last, self.blits))): return []
+        #the areas drawn now, and the areas drawn last frame that may be cleared now
+        return list({tuple(blit[-1]) for blit in last+self.blits})
+
+class PixelStream():
+    """
+    Uploads pixels to a texture through a ring of pixel buffer objects. A buffer is orphaned before
+    it is filled, so the driver hands out fresh memory instead of making the CPU wait until the GPU
+    is done with the previous frame.
+
+    Attributes:
+        texture (Texture): Uploaded texture.
+        buffers (list): Ring of pixel buffers.
+        index (int): Next buffer of the ring.
+
+    Methods:
+        write(data, viewport): Uploads the pixels (top row first) of the whole texture, or of a viewport (x, y, w, h).
+    """
+    def __init__(self, ctx, texture, count = UPLOAD_BUFFERS):
+        self.texture = texture
+        size = texture.width*texture.height*texture.components
+        self.buffers = [ctx.buffer(reserve = size) for _ in range(count)]
+        self.index = 0
+
+    def write(self, data, viewport = None):
+        buffer = self.buffers[self.index]
+        self.index = (self.index+1)%len(self.buffers)
+        buffer.orphan(len(data))
+        buffer.write(data)
+        self.texture.write(buffer, viewport)
+
+class PostProcess():
+    """
+    moderngl pass chain of the CRT mode: the screen and the hud surfaces are uploaded,
+    the light pass cuts every light out of the darkness in one instanced draw (cost follows the lit area,
+    not the number of lights), the effects pass applies the darkness, the hud and the transitions
+    into an offscreen texture, then the CRT pass draws that texture to the window.
+
+    Attributes:
+        ctx (Context): moderngl context.
+        size (tuple): Size of the screen surface.
+        effects (ScreenEffects): Effects of the current frame, filled by the level.
+        screen_texture, hud_texture, light_texture (Texture): Uploaded inputs.
+        screen_stream, hud_stream (PixelStream): Uploads of the screen and hud surfaces.
+        hud_uploaded (bool): Whether the whole hud was uploaded once, after that only its damage is.
+        upload_ms (float): Time spent uploading the surfaces in the last frame.
+        upload_bytes (int): Bytes uploaded in the last frame.
+        upload_history (deque): upload_ms of the last frames.
+        darkness (Framebuffer): Output of the light pass.
+        target (Framebuffer): Output of the effects pass, input of the CRT pass.
+        light_buffer (Buffer): Lights of the frame, one instance each.
+        light_prog, effects_prog, crt_prog (Program): Shaders of the passes.
+        light_vao, effects_vao, crt_vao (VertexArray): Geometry of the passes.
+
+    Methods:
+        upload(screen, hud, dirty): Uploads the surfaces, only the dirty rects of the screen if given
+            and only the damage of the hud (HudSurface).
+        upload_rects(stream, surface, rects, format): Uploads the rects of the surface, returns the bytes uploaded.
+        render(screen, hud, time, output, dirty): Runs the passes on the screen and hud surfaces, output is the window by default.
+            dirty (menus): rects of the screen changed since the last frame, None uploads the whole screen.
+        stats(): Returns the last and the average upload time.
+    """
+    def __init__(self, ctx, size, light_image):
+        self.ctx = ctx
+        self.size = size
+        self.effects = ScreenEffects()
+
+        self.screen_texture = ctx.texture(size, 3)
+        self.hud_texture = ctx.texture(size, 4)
+        self.light_texture = ctx.texture(light_image.get_size(), 4, pygame.image.tobytes(light_image, 'RGBA'))
+        for texture in (self.screen_texture, self.hud_texture, self.light_texture):
+            texture.repeat_x = False
+            texture.repeat_y = False
+        self.screen_stream = PixelStream(ctx, self.screen_texture)
+        self.hud_stream = PixelStream(ctx, self.hud_texture)
+        self.hud_uploaded = False
+        self.upload_ms = 0
+        self.upload_bytes = 0
+        self.upload_history = deque(maxlen = FPS*2)
+        self.darkness = ctx.framebuffer(color_attachments = [ctx.texture(size, 4)])
+        self.target = ctx.framebuffer(color_attachments = [ctx.texture(size, 3)])
+        self.target.color_attachments[0].repeat_x = False
+        self.target.color_attachments[0].repeat_y = False
+
+        self.light_prog = ctx.program(vertex_shader = LIGHT_VERTEX_SHADER, fragment_shader = LIGHT_SHADER)
+        self.light_prog['screen_size'] = size
+        self.effects_prog = ctx.program(vertex_shader = VERTEX_SHADER, fragment_shader = EFFECTS_SHADER)
+        self.effects_prog['Texture'] = 0
+        self.effects_prog['Hud'] = 1
+        self.effects_prog['Darkness'] = 2
+        self.effects_prog['screen_size'] = size
+        self.crt_prog = ctx.program(vertex_shader = VERTEX_SHADER, fragment_shader = CRT_SHADER)
+
+        world_coordinates = [-1, -1,  1, -1,
+                            -1,  1,  1,  1]
+        render_indices = [0, 1, 2,
+                        1, 2, 3]
+        vbo = ctx.buffer(struct.pack('8f', *world_coordinates))
+        ibo = ctx.buffer(struct.pack('6I', *render_indices))
+        #the surfaces are uploaded top row first, the effects pass keeps that order in its target
+        effects_uv = ctx.buffer(struct.pack('8f', 0, 0,  1, 0,  0, 1,  1, 1))
+        crt_uv = ctx.buffer(struct.pack('8f', 0, 1,  1, 1,  0, 0,  1, 0))
+        self.effects_vao = ctx.vertex_array(self.effects_prog, [(vbo, '2f', 'vert'), (effects_uv, '2f', 'in_text')], ibo)
+        self.crt_vao = ctx.vertex_array(self.crt_prog, [(vbo, '2f', 'vert'), (crt_uv, '2f', 'in_text')], ibo)
+        corners = ctx.buffer(struct.pack('8f', 0, 0,  1, 0,  0, 1,  1, 1))
+        self.light_buffer = ctx.buffer(reserve = 64*12)
+        self.light_vao = ctx.vertex_array(self.light_prog, [(corners, '2f', 'corner'), (self.light_buffer, '3f/i', 'light')])
+
+    def render_darkness(self):
+        effects = self.effects
+        self.darkness.use()
+        self.darkness.clear(effects.darkness/255)
+        if (effects.darkness<=0 or not effects.lights): return
+        lights = np.array(effects.lights, 'f4').tobytes()
+        if (len(lights)>self.light_buffer.size): self.light_buffer.orphan(len(lights))
+        self.light_buffer.write(lights)
+        self.light_texture.use(0)
+        #darkness *= 1-alpha of each light
+        self.ctx.enable(moderngl.BLEND)
+        self.ctx.blend_func = moderngl.ZERO, moderngl.ONE_MINUS_SRC_ALPHA
+        self.light_vao.render(moderngl.TRIANGLE_STRIP, vertices = 4, instances = len(effects.lights))
+        self.ctx.disable(moderngl.BLEND)
+
+    def write_effects(self):
+        effects = self.effects
+        prog = self.effects_prog
+        circles = np.zeros((MAX_CIRCLES, 2), 'f4')
+        colors = np.zeros((MAX_CIRCLES, 3), 'f4')
+        count = min(len(effects.circles), MAX_CIRCLES)
+        for i, (radius, color, inside) in enumerate(effects.circles[:count]):
+            circles[i] = (radius, inside)
+            colors[i] = (color.r/255, color.g/255, color.b/255)
+        prog['circle_count'] = count
+        prog['circles'].write(circles.tobytes())
+        prog['circle_colors'].write(colors.tobytes())
+        effects.clear()
+
+    def upload(self, screen, hud, dirty = None):
+        start = perf_counter()
+        self.upload_bytes = 0
+        if (dirty==None):
+            data = memoryview(screen.get_view('1')).cast('B')
+            self.screen_stream.write(data)
+            self.upload_bytes += len(data)
+        else:
+            self.upload_bytes += self.upload_rects(self.screen_stream, screen, dirty, 'RGB')
+        if (not self.hud_uploaded):
+            data = pygame.image.tobytes(hud, 'RGBA')
+            self.hud_stream.write(data)
+            self.upload_bytes += len(data)
+            self.hud_uploaded = True
+        else:
+            self.upload_bytes += self.upload_rects(self.hud_stream, hud, hud.damage(), 'RGBA')
+        end = perf_counter()
+        system.profiler.record('upload', start, end)
+        self.upload_ms = (end-start)*1000
+        self.upload_history.append(self.upload_ms)
+
+    def upload_rects(self, stream, surface, rects, format):
+        uploaded = 0
+        bounds = surface.get_rect()
+        for rect in rects:
+            rect = bounds.clip(rect)
+            if (rect.width==0 or rect.height==0): continue
+            data = pygame.image.tobytes(surface.subsurface(rect), format)
+            stream.write(data, tuple(rect))
+            uploaded += len(data)
+        return uploaded
+
+    def stats(self):
+        average = sum(self.upload_history)/len(self.upload_history) if self.upload_history else 0
+        return {'upload_ms': self.upload_ms, 'upload_avg_ms': average, 'upload_bytes': self.upload_bytes}
+
+    def render(self, screen, hud, time, output = None, dirty = None):
+        if (output==None): output = self.ctx.screen
+        self.upload(screen, hud, dirty)
+        self.render_darkness()
+        self.write_effects()
+
+        self.target.use()
+        self.screen_texture.use(0)
+        self.hud_texture.use(1)
+        self.darkness.color_attachments[0].use(2)
+        self.effects_vao.render()
+
+        output.use()
+        self.ctx.clear(14/255,40/255,66/255)
+        self.crt_prog['current_time'] = time
+        self.target.color_attachments[0].use(0)
+        self.crt_vao.render()
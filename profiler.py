@@ -0,0 +1,105 @@
+import pygame
+from settings import *
+import json
+from collections import deque
+from time import perf_counter
+
+class FrameProfiler():
+    """
+    Times the phases of each frame and the update of each sprite class while enabled,
+    shows the averages in an overlay and exports the recorded frames as a Chrome trace (chrome://tracing).
+    Disabled, record() returns at once and nothing else runs, so it stays in release builds.
+
+    Attributes:
+        enabled (bool): Recording and showing the overlay, toggled in game by F3 (game.py).
+        events (deque): Chrome trace events of the last frames.
+        origin (float): perf_counter() of the trace time 0.
+        frame_start (float): perf_counter() at the start of the current frame.
+        frame (dict): Name -> seconds recorded in the current frame.
+        averages (dict): Name -> smoothed ms per frame.
+        counts (dict): Sprite class -> number of sprites updated in the last frame.
+        font (Font): Font of the overlay, loaded when first shown.
+
+    Methods:
+        toggle(): Enables or disables the profiler.
+        begin_frame(): Starts a frame.
+        record(name, start, end, category): Records a phase that ran from start to end (perf_counter()).
+        record_classes(start, totals): Records the update time of each sprite class, totals: name -> (seconds, count).
+        end_frame(): Ends the frame and updates the averages.
+        draw(screen): Draws the overlay.
+        export(path): Writes the recorded events as a Chrome trace JSON file.
+    """
+    def __init__(self, max_events = PROFILER_MAX_EVENTS):
+        self.enabled = False
+        self.events = deque(maxlen = max_events)
+        self.origin = perf_counter()
+        self.frame_start = self.origin
+        self.frame = {}
+        self.averages = {}
+        self.counts = {}
+        self.font = None
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.averages = {}
+
+    def begin_frame(self):
+        if (not self.enabled): return
+        self.frame_start = perf_counter()
+        self.frame = {}
+
+    def event(self, name, start, seconds, category, tid = 0, args = None):
+        event = {'name': name, 'cat': category, 'ph': 'X', 'pid': 0, 'tid': tid,
+            'ts': (start-self.origin)*10**6, 'dur': seconds*10**6}
+        if (args!=None): event['args'] = args
+        self.events.append(event)
+
+    def record(self, name, start, end, category = 'phase'):
+        if (not self.enabled): return
+        self.event(name, start, end-start, category)
+        self.frame[name] = self.frame.get(name, 0)+end-start
+
+    def record_classes(self, start, totals):
+        if (not self.enabled): return
+        #one event per class, laid one after another from the start of the update (tid 1)
+        for name, (seconds, count) in sorted(totals.items()):
+            self.event(name, start, seconds, 'class', 1, {'count': count})
+            start += seconds
+            self.frame['class '+name] = seconds
+        self.counts = {name: count for name, (seconds, count) in totals.items()}
+
+    def end_frame(self):
+        if (not self.enabled): return
+        end = perf_counter()
+        self.event('frame', self.frame_start, end-self.frame_start, 'frame')
+        self.frame['frame'] = end-self.frame_start
+        for name in set(self.averages)|set(self.frame):
+            ms = self.frame.get(name, 0)*1000
+            self.averages[name] = self.averages.get(name, ms)*0.9+ms*0.1
+
+    def draw(self, screen):
+        if (not self.enabled or not self.averages): return
+        if (self.font==None): self.font = pygame.font.Font(FONT_PATH, 14)
+        averages = self.averages
+        frame = averages.get('frame', 0)
+        lines = [f'frame {frame:6.2f} ms  {1000/max(frame, 0.001):5.0f} fps']
+        lines += [f'{name:<12}{ms:6.2f}' for name, ms in averages.items()
+            if name!='frame' and not name.startswith('class ')]
+        classes = sorted((ms, name[6:]) for name, ms in averages.items() if name.startswith('class '))
+        for ms, name in classes[::-1][:8]:
+            lines.append(f'{name[:12]:<12}{ms:6.2f} x{self.counts.get(name, 0)}')
+        images = [self.font.render(line, False, 'white') for line in lines]
+        width = max(image.get_width() for image in images)+10
+        height = sum(image.get_height() for image in images)+10
+        left = screen.get_width()-width-10
+        background = pygame.Surface((width, height), pygame.SRCALPHA)
+        background.fill((0, 0, 0, 160))
+        screen.blit(background, (left, 10))
+        y = 15
+        for image in images:
+            screen.blit(image, (left+5, y))
+            y += image.get_height()
+
+    def export(self, path):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}, f)
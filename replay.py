@@ -0,0 +1,125 @@
+import pygame
+from settings import *
+import system
+import gzip
+import json
+import random
+import hashlib
+import numpy as np
+from time import perf_counter
+from level import LevelSwitcher
+from controls import ScriptedInput
+from timestep import FixedTimestep
+
+#bumped when the file layout changes
+RECORDING_VERSION = 2
+
+def seed_all(seed):
+    "seeds every random generator the game uses (random in bullet.py, numpy.random in enemy.py and horde.py)"
+    random.seed(seed)
+    np.random.seed(seed)
+
+def state_digest(level):
+    "hash of the game state a replay must reproduce: player, enemies, horde and the clock"
+    state = [type(level).__name__, system.time]
+    player = getattr(level, 'player', None)
+    if (player!=None):
+        state += [tuple(player.hitbox), player.health]
+        state += [(type(enemy).__name__, tuple(enemy.hitbox), enemy.current_health, enemy.is_dead) for enemy in level.enemies]
+    horde = getattr(level, 'horde', None)
+    if (horde!=None): state.append(horde.pos[:horde.count].tobytes())
+    return hashlib.sha1(repr(state).encode()).hexdigest()
+
+class Recording():
+    """
+    Seed and per frame input of a game run, saved as gzipped JSON.
+    A frame is [frame time, mouse_scroll, held keys, mouse position, mouse buttons],
+    the last three are null when they didn't change since the previous frame.
+
+    Attributes:
+        seed (int): Seed of the random generators at the start of the run.
+        frames (list): Encoded frames.
+        digest (str): state_digest() at the end of the run, None if unknown.
+        last (list): Last held keys, position and buttons added, for the delta encoding.
+
+    Methods:
+        add(frame_time, scroll, controls): Appends the real seconds of the previous frame and the input a frame read.
+        inputs(): Yields (frame_time, scroll, held, pos, buttons) of each frame.
+        save(path): Writes the recording.
+        load(path): Reads a recording (static).
+    """
+    def __init__(self, seed, frames = None, digest = None):
+        self.seed = seed
+        self.frames = frames if frames!=None else []
+        self.digest = digest
+        self.last = [None, None, None]
+
+    def add(self, frame_time, scroll, controls):
+        frame = [frame_time, scroll]
+        current = [sorted(controls.held), list(controls.pos), [int(button) for button in controls.buttons]]
+        for i, value in enumerate(current):
+            frame.append(value if value!=self.last[i] else None)
+        self.last = current
+        self.frames.append(frame)
+
+    def inputs(self):
+        held, pos, buttons = [], (0, 0), (False, False, False)
+        for frame_time, scroll, new_held, new_pos, new_buttons in self.frames:
+            if (new_held!=None): held = new_held
+            if (new_pos!=None): pos = new_pos
+            if (new_buttons!=None): buttons = [bool(button) for button in new_buttons]
+            yield frame_time, scroll, held, pos, buttons
+
+    def save(self, path):
+        data = {'version': RECORDING_VERSION, 'seed': self.seed, 'digest': self.digest, 'frames': self.frames}
+        with gzip.open(path, 'wt') as f:
+            json.dump(data, f, separators = (',', ':'))
+
+    @staticmethod
+    def load(path):
+        with gzip.open(path, 'rt') as f:
+            data = json.load(f)
+        assert data['version']==RECORDING_VERSION, f"Unsupported recording version: {data['version']}"
+        return Recording(data['seed'], data['frames'], data['digest'])
+
+class Replay(LevelSwitcher):
+    """
+    Runs a Recording headlessly as fast as possible, switching levels like Game does.
+    system must be set up headless first (benchmark.init_headless()).
+
+    Attributes:
+        recording (Recording): Input to play.
+        level: Current level or menu.
+        current_level (int): Index of the current level, -1 for the menu.
+        is_run (bool): False once the recording asked to exit.
+        timestep (FixedTimestep): Steps of the recorded frames, same as Game.
+        frame_times (list): Seconds of each frame (steps and render).
+
+    Methods:
+        level_index(level), preload_level(level), go_to_level(level): From LevelSwitcher, same as Game.
+        run(): Plays every frame and returns state_digest() of the end state.
+    """
+    def __init__(self, recording):
+        self.recording = recording
+        self.is_run = True
+        self.frame_times = []
+        self.timestep = FixedTimestep()
+        system.controls = ScriptedInput()
+        system.time = 0
+        system.delta_time = 0
+        system.mouse_scroll = 0
+        seed_all(recording.seed)
+        self.start_menu()
+
+    def run(self):
+        for frame_time, scroll, held, pos, buttons in self.recording.inputs():
+            if (not self.is_run): break
+            system.mouse_scroll = scroll
+            system.controls.set(held, pos, buttons)
+            system.profiler.begin_frame()
+            system.screen.fill('black')
+            start = perf_counter()
+            self.timestep.run(self, frame_time)
+            self.frame_times.append(perf_counter()-start)
+            system.profiler.end_frame()
+        return state_digest(self.level)
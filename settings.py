@@ -7,11 +7,44 @@ RED = ( 255, 0, 0)
 
 
 FPS      = 60
+#fixed simulation step (timestep.py), rendering interpolates between steps
+SIMULATION_STEP = 1/FPS
+MAX_STEPS_PER_FRAME = 5
 TILESIZE = 64
 
 SHOW_BULLETLINE = True
+#killed projectiles kept per class for reuse (bullet.py)
+PROJECTILE_POOL_SIZE = 256
+
+#bake visible tile layers into chunks of TILE_CHUNK_SIZE x TILE_CHUNK_SIZE tiles
+STATIC_TILE_CHUNKS = True
+TILE_CHUNK_SIZE = 16
+
+#memory cap of the camera's scaled image cache (bytes)
+SCALED_CACHE_MAX_BYTES = 64*1024*1024
+
+#enemies path find toward the player up to this many tiles
+FLOW_FIELD_RADIUS = 24
+
+#simulate the enemies of the map as one NumPy horde (horde.py)
+HORDE_MODE = False
+
+#world size (px) of the light around each light source (light.py)
+PLAYER_LIGHT_SIZE = 1000
+EXPLOSION_LIGHT_SIZE = 600
+FLAME_LIGHT_SIZE = 160
+
+#particles of each kind (particle.py), a new one replaces the oldest past it
+PARTICLE_CAPACITY = 32768
+
+#frame profiler (profiler.py): F3 shows it, F4 writes the trace of the last frames to PROFILER_TRACE_PATH
+PROFILER_TRACE_PATH = 'profile_trace.json'
+PROFILER_MAX_EVENTS = 100000
 
 PATH = 'oop/'
+FONT_PATH = PATH + 'font/slkscr.ttf'
+#rendered strings kept by ui.Font.render (LRU)
+TEXT_CACHE_SIZE = 256
 
 WORLD_MAP = [
 ['x','x','x','x','x','x','x','x','x','x','x','x','x','x','x','x','x','x','x','x'],
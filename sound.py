@@ -12,7 +12,8 @@ pygame.mixer.set_num_channels(64)
 class Playlist:
     def __init__(self, path):
         self.path = path
-        self.sounds = file.import_playlist(path)
+        #decoded once per path, the Sound objects are shared
+        self.sounds = file.assets.get(('playlist', path), lambda: file.import_playlist(path))
     
     def play(self):
         random.choice(self.sounds).play()
\ No newline at end of file
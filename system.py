@@ -1,4 +1,6 @@
 # from level import YSortCameraGroup
+from controls import LiveInput
+from profiler import FrameProfiler
 
 # from pygame import math
 delta_time = 0
@@ -8,5 +10,16 @@ camera = None
 level = None
 screen = None
 go_to_level = None
+preload_level = None
+#CRT mode: the hud is drawn on its own surface and the full screen effects are done on the GPU (post.py)
+hud_screen = None
+post_effects = None
+
+#keyboard and mouse (controls.py), replaced by a ScriptedInput in headless runs
+controls = LiveInput()
+#headless runs don't load the background music
+play_music = True
+#per phase and per sprite class frame times (profiler.py), F3 shows them
+profiler = FrameProfiler()
 
 debug = None
\ No newline at end of file
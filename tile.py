@@ -1,9 +1,108 @@
 import pygame 
 from settings import *
+from time import sleep
 
 class Tile(pygame.sprite.Sprite):
+	is_static = True #never moves, see RenderOrder
+
+	def __init__(self,pos,groups,image,zindex = 0):
+		super().__init__(groups)
+		self.image = image
+		self.rect = self.image.get_rect(topleft = pos)
+		self.zindex = zindex
+
+class TileChunk(pygame.sprite.Sprite):
+	"""
+	One tile row of a baked static chunk.
+
+	The chunk is baked once, each row is a view (subsurface) of it so dynamic
+	sprites with the same zindex are still y-sorted against the tiles.
+
+	Attributes:
+		image (Surface): Subsurface of the baked chunk for this row.
+		rect (Rect): World position and size of the row.
+		zindex (int): Rendering layer of the row.
+		scaled_size (tuple): Size of the cached scaled image.
+		scaled_image (Surface): Cached scaled image for the current zoom.
+
+	Methods:
+		get_scaled_image(size): Returns the image scaled to size, re-scaled only when size changes.
+	"""
+	is_static = True
+
 	def __init__(self,pos,groups,image,zindex = 0):
 		super().__init__(groups)
 		self.image = image
 		self.rect = self.image.get_rect(topleft = pos)
-		self.zindex = zindex
\ No newline at end of file
+		self.zindex = zindex
+		self.scaled_size = None
+		self.scaled_image = None
+
+	def get_scaled_image(self, size):
+		if (self.scaled_size!=size): #zoom changed
+			self.scaled_size = size
+			self.scaled_image = pygame.transform.scale(self.image,size)
+		return self.scaled_image
+
+class StaticTileLayer():
+	"""
+	Bakes every tile of one visible layer (zindex) into cached chunk surfaces.
+
+	Attributes:
+		groups (list): Groups the baked rows are added to.
+		zindex (int): Rendering layer of the tiles.
+		chunk_size (int): Side length of a chunk, in tiles.
+		tiles (dict): (col, row) -> tile image, cleared after baking.
+		chunks (dict): (chunk_col, chunk_row) -> baked chunk surface.
+		sprites (list): TileChunk rows of all chunks.
+
+	Methods:
+		add(col, row, image): Adds a tile to the layer.
+		bake(baked): Blits the tiles into chunk surfaces (bake_chunks) and creates the TileChunk rows.
+	"""
+	def __init__(self, groups, zindex = 0, chunk_size = TILE_CHUNK_SIZE):
+		self.groups = groups
+		self.zindex = zindex
+		self.chunk_size = chunk_size
+		self.tiles = {}
+		self.chunks = {}
+		self.sprites = []
+
+	def add(self, col, row, image):
+		self.tiles[(col,row)] = image
+
+	def bake(self, baked = None):
+		"baked: result of bake_chunks for the same tiles if already made (preloader worker)"
+		if (baked==None): baked = bake_chunks(self.tiles, self.chunk_size)
+		n = self.chunk_size
+		for (chunk_col,chunk_row), (surface, spans) in baked.items():
+			self.chunks[(chunk_col,chunk_row)] = surface
+			chunk_pos = pygame.math.Vector2(chunk_col,chunk_row)*n*TILESIZE
+			for row, (left, right) in spans.items():
+				rect = pygame.Rect(left*TILESIZE,row*TILESIZE,(right-left+1)*TILESIZE,TILESIZE)
+				sprite = TileChunk(chunk_pos+rect.topleft,self.groups,surface.subsurface(rect),self.zindex)
+				self.sprites.append(sprite)
+		self.tiles = {}
+		return self.sprites
+
+def bake_chunks(tiles, chunk_size = TILE_CHUNK_SIZE, on_worker = False):
+	"""blits (col, row) -> image tiles into chunk surfaces,
+	returns (chunk_col, chunk_row) -> (surface, occupied columns of each row: row -> [left, right])"""
+	n = chunk_size
+	chunk_tiles = {}
+	for (col,row), image in tiles.items():
+		chunk_tiles.setdefault((col//n,row//n),[]).append((col%n,row%n,image))
+
+	baked = {}
+	for chunk, tiles in chunk_tiles.items():
+		surface = pygame.Surface((n*TILESIZE,n*TILESIZE),pygame.SRCALPHA)
+		spans = {}
+		for col, row, image in tiles:
+			surface.blit(image,(col*TILESIZE,row*TILESIZE))
+			span = spans.setdefault(row,[col,col])
+			span[0] = min(span[0],col)
+			span[1] = max(span[1],col)
+		baked[chunk] = (surface, spans)
+		#blits hold the GIL, let the main thread run
+		if (on_worker): sleep(0.001)
+	return baked
@@ -0,0 +1,49 @@
+from settings import *
+import system
+
+class FixedTimestep():
+    """
+    Turns the real time of the rendered frames into simulation steps of a fixed length,
+    so gameplay doesn't depend on the frame rate: a slow frame runs several steps,
+    a fast one may run none and only renders, interpolating between the last two steps.
+
+    Attributes:
+        step (float): Simulated seconds per step (system.delta_time during a step).
+        max_steps (int): Steps run per frame at most, the time beyond is dropped (the game slows down
+            instead of falling further behind).
+        accumulator (float): Real time not simulated yet.
+        alpha (float): Fraction of a step between the last simulated state and the rendered time.
+
+    Methods:
+        advance(frame_time): Adds the real time of a frame, returns the number of steps to run.
+        run(game, frame_time): Runs the steps of a frame on game.level, then renders it.
+    """
+    def __init__(self, step = SIMULATION_STEP, max_steps = MAX_STEPS_PER_FRAME):
+        self.step = step
+        self.max_steps = max_steps
+        self.accumulator = 0
+        self.alpha = 1
+
+    def advance(self, frame_time):
+        self.accumulator += frame_time
+        steps = int(self.accumulator/self.step)
+        if (steps>self.max_steps):
+            steps = self.max_steps
+            self.accumulator = self.step*steps
+        self.accumulator -= self.step*steps
+        self.alpha = self.accumulator/self.step
+        return steps
+
+    def run(self, game, frame_time):
+        "game: object holding the current level (Game, Replay), go_to_level may replace it during a step"
+        level = game.level
+        steps = self.advance(frame_time)
+        system.delta_time = self.step
+        for _ in range(steps):
+            level.step()
+            system.time += self.step
+            #the new level starts stepping next frame
+            if (game.level is not level): break
+        #render animations (ui) follow the simulated time
+        system.delta_time = self.step*steps
+        level.render(self.alpha)
@@ -1,6 +1,8 @@
 import pygame
 from settings import *
 import system
+import file
+from collections import OrderedDict
 
 class UI():
     """
@@ -18,7 +20,8 @@ class UI():
         draw_sprite(sprite): Draws a given sprite on the screen.
     """
     def __init__(self, player):
-        self.screen = system.screen
+        #own surface in CRT mode, drawn over the darkness by the GPU
+        self.screen = system.hud_screen if system.hud_screen!=None else system.screen
         self.hp_bar = HealthBar(player)
         self.stability_bar = StabilityBar(player)
         self.slot_bar = SlotBar(player)
@@ -46,13 +49,23 @@ class UI():
 
 class UI_Object():
     """
-    Base class for UI objects, providing common methods for drawing on the screen.
+    Base class for retained UI widgets: a widget is drawn once into its own image,
+    and only drawn again when the values it shows (get_state()) change.
+    The drawing methods take screen positions and draw into the image, its colors are
+    premultiplied by alpha so layers composite over each other like on the screen.
 
     Attributes:
         screen (Surface): The screen where the UI object is drawn.
         player (Player): The player object associated with this UI object.
+        rect (Rect): Area of the screen covered by the widget image, set by the subclass.
+        image (Surface): Widget drawn for state, created again when the state changes.
+        state: Values the image was drawn for.
 
     Methods:
+        get_state(): Returns the values shown by the widget (subclass).
+        redraw(): Draws the widget for self.state into the new image (subclass).
+        display(): Redraws the image if the state changed, then blits it.
+        local(pos): Converts a screen position to a position in the image.
         rect_to_surf(rect, color): Creates a surface with the given rect size and color.
         apply_mask(surf, mask, pos): Applies a mask to a surface at a given position.
         draw_rect(color, rect): Draws a rectangle of the given color and size.
@@ -60,8 +73,29 @@ class UI_Object():
         blit(image, pos): Draws an image on the screen at a given position.
     """
     def __init__(self, player):
-        self.screen = system.screen   
+        self.screen = system.hud_screen if system.hud_screen!=None else system.screen
         self.player = player
+        self.rect = None
+        self.image = None
+        self.state = None
+
+    def get_state(self):
+        return None
+
+    def redraw(self):
+        pass
+
+    def display(self):
+        state = self.get_state()
+        if (self.image==None or state!=self.state):
+            #a new image, the hud (post.HudSurface) only uploads images it did not show last frame
+            self.image = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+            self.state = state
+            self.redraw()
+        self.screen.blit(self.image, self.rect, special_flags = pygame.BLEND_PREMULTIPLIED)
+
+    def local(self, pos):
+        return (pos[0]-self.rect.left, pos[1]-self.rect.top)
     
     def rect_to_surf(self, rect, color):
         s = pygame.Surface(rect.size, pygame.SRCALPHA)
@@ -71,10 +105,13 @@ class UI_Object():
     def apply_mask(self, surf, mask, pos = (0,0)):
         surf.blit(mask,pos,None,pygame.BLEND_RGBA_MULT)
 
+    def premultiply(self, color):
+        r, g, b, a = pygame.Color(color)
+        return (r*a//255, g*a//255, b*a//255, a)
+
     def draw_rect(self, color, rect):
-        s = pygame.Surface(rect.size, pygame.SRCALPHA)
-        s.fill(color)
-        self.screen.blit(s,rect.topleft)
+        s = self.rect_to_surf(rect, self.premultiply(color))
+        self.image.blit(s, self.local(rect.topleft), special_flags = pygame.BLEND_PREMULTIPLIED)
 
     def draw_parallelogram(self, color, rect: pygame.Rect):
         "rect -> parallelogram. width += height"
@@ -86,13 +123,15 @@ class UI_Object():
         p4 = pygame.math.Vector2(rect.bottomleft)-rect.topleft
         p1.x += height
         p2.x += height
+        #drawn with alpha on a surface that is blitted with that alpha again
+        if (len(color)>3): color = (*color[:3], color[3]*color[3]//255)
         surface = pygame.Surface((rect.size[0]+height,rect.size[1]), pygame.SRCALPHA)
-        pygame.draw.polygon(surface, color, [p1,p2,p3,p4])
-        if (len(color)>3): surface.set_alpha(color[3])
-        self.screen.blit(surface, rect.topleft)
+        pygame.draw.polygon(surface, self.premultiply(color), [p1,p2,p3,p4])
+        self.image.blit(surface, self.local(rect.topleft), special_flags = pygame.BLEND_PREMULTIPLIED)
     
     def blit(self, image, pos):
-        self.screen.blit(image,pos)
+        if (not image.get_flags() & pygame.SRCALPHA): image = image.convert_alpha()
+        self.image.blit(image.premul_alpha(), self.local(pos), special_flags = pygame.BLEND_PREMULTIPLIED)
 
 
 class HealthBar(UI_Object):
@@ -115,8 +154,8 @@ class HealthBar(UI_Object):
         hp_mask_right (Surface): Mask for the right side of the health bar.
 
     Methods:
-        show_bar(current, max_amount, bg_rect, color): Displays the health bar with the current health.
-        display(): Renders the health bar on the screen.
+        get_state(): Moves the drain toward the health, returns the bar and drain widths and the bar color.
+        redraw(): Draws the health bar.
     """
     def __init__(self, player):
         super().__init__(player)
@@ -129,43 +168,47 @@ class HealthBar(UI_Object):
 
         #init bar
         self.health_bar_rect = pygame.Rect(30,50,self.HEALTH_BAR_WIDTH,self.HEALTH_BAR_HEIGHT)
+        self.rect = self.health_bar_rect.inflate(self.HEALTH_BAR_HEIGHT, 0)
+        self.rect.left = self.health_bar_rect.left
         self.current_drain = 0
         self.drain_speed = 3 #1/x second to hp
         self.DRAIN_COLOR = (255,255,255,255)
 
         self.path = PATH + 'graphics/ui/'
-        self.hp_mask_left = pygame.image.load(self.path+'hp_bar_mask_left.png').convert_alpha()
-        self.hp_mask_right = pygame.image.load(self.path+'hp_bar_mask_right.png').convert_alpha()
-
-    def show_bar(self,current, max_amount, bg_rect, color):
-        #bg
-        self.draw_parallelogram(self.BAR_BG_COLOR, bg_rect)
-
-        ratio = current/max_amount
+        self.hp_mask_left = file.import_image(self.path+'hp_bar_mask_left.png')
+        self.hp_mask_right = file.import_image(self.path+'hp_bar_mask_right.png')
 
+    def get_state(self):
+        player = self.player
+        ratio = player.health/player.max_health
         self.current_drain = max(self.current_drain, ratio)
         dx = (self.current_drain-ratio)*system.delta_time*self.drain_speed
         self.current_drain -= dx
-        drain_width = self.current_drain*bg_rect.width
+
+        color = self.HP_BAR_COLOR_LOW
+        if (ratio>0.6):
+            color = self.HP_BAR_COLOR_HIGH
+        elif (ratio>0.3): 
+            color = self.HP_BAR_COLOR_MEDIUM
+        #in pixels (rounded like Rect), the drain stops redrawing when it is less than a pixel away
+        width = self.health_bar_rect.width
+        return int(ratio*width+0.5), int(self.current_drain*width+0.5), color
+
+    def redraw(self):
+        current_width, drain_width, color = self.state
+        bg_rect = self.health_bar_rect
+        #bg
+        self.draw_parallelogram(self.BAR_BG_COLOR, bg_rect)
+
         drain_rect = bg_rect.copy()
         drain_rect.width = drain_width
         self.draw_parallelogram(self.DRAIN_COLOR, drain_rect)
 
         #current bar
-        current_width = ratio*bg_rect.width
         current_rect = bg_rect.copy()
         current_rect.width = current_width
-        color = self.HP_BAR_COLOR_LOW
-        if (ratio>0.6):
-            color = self.HP_BAR_COLOR_HIGH
-        elif (ratio>0.3): 
-            color = self.HP_BAR_COLOR_MEDIUM
         self.draw_parallelogram(color, current_rect)
 
-    def display(self):
-        player = self.player
-        self.show_bar(player.health, player.max_health, self.health_bar_rect, "dmm")
-
 class StabilityBar(UI_Object):
     """
     Represents a stability bar for displaying the player's weapon stability.
@@ -179,8 +222,8 @@ class StabilityBar(UI_Object):
         bar_rect (Rect): Rectangular area representing the stability bar.
 
     Methods:
-        show_bar(current, max_amount, bg_rect, min_amount): Displays the stability bar with the current stability.
-        display(): Renders the stability bar on the screen.
+        get_state(): Returns the bar width and whether the stability is low.
+        redraw(): Draws the stability bar.
     """
     def __init__(self, player):
         super().__init__(player)
@@ -192,26 +235,25 @@ class StabilityBar(UI_Object):
 
         #init bar
         self.bar_rect = pygame.Rect(30,50+20,self.BAR_WIDTH,self.BAR_HEIGHT)
+        self.rect = pygame.Rect(self.bar_rect.topleft, (self.BAR_WIDTH+self.BAR_HEIGHT, self.BAR_HEIGHT))
+
+    def get_state(self):
+        weapon = self.player.current_weapon
+        if (not weapon): return 0, False
+        return int(weapon.stability/weapon.max_stability*self.bar_rect.width+0.5), weapon.stability<weapon.min_stability
 
-    def show_bar(self,current, max_amount, bg_rect, min_amount):
+    def redraw(self):
+        current_width, is_low = self.state
+        bg_rect = self.bar_rect
         #bg
         self.draw_parallelogram(self.BAR_BG_COLOR, bg_rect)
 
         #current bar
-        current_width = current/max_amount*bg_rect.width
         current_rect = bg_rect.copy()
         current_rect.width = current_width
-        color = self.BAR_COLOR_LOW if current<min_amount else self.BAR_COLOR_HIGH
+        color = self.BAR_COLOR_LOW if is_low else self.BAR_COLOR_HIGH
         self.draw_parallelogram(color, current_rect)
 
-    def display(self):
-        player = self.player
-        if (player.current_weapon): 
-            weapon = player.current_weapon
-            self.show_bar(weapon.stability, weapon.max_stability, self.bar_rect, weapon.min_stability)  
-        else: 
-            self.show_bar(0, 100, self.bar_rect, 0)  
-
 class Text:
     """
     Represents a text object for rendering text on the screen.
@@ -224,7 +266,7 @@ class Text:
         None
     """
     def __init__(self, text, size, color = "Red", center = None, topleft = None):
-        self.image = Font.get_font(size).render(text, False, color)
+        self.image = Font.render(text, size, color)
         if (center!=None):
             self.rect = self.image.get_rect(center = center)
         elif (topleft!=None):
@@ -233,14 +275,40 @@ class Text:
 
 class Font:
     """
-    Provides a method for retrieving fonts.
+    Pool of the loaded fonts and LRU cache of the rendered strings,
+    a string is only rendered again when it changed or was evicted.
+    Rendered surfaces are shared, they must not be drawn on.
+
+    Attributes:
+        fonts (dict): (path, size) -> font, each file and size is loaded once.
+        texts (OrderedDict): (path, size, text, color, antialias) -> rendered surface, least recently used first.
+        max_texts (int): Number of rendered strings kept.
 
     Methods:
-        get_font(size): Returns a font object with the given size.
+        get_font(size, path): Returns the font object with the given size.
+        render(text, size, color, antialias, path): Returns the rendered string, from the cache if it was rendered before.
     """
-    def get_font(size):
-        path = PATH + 'font/slkscr.ttf'
-        return pygame.font.Font(path, size)
+    fonts = {}
+    texts = OrderedDict()
+    max_texts = TEXT_CACHE_SIZE
+
+    def get_font(size, path = FONT_PATH):
+        font = Font.fonts.get((path, size))
+        if (font==None):
+            font = Font.fonts[(path, size)] = pygame.font.Font(path, size)
+        return font
+
+    def render(text, size, color = "White", antialias = False, path = FONT_PATH):
+        #"white", "White" and (255,255,255) are the same entry
+        key = (path, size, text, tuple(pygame.Color(color)), antialias)
+        texts = Font.texts
+        image = texts.get(key)
+        if (image!=None):
+            texts.move_to_end(key)
+            return image
+        image = texts[key] = Font.get_font(size, path).render(text, antialias, color)
+        if (len(texts)>Font.max_texts): texts.popitem(last = False)
+        return image
     
 class SlotBar(UI_Object):
     """
@@ -262,8 +330,8 @@ class SlotBar(UI_Object):
         primary_slot_image (Surface): Image for the primary slot frame.
 
     Methods:
-        display_slot(): Displays the inventory slots on the screen.
-        display(): Renders the slot bar on the screen.
+        get_state(): Returns the primary slot and the avatar and quantity of each item.
+        redraw(): Draws the inventory slots.
     """
     def __init__(self, player):
         super().__init__(player)
@@ -289,7 +357,15 @@ class SlotBar(UI_Object):
         sub_img.fill((255,255,255,255))
         self.primary_slot_image.blit(sub_img,pos, special_flags = pygame.BLEND_RGBA_SUB)    
 
-    def display_slot(self):
+        frame = self.primary_frame_thickness
+        self.rect = pygame.Rect(self.topleft_pos-(frame,frame),
+            (9*(self.slot_side_length+self.slot_spacing)-self.slot_spacing+2*frame, self.slot_side_length+2*frame))
+
+    def get_state(self):
+        items = tuple((item.avatar, item.food.quantity if hasattr(item,'food') else None) for item in self.inventory)
+        return self.player.current_primary, items
+
+    def redraw(self):
         for slot in range(9):
             #bg
             pos = self.topleft_pos.copy()
@@ -315,9 +391,6 @@ class SlotBar(UI_Object):
                     num_text = Text(str(item.food.quantity), 15, "white", topleft = pos)
                     self.blit(num_text.image, pos)
 
-    def display(self):
-        self.display_slot()
-
 class Button:
     """
     Represents a button in the UI.
@@ -328,10 +401,12 @@ class Button:
         base_color (tuple): Base color of the button text.
         hovering_color (tuple): Color of the button text when hovered.
         text_input (str): Text displayed on the button.
-        text (Surface): Rendered text surface.
+        text (Surface): Rendered text surface, base_text or hovering_text.
+        base_text, hovering_text (Surface): Text rendered in each color once.
         rect (Rect): Rectangular area representing the button.
         text_rect (Rect): Rectangular area representing the button text.
         is_available (bool): Whether the button is available for interaction.
+        is_hovering (bool): Whether the mouse was over the button at the last update.
 
     Methods:
         update(screen): Updates the button display on the screen.
@@ -345,7 +420,9 @@ class Button:
         self.font = font
         self.base_color, self.hovering_color = base_color, hovering_color
         self.text_input = text_input
-        self.text = self.font.render(self.text_input, True, self.base_color)
+        self.base_text = self.font.render(self.text_input, True, self.base_color)
+        self.hovering_text = self.font.render(self.text_input, True, self.hovering_color)
+        self.text = self.base_text
         #image -> bg 1 color -> none 
         if self.image is None:
             if bg_color is None:
@@ -356,9 +433,10 @@ class Button:
         self.rect = self.image.get_rect(center=center)
         self.text_rect = self.text.get_rect(center=center)
         self.is_available = True
+        self.is_hovering = False
 
     def update(self, screen):
-        mouse = pygame.mouse.get_pos()
+        mouse = system.controls.mouse_pos()
         self.changeColor(mouse)
         if self.image is not None:
             screen.blit(self.image, self.rect)
@@ -374,7 +452,8 @@ class Button:
         self.is_available = False
 
     def changeColor(self, position):
-        if position[0] in range(self.rect.left, self.rect.right) and position[1] in range(self.rect.top, self.rect.bottom):
-            self.text = self.font.render(self.text_input, True, self.hovering_color)
+        self.is_hovering = position[0] in range(self.rect.left, self.rect.right) and position[1] in range(self.rect.top, self.rect.bottom)
+        if self.is_hovering:
+            self.text = self.hovering_text
         else:
-            self.text = self.font.render(self.text_input, True, self.base_color)
+            self.text = self.base_text
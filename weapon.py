@@ -4,6 +4,7 @@ import system
 from math import acos, pi, atan2, exp2
 import json
 from sound import Playlist
+import file
 
 dirname_to_weapon_shift = [
     pygame.math.Vector2(0,-25),
@@ -50,9 +51,13 @@ class Weapon(pygame.sprite.Sprite):
         is_reloading (bool): Flag indicating if the weapon is currently reloading.
         reloading_time (float): Time taken for reloading.
         reloading_current_time (float): Current time during reloading.
+        bullet_image (Surface): Projectile image, loaded once and shared by every shot.
+        bullet_rotations (dict): Angle bucket -> rotated bullet_image, shared by every weapon of the same image.
+        bullet_angle_step (float): Size of an angle bucket in degree.
 
     Methods:
         read_info(path): Reads weapon information from a JSON file.
+        get_bullet_image(angle): Returns bullet_image rotated to the angle bucket of angle.
         weapon_rotate(angle): Rotates the weapon image by a given angle.
         update_transform(): Updates the position and rotation of the weapon.
         reload(): Reloads the weapon.
@@ -73,7 +78,7 @@ class Weapon(pygame.sprite.Sprite):
         self.type = type
         self.path = PATH + 'graphics/weapon/'+ self.name + '/'
         sprite_path = self.path+ 'sprite/0.png' 
-        self.original_image = pygame.image.load(sprite_path).convert_alpha()
+        self.original_image = file.import_image(sprite_path)
         self.image = self.original_image
         
         self.rect = self.image.get_rect()
@@ -107,7 +112,7 @@ class Weapon(pygame.sprite.Sprite):
         self.read_info(info_path)
 
         self.shoot_sounds = Playlist(self.path+'shoot_playlist/')
-        self.reloading_sound = pygame.mixer.Sound(self.path+'reloading.wav')
+        self.reloading_sound = file.import_sound(self.path+'reloading.wav')
     
     def read_info(self,path):
         f = open(path, "r")
@@ -134,7 +139,22 @@ class Weapon(pygame.sprite.Sprite):
         self.total_ammo = data["total_ammo"]
         self.reloading_time = data["reloading_time"]
 
+        #projectile images, read once instead of on every shot
+        bullet_path = self.path + 'bullet/0.png'
+        self.bullet_image = file.import_image(bullet_path)
+        self.bullet_rotations = file.assets.get(('rotations', bullet_path), dict)
+        self.bullet_angle_step = 1
+
         return data
+
+    def get_bullet_image(self, angle):
+        "angle in degree, world coor"
+        bucket = round(angle/self.bullet_angle_step)%round(360/self.bullet_angle_step)
+        image = self.bullet_rotations.get(bucket)
+        if (image==None):
+            image = pygame.transform.rotate(self.bullet_image,-bucket*self.bullet_angle_step) #is on screen
+            self.bullet_rotations[bucket] = image
+        return image
     
     def weapon_rotate(self, angle):
         self.image = pygame.transform.rotate(self.original_image,angle)
@@ -262,9 +282,16 @@ class FlameThrower(Weapon):
 
     Attributes:
         max_stability: The maximum stability of the flamethrower.
+        flamesmoke_image: Smoke image with the start alpha, made once and shared by every smoke.
+        flame_frames (dict): Size -> flame image of that size, tinted for the lifetime left at that size.
+        flamesmoke_frames (dict): Size -> smoke image of that size, with the alpha of the lifetime left at that size.
 
     Methods:
         read_info(path): Reads additional information specific to the flamethrower from a JSON file.
+        alpha_copy(image, alpha): Returns a copy of a shared image with a surface alpha.
+        bake_frames(start_size, end_size, render): Renders one frame per integer size of a growing projectile.
+        render_flame(size, left): Returns the flame image of a size, left: lifetime ratio left (1 to 0).
+        render_flamesmoke(size, left): Returns the smoke image of a size.
         shoot(): Fires flames from the flamethrower.
     """
     def __init__(self,player,groups, name, zindex = 0):
@@ -284,6 +311,45 @@ class FlameThrower(Weapon):
         self.flamesmoke_lifetime = data["flamesmoke_lifetime"]
         self.flamesmoke_start_alpha = data["flamesmoke_start_alpha"]
         self.flamesmoke_end_alpha = data["flamesmoke_end_alpha"]
+        #a copy with the start alpha, the imported image is shared and must not be modified in place
+        smoke_path = self.path + 'flamesmoke/0.png'
+        self.flamesmoke_image = file.assets.get(('flamesmoke image', smoke_path, self.flamesmoke_start_alpha),
+            lambda: self.alpha_copy(file.import_image(smoke_path), self.flamesmoke_start_alpha))
+
+        #animations baked once per weapon kind, the projectiles index them by their size (bullet.py)
+        self.flame_frames = file.assets.get(('flame frames', self.path),
+            lambda: self.bake_frames(self.bullet_start_size, self.bullet_end_size, self.render_flame))
+        self.flamesmoke_frames = file.assets.get(('flamesmoke frames', self.path),
+            lambda: self.bake_frames(self.flamesmoke_start_size, self.flamesmoke_end_size, self.render_flamesmoke))
+
+    def alpha_copy(self, image, alpha):
+        image = image.copy()
+        image.set_alpha(alpha)
+        return image
+
+    def bake_frames(self, start_size, end_size, render):
+        "the size grows linearly over the lifetime, scaling to it truncates so each integer size is one frame"
+        frames = {}
+        low, high = sorted((int(start_size), int(end_size)))
+        for size in range(low, high+1):
+            left = 1-(size-start_size)/(end_size-start_size) if end_size!=start_size else 1
+            frames[size] = render(size, min(max(left, 0), 1))
+        return frames
+
+    def render_flame(self, size, left):
+        #more black with age, the flame is round so it is not rotated
+        image = self.bullet_image.copy()
+        colored_image = pygame.Surface(image.get_size(),pygame.SRCALPHA)
+        color_add = left*120
+        colored_image.fill((color_add,color_add,color_add,0))
+        image.blit(colored_image, (0,0), special_flags = pygame.BLEND_RGBA_ADD)
+        return pygame.transform.scale(image,(size,size))
+
+    def render_flamesmoke(self, size, left):
+        image = pygame.transform.scale(self.flamesmoke_image,(size,size))
+        alpha = max((self.flamesmoke_end_alpha-self.flamesmoke_start_alpha)*left+self.flamesmoke_start_alpha,0)
+        image.set_alpha(alpha)
+        return image
 
     def shoot(self):
         if (self.current_shooting_cooldown>0): return
@@ -308,7 +374,7 @@ class MissileLaucher(Weapon):
     """
     def __init__(self,player,groups, name, zindex = 0):
         super().__init__(player,groups, name, 'missile_laucher', zindex)
-        self.explode_sound = pygame.mixer.Sound(self.path+'explode.wav')
+        self.explode_sound = file.import_sound(self.path+'explode.wav')
 
     def shoot(self):
         if (self.current_shooting_cooldown>0): return